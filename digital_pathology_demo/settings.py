@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import json
 import os
 from pathlib import Path
 from django.core.management.utils import get_random_secret_key
@@ -96,16 +97,70 @@ WSGI_APPLICATION = 'digital_pathology_demo.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'database' / 'db.sqlite3',
-    }
+# SQLite unless DJANGO_DB_ENGINE is 'postgresql', configured from the POSTGRES_* variables
+DJANGO_DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'sqlite')
+# Seconds each worker thread keeps its connection open across requests; 0 reconnects on every request
+DJANGO_DB_CONN_MAX_AGE = int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 60))
+
+# Applied on every SQLite connection. WAL lets readers run alongside the one writer instead of blocking on it,
+# synchronous=NORMAL only syncs at checkpoints (safe under WAL), busy_timeout makes a writer wait for the lock
+# rather than fail with "database is locked", and mmap serves reads from the page cache without copying
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 20_000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
 }
 
+if DJANGO_DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'plip'),
+            'USER': os.environ.get('POSTGRES_USER', 'plip'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DJANGO_DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'database' / 'db.sqlite3',
+            'CONN_MAX_AGE': DJANGO_DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': ';'.join(f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()),
+                # Take the write lock at BEGIN: a deferred transaction that reads first and then writes cannot wait
+                # on busy_timeout when it finds the lock taken, and fails straight away
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
 # Auth User settings
 AUTH_USER_MODEL = 'authentication.User'
 
+# The PLIP result cache lives in the database so every gunicorn worker and the job worker share it;
+# create its table with `manage.py createcachetable`. Entries are culled once MAX_ENTRIES is reached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'plip_results': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'plip_result_cache',
+        'TIMEOUT': int(os.environ.get('PLIP_RESULT_CACHE_TIMEOUT', 30 * 24 * 3600)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('PLIP_RESULT_CACHE_MAX_ENTRIES', 100_000)),
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -143,6 +198,13 @@ USE_TZ = True
 STATIC_URL = '/staticfiles/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    # Image thumbnails named by md5, see PLIP_THUMBNAIL_DIR
+    'plip_thumbnails': {'BACKEND': 'image_classifier.services.thumbnails.ContentAddressedStorage'},
+}
+
 # URL Redirects
 LOGIN_URL = 'login'
 LOGOUT_REDIRECT_URL = 'login'
@@ -189,6 +251,79 @@ SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True
 }
 
+# PLIP classifier settings
+# 'full' serves classification; 'browse' only serves the data browser, list API and admin and never imports torch
+PLIP_DEPLOYMENT_ROLE = os.environ.get('PLIP_DEPLOYMENT_ROLE', 'full')
+# Inference precision: fp32, bf16 (autocast) or int8 (dynamic quantization of the linear layers)
+PLIP_PRECISION = os.environ.get('PLIP_PRECISION', 'fp32')
+# Model registry: name -> {"path": hub id or local checkpoint dir, "revision": ..., "precision": ...}
+PLIP_MODELS = json.loads(os.environ.get('PLIP_MODELS', '{"plip": {"path": "vinid/plip", "revision": "main"}}'))
+PLIP_DEFAULT_MODEL = os.environ.get('PLIP_DEFAULT_MODEL', 'plip')
+# Loaded models are evicted least recently used first over this budget, and non-default ones when idle
+PLIP_MODEL_MEMORY_BUDGET_MB = int(os.environ.get('PLIP_MODEL_MEMORY_BUDGET_MB', 2048))
+PLIP_MODEL_IDLE_SECONDS = int(os.environ.get('PLIP_MODEL_IDLE_SECONDS', 3600))
+# Manifest written by the plip_models command; every process polls it and hot swaps changed models
+PLIP_MODEL_MANIFEST = os.environ.get('PLIP_MODEL_MANIFEST', str(BASE_DIR / 'database' / 'plip_models.json'))
+PLIP_MODEL_MANIFEST_POLL_SECONDS = float(os.environ.get('PLIP_MODEL_MANIFEST_POLL_SECONDS', 5))
+# Number of normalized label text embeddings kept in each process's LRU cache
+PLIP_TEXT_EMBEDDING_CACHE_SIZE = int(os.environ.get('PLIP_TEXT_EMBEDDING_CACHE_SIZE', 1024))
+# Storage dtype of persisted per-image embeddings (float16 or float32)
+PLIP_EMBEDDING_DTYPE = os.environ.get('PLIP_EMBEDDING_DTYPE', 'float16')
+# Append-only memory-mapped embedding matrices for similarity search, one directory per model
+PLIP_VECTOR_DIR = os.environ.get('PLIP_VECTOR_DIR', str(BASE_DIR / 'database' / 'vectors'))
+PLIP_VECTOR_DTYPE = os.environ.get('PLIP_VECTOR_DTYPE', 'float16')
+# 'ivf' scans the PLIP_SIMILARITY_NPROBE nearest inverted lists once build_similarity_index has run, 'exact' every row
+PLIP_SIMILARITY_METHOD = os.environ.get('PLIP_SIMILARITY_METHOD', 'ivf')
+PLIP_SIMILARITY_NPROBE = int(os.environ.get('PLIP_SIMILARITY_NPROBE', 8))
+# Free-text search ranks at most this many images, paged through in the API and data browser
+PLIP_TEXT_SEARCH_MAX_RESULTS = int(os.environ.get('PLIP_TEXT_SEARCH_MAX_RESULTS', 200))
+# Cache alias holding (image md5, label list, model) -> prediction results shared across workers
+PLIP_RESULT_CACHE = 'plip_results'
+
+# Label predicates a single list or data browser filter may combine
+PLIP_FILTER_MAX_PREDICATES = int(os.environ.get('PLIP_FILTER_MAX_PREDICATES', 32))
+# Seconds a list total is reused for the same filters when counts are requested as 'cached' or 'approximate'
+PLIP_LIST_COUNT_CACHE_SECONDS = int(os.environ.get('PLIP_LIST_COUNT_CACHE_SECONDS', 300))
+# Seconds an analytics summary is reused for the same date range, bucket and label; 0 reads the tables every time
+PLIP_ANALYTICS_CACHE_SECONDS = int(os.environ.get('PLIP_ANALYTICS_CACHE_SECONDS', 60))
+# Submissions an export reads per query, each with one query for their scores; bounds the export's memory
+PLIP_EXPORT_CHUNK_SIZE = int(os.environ.get('PLIP_EXPORT_CHUNK_SIZE', 2000))
+
+PLIP_THUMBNAIL_DIR = os.environ.get('PLIP_THUMBNAIL_DIR', str(BASE_DIR / 'database' / 'thumbnails'))
+# Internal nginx location mapped onto PLIP_THUMBNAIL_DIR; when empty Django streams thumbnails itself
+PLIP_THUMBNAIL_ACCEL_PREFIX = os.environ.get('PLIP_THUMBNAIL_ACCEL_PREFIX', '')
+PLIP_THUMBNAIL_MAX_AGE = int(os.environ.get('PLIP_THUMBNAIL_MAX_AGE', 365 * 24 * 3600))
+# Uploads whose header reports more pixels than this are rejected before decoding
+PLIP_MAX_IMAGE_PIXELS = int(os.environ.get('PLIP_MAX_IMAGE_PIXELS', 50_000_000))
+# Micro-batching of concurrent uploads into one vision forward pass
+PLIP_BATCH_MAX_SIZE = int(os.environ.get('PLIP_BATCH_MAX_SIZE', 8))
+PLIP_BATCH_MAX_WAIT_MS = float(os.environ.get('PLIP_BATCH_MAX_WAIT_MS', 5))
+# Limits for multi-file and archive uploads to /api/v1/plipbatch/. Files are read and classified 32 at a time, so a
+# batch holds at most about 32 * PLIP_BATCH_MAX_MEMBER_BYTES of file contents in memory. The member limit also caps
+# uploads queued as jobs, which are held in the database until a worker classifies them
+PLIP_BATCH_MAX_FILES = int(os.environ.get('PLIP_BATCH_MAX_FILES', 500))
+PLIP_BATCH_MAX_MEMBER_BYTES = int(os.environ.get('PLIP_BATCH_MAX_MEMBER_BYTES', 25 * 1024 * 1024))
+DATA_UPLOAD_MAX_NUMBER_FILES = PLIP_BATCH_MAX_FILES
+# Tiled large-image classification; larger JPEGs are decoded at reduced scale to stay under the pixel budget, with
+# tiles still covering PLIP_TILE_SIZE original pixels at the reduced resolution reported in the response
+PLIP_TILE_SIZE = int(os.environ.get('PLIP_TILE_SIZE', 224))
+PLIP_TILE_BATCH_SIZE = int(os.environ.get('PLIP_TILE_BATCH_SIZE', 32))
+PLIP_TILE_MAX_DECODE_PIXELS = int(os.environ.get('PLIP_TILE_MAX_DECODE_PIXELS', 36_000_000))
+# Asynchronous jobs; long-polls stay below the gunicorn timeout
+PLIP_JOB_BATCH_SIZE = int(os.environ.get('PLIP_JOB_BATCH_SIZE', 16))
+PLIP_JOB_MAX_WAIT_SECONDS = float(os.environ.get('PLIP_JOB_MAX_WAIT_SECONDS', 20))
+PLIP_JOB_POLL_INTERVAL = 0.5
+PLIP_JOB_STALE_SECONDS = int(os.environ.get('PLIP_JOB_STALE_SECONDS', 600))
+PLIP_JOB_MAX_ATTEMPTS = 3
+# Seconds before a job is retried after the inference server was busy or unreachable
+PLIP_JOB_RETRY_SECONDS = int(os.environ.get('PLIP_JOB_RETRY_SECONDS', 30))
+# 'local' loads the model in every process, 'remote' uses the shared inference server over a Unix socket
+PLIP_INFERENCE_BACKEND = os.environ.get('PLIP_INFERENCE_BACKEND', 'local')
+PLIP_INFERENCE_SOCKET = os.environ.get('PLIP_INFERENCE_SOCKET', '/run/plip/inference.sock')
+PLIP_INFERENCE_TIMEOUT = float(os.environ.get('PLIP_INFERENCE_TIMEOUT', 25))
+PLIP_INFERENCE_MAX_PENDING = int(os.environ.get('PLIP_INFERENCE_MAX_PENDING', 32))
+PLIP_INFERENCE_QUEUE_TIMEOUT = float(os.environ.get('PLIP_INFERENCE_QUEUE_TIMEOUT', 10))
+
 # Django CSP settings
 # certain htmx triggers need UNSAFE_EVAL
 # drf-spectacular UIs need UNSAFE_INLINE
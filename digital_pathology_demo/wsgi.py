@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'digital_pathology_demo.settings')
 
 application = get_wsgi_application()
+
+# Load the classifier per worker before the first request; a no-op for browse-only and remote-backend workers
+from image_classifier.services.inference import warm_up  # noqa: E402
+
+warm_up()
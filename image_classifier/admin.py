@@ -11,24 +11,20 @@ class PLIPImageAdmin(admin.ModelAdmin):
 
     def image_preview(self, obj):
         """
-        Converts the binary blob into base64 encoded thumbnail.
+        Links the thumbnail through the authorized thumbnail URL rather than inlining it.
         """
-        if obj.blob_image:
-            base64_data = obj.image_base64
-
-            # Return HTML img tag for rendering in admin screen
-            return mark_safe(
-                f'<img src="data:image/jpeg;base64,{base64_data}"'
-                f'style="width: 100px; height: auto; border-radius: 4px;" />'
-            )
-        return "No Image"
+        # Return HTML img tag for rendering in admin screen
+        return mark_safe(
+            f'<img src="{obj.thumbnail_url}" loading="lazy"'
+            f'style="width: 100px; height: auto; border-radius: 4px;" />'
+        )
 
     image_preview.short_description = 'Thumbnail'
 
 
 @admin.register(PLIPSubmission)
 class PLIPSubmissionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'filename', 'user', 'created_at')
+    list_display = ('id', 'filename', 'user', 'predicted_label', 'predicted_score', 'created_at')
     search_fields = ('id', 'filename')
 
 
@@ -1,12 +1,24 @@
-from django.urls import path
+from django.urls import path, re_path
 from rest_framework.permissions import IsAuthenticated
 from drf_spectacular.views import SpectacularSwaggerView, SpectacularAPIView
-from .api_views import PLIPAPIListView, PLIPAPICreateView
+from .api_views import (PLIPAPIListView, PLIPAPICreateView, PLIPAPIBatchCreateView, PLIPAPITiledCreateView,
+                        PLIPAPIReclassifyView, PLIPAPIJobCreateView, PLIPAPIJobStatusView, PLIPAPISimilarView,
+                        PLIPAPITextSearchView, PLIPAPIAnalyticsView, PLIPAPIExportView, PLIPThumbnailView)
 
 
 urlpatterns = [
     path('pliplist/', PLIPAPIListView.as_view(), name='plip-list'),
     path('plipinput/', PLIPAPICreateView.as_view(), name='plip-input'),
+    path('plipbatch/', PLIPAPIBatchCreateView.as_view(), name='plip-batch'),
+    path('pliptiled/', PLIPAPITiledCreateView.as_view(), name='plip-tiled'),
+    path('plipreclassify/', PLIPAPIReclassifyView.as_view(), name='plip-reclassify'),
+    path('plipsimilar/', PLIPAPISimilarView.as_view(), name='plip-similar'),
+    path('pliptextsearch/', PLIPAPITextSearchView.as_view(), name='plip-text-search'),
+    path('plipjobs/', PLIPAPIJobCreateView.as_view(), name='plip-job-create'),
+    path('plipjobs/<int:pk>/', PLIPAPIJobStatusView.as_view(), name='plip-job-status'),
+    path('plipexport/', PLIPAPIExportView.as_view(), name='plip-export'),
+    path('plipanalytics/', PLIPAPIAnalyticsView.as_view(), name='plip-analytics'),
+    re_path(r'^thumbnails/(?P<md5>[0-9a-f]{32})/$', PLIPThumbnailView.as_view(), name='plip-thumbnail'),
     path('schema/', SpectacularAPIView.as_view(permission_classes=(IsAuthenticated, )), name='schema'),
     path('schema/swagger-ui/',
          SpectacularSwaggerView.as_view(url_name='schema', permission_classes=(IsAuthenticated, )), name='swagger-ui'),
@@ -1,24 +1,67 @@
 import hashlib
 import io
+import time
+from itertools import chain
 
 from PIL import Image
 
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
 
 from rest_framework import generics, status
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
 
 from authentication.permissions import IsContributor
-from .models import PLIPSubmission, PLIPImage, PLIPLabel, PLIPScore
-from .serializers.plip_serializers import PLIPAPIListInputSerializer, PLIPAPICreateSerializer, PLIPSubmissionSerializer
-from .services.plip import PLIPClassifier
+from .models import PLIPImage, PLIPSubmission, PLIPTile, PLIPTileMap, PLIPJob
+from .serializers.plip_serializers import (PLIPAPIListInputSerializer, PLIPAPICreateSerializer,
+                                          PLIPAPIBatchCreateSerializer, PLIPAPIBatchResponseSerializer,
+                                          PLIPAPITiledCreateSerializer, PLIPAPITiledResultSerializer,
+                                          PLIPAPIReclassifySerializer, PLIPSubmissionSerializer, PLIPJobSerializer,
+                                          PLIPAPISimilarSerializer, PLIPAPISimilarResultSerializer,
+                                          PLIPAPITextSearchSerializer, PLIPAPITextSearchResultSerializer,
+                                          PLIPAPITextSearchPageSerializer,
+                                          PLIPAPIListOptionsSerializer, PLIPAPIListPageSerializer,
+                                          PLIPAPIListPageResultSerializer, PLIPAPIAnalyticsInputSerializer,
+                                          PLIPAPIAnalyticsSerializer, PLIPAPIExportOptionsSerializer)
+from .services.inference import get_classifier, InferenceUnavailable
+from .services.inference_client import InferenceServerBusy
+from .services.scoring import parse_labels
+from .services.embeddings import get_stored_embedding
+from .services.batching import embed_image
+from .services.batch import count_archive_files, iter_archive_files, classify_files
+from .services.decode import decode_upload
+from .services.labels import get_labels
+from .services.ingest import ingest_upload, save_results, upload_md5, embed_upload
+from .services.similarity import find_similar, search_text, latest_submissions
+from .services.tiling import open_for_tiling, classify_tiles, render_class_map, class_map_legend
+from .services.thumbnails import get_thumbnail_storage, thumbnail_name
+from .services.pagination import keyset_page, count_rows
+from .services.filters import list_filter, FilterError
+from .services.analytics import analytics_summary
+from .services.export import CONTENT_TYPES, ExportError, export_submissions
+
+
+def list_options(request) -> dict:
+    """
+    Serializer context for list responses from the fields, scores and thumbnails query parameters.
+    Thumbnails are linked by URL unless inline base64 is asked for, so pages stay small and browsers can cache
+    the images.
+    """
+    options = PLIPAPIListOptionsSerializer(data=request.query_params)
+    options.is_valid(raise_exception=True)
+    return {'request': request, **options.validated_data}
 
 
 class PLIPAPIListView(APIView):
@@ -26,61 +69,114 @@ class PLIPAPIListView(APIView):
     serializer_class = PLIPAPIListInputSerializer
 
     def get_queryset(self):
-        queryset = PLIPSubmission.objects.all()
         serialized_input = self.serializer_class(data=self.request.data)
         serialized_input.is_valid(raise_exception=True)
+        self.filters = serialized_input.validated_data
 
-        min_date = serialized_input.validated_data.get('min_date', None)
-        max_date = serialized_input.validated_data.get('max_date', None)
-        labels = serialized_input.validated_data.get('labels', None)
+        try:
+            return PLIPSubmission.objects.filter(list_filter(self.filters))
+        except FilterError as e:
+            raise ValidationError({'filter': str(e)})
 
-        q_and_objects = Q()
-        q_or_objects = Q()
-        has_label_filters = False
+    @extend_schema(parameters=[PLIPAPIListPageSerializer, PLIPAPIListOptionsSerializer],
+                   responses={200: PLIPAPIListPageResultSerializer})
+    def post(self, request):
+        """
+        Pages through submissions newest first with a cursor, so every page costs the same however deep it is.
+        The total is only counted when asked for with ?count=exact, cached or approximate.
+        """
+        page_options = PLIPAPIListPageSerializer(data=request.query_params)
+        page_options.is_valid(raise_exception=True)
+        context = list_options(request)
 
-        if min_date:
-            q_and_objects &= Q(created_at__gte=min_date)
+        queryset = self.get_queryset()
+        submissions, next_cursor = keyset_page(PLIPSubmissionSerializer.setup_eager_loading(queryset, context),
+                                               page_options.validated_data.get('cursor'), page_size=10)
+
+        output = {
+            'next': replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor) if next_cursor else None,
+            'results': PLIPSubmissionSerializer(submissions, many=True, context=context).data,
+        }
+        count, approximate = count_rows(queryset, page_options.validated_data['count'], self.filters)
+        if count is not None:
+            output.update(count=count, count_approximate=approximate)
+
+        return Response(output, status=status.HTTP_200_OK)
+
+
+class PLIPAPIExportView(PLIPAPIListView):
+    """
+    Streams every submission matching the list view's filters, with its scores, as CSV, JSON lines or Parquet.
+    Submissions are read PLIP_EXPORT_CHUNK_SIZE at a time with one query for their scores, so exports of any
+    size use the same memory. Thumbnails are only included when asked for.
+    """
+
+    @extend_schema(parameters=[PLIPAPIExportOptionsSerializer],
+                   responses={(200, 'text/csv'): OpenApiTypes.STR, (200, 'application/x-ndjson'): OpenApiTypes.STR,
+                              (200, 'application/vnd.apache.parquet'): OpenApiTypes.BINARY})
+    def post(self, request):
+        """
+        Downloads the submissions matching the same body as pliplist, oldest first, as a file of one row per
+        score or, with ?layout=wide, one row per submission and a score column per label.
+        """
+        options = PLIPAPIExportOptionsSerializer(data=request.query_params)
+        options.is_valid(raise_exception=True)
+        data = options.validated_data
 
-        if max_date:
-            q_and_objects &= Q(created_at__lte=max_date)
+        try:
+            columns, content = export_submissions(self.get_queryset(), data['file_format'], data['layout'],
+                                                  data.get('columns'), data['thumbnails'],
+                                                  settings.PLIP_EXPORT_CHUNK_SIZE)
+        except ExportError as e:
+            raise ValidationError({'file_format': str(e)})
 
-        if labels:
-            for obj in labels:
-                q_label_object = Q()
+        response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[data['file_format']])
+        filename = f"plip-export-{time.strftime('%Y%m%d-%H%M%S')}.{data['file_format']}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        # Let nginx pass the rows on as they are written instead of buffering the whole export
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
-                if 'label' in obj:
-                    has_label_filters = True
-                    q_label_object &= Q(submission_scores__label__label__icontains=obj['label'])
 
-                    if 'min' in obj:
-                        q_label_object &= Q(submission_scores__score__gte=obj['min'])
-                    if 'max' in obj:
-                        q_label_object &= Q(submission_scores__score__lte=obj['max'])
+@extend_schema_view(post=extend_schema(responses={201: PLIPSubmissionSerializer}))
+class PLIPAPICreateView(generics.CreateAPIView):
+    permission_classes = (IsAuthenticated, IsContributor)
+    parser_classes = (MultiPartParser, FormParser)
+    serializer_class = PLIPAPICreateSerializer
 
-                q_or_objects |= q_label_object
+    def create(self, request, *args, **kwargs):
+        input_serializer = self.serializer_class(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
+        input_file = input_serializer.validated_data.get('image', None)
+        input_labels = input_serializer.validated_data.get('labels', None)
 
-        # Combine: Dates AND (Label A OR Label B)
-        # Only include or objects if filters are present to avoid potentially appending falsey value or unneeded joins
-        q_final = q_and_objects
-        if has_label_filters:
-            q_final &= q_or_objects
+        try:
+            plip_classifier = get_classifier(input_serializer.validated_data.get('model') or None)
+            result = ingest_upload(input_file, parse_labels(input_labels), plip_classifier)
+            submissions = save_results(self.request.user, [result],
+                                       input_serializer.validated_data.get('expected_label', None), plip_classifier)
 
-        queryset = queryset.filter(q_final).distinct().order_by('-id')
-        return PLIPSubmissionSerializer.setup_eager_loading(queryset)
+            output_serializer = PLIPSubmissionSerializer(submissions[0], context={'request': request})
 
-    @extend_schema(responses={200: PLIPSubmissionSerializer})
-    def post(self, request):
-        queryset = self.get_queryset()
-        page_size = 10
-        paginator = PageNumberPagination()
-        paginator.page_size = page_size
-        result_page = paginator.paginate_queryset(queryset, request)
-        output_serializer = PLIPSubmissionSerializer(result_page, many=True)
+            return Response(output_serializer.data, status=status.HTTP_201_CREATED)
 
-        return paginator.get_paginated_response(output_serializer.data)
+        except InferenceServerBusy as e:
+            return Response({"error": f"Inference server is busy: {str(e)}"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
+        except InferenceUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-class PLIPAPICreateView(generics.CreateAPIView):
+        except Exception as e:
+            return Response({"error": f"Error processing image: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@extend_schema_view(post=extend_schema(responses={202: PLIPJobSerializer}))
+class PLIPAPIJobCreateView(generics.CreateAPIView):
+    """
+    Stores the upload as a queued job and answers 202 Accepted immediately;
+    run_plip_worker classifies it and the status URL reports the resulting submission
+    """
     permission_classes = (IsAuthenticated, IsContributor)
     parser_classes = (MultiPartParser, FormParser)
     serializer_class = PLIPAPICreateSerializer
@@ -89,69 +185,405 @@ class PLIPAPICreateView(generics.CreateAPIView):
         input_serializer = self.serializer_class(data=request.data)
         input_serializer.is_valid(raise_exception=True)
         input_file = input_serializer.validated_data.get('image', None)
-        input_labels = input_serializer.validated_data.get('labels', None)
+
+        # The upload waits in the database until a worker gets to it, so it is held to the archive member limit
+        max_bytes = getattr(settings, 'PLIP_BATCH_MAX_MEMBER_BYTES', 25 * 1024 * 1024)
+        if input_file.size > max_bytes:
+            return Response({"error": f"Uploads queued as jobs may be at most {max_bytes} bytes"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        input_file.seek(0)
+        job = PLIPJob.objects.create(
+            user=self.request.user,
+            filename=input_file.name[:100],
+            upload=input_file.read(),
+            labels=input_serializer.validated_data.get('labels', None) or '',
+            expected_label=input_serializer.validated_data.get('expected_label', None),
+        )
+
+        output_serializer = PLIPJobSerializer(job, context={'request': request})
+        return Response(output_serializer.data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': output_serializer.data['status_url']})
+
+
+class PLIPAPIJobStatusView(generics.RetrieveAPIView):
+    """
+    Reports a job's status and, once done, its submission.
+    Pass ?wait=<seconds> to long-poll until the job finishes or the wait runs out.
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = PLIPJobSerializer
+
+    def get_queryset(self):
+        return PLIPJob.objects.filter(user=self.request.user).defer('upload')
+
+    def get_object(self):
+        job = super().get_object()
 
         try:
-            file_content = input_file.read()
-            md5_checksum = hashlib.md5(file_content).hexdigest()
-            image_bin = io.BytesIO(file_content)
-            pil_img = Image.open(image_bin).convert('RGB')
+            wait = min(float(self.request.query_params.get('wait', 0)), settings.PLIP_JOB_MAX_WAIT_SECONDS)
+        except ValueError:
+            wait = 0
+
+        deadline = time.monotonic() + wait
+        while job.status in (PLIPJob.QUEUED, PLIPJob.RUNNING) and time.monotonic() < deadline:
+            time.sleep(settings.PLIP_JOB_POLL_INTERVAL)
+            job.refresh_from_db(fields=['status', 'submission', 'error', 'started_at', 'finished_at'])
+
+        if job.submission_id:
+            job.submission = (PLIPSubmissionSerializer.setup_eager_loading(PLIPSubmission.objects.all())
+                              .get(id=job.submission_id))
+        return job
+
+
+@extend_schema_view(post=extend_schema(responses={201: PLIPAPIBatchResponseSerializer}))
+class PLIPAPIBatchCreateView(generics.CreateAPIView):
+    """
+    Classifies many image files, or a zip/tar archive of patches, in one request.
+    Images go through batched vision forwards and all submissions are saved in a single transaction;
+    the response lists a submission or an error for every file in upload order.
+    """
+    permission_classes = (IsAuthenticated, IsContributor)
+    parser_classes = (MultiPartParser, FormParser)
+    serializer_class = PLIPAPIBatchCreateSerializer
+
+    def create(self, request, *args, **kwargs):
+        input_serializer = self.serializer_class(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
+        max_files = getattr(settings, 'PLIP_BATCH_MAX_FILES', 500)
 
-            if input_labels:
-                labels = [label.strip() for label in input_labels.split(',')]
+        try:
+            uploads = input_serializer.validated_data.get('images', [])
+            archive = input_serializer.validated_data.get('archive', None)
+            file_count = len(uploads) + (count_archive_files(archive) if archive else 0)
+
+            if not file_count:
+                return Response({"error": "No image files found in upload"}, status=status.HTTP_400_BAD_REQUEST)
+            if file_count > max_files:
+                return Response({"error": f"A batch may contain at most {max_files} images"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            plip_classifier = get_classifier(input_serializer.validated_data.get('model') or None)
+            labels = parse_labels(input_serializer.validated_data.get('labels', None))
+            # Uploads and archive members are read as classify_files() reaches them, one chunk at a time
+            files = chain(((upload.name, upload.read()) for upload in uploads),
+                          iter_archive_files(archive) if archive else ())
+            results = classify_files(files, labels, plip_classifier)
+            submissions = save_results(self.request.user, results,
+                                       input_serializer.validated_data.get('expected_label', None), plip_classifier)
+
+            output = []
+            for index, result in enumerate(results):
+                if index in submissions:
+                    submission_data = PLIPSubmissionSerializer(submissions[index], context={'request': request}).data
+                    output.append({'filename': result['filename'], 'submission': submission_data})
+                else:
+                    output.append({'filename': result['filename'], 'error': result['error']})
+
+            response_status = status.HTTP_201_CREATED if submissions else status.HTTP_400_BAD_REQUEST
+            return Response({'results': output}, status=response_status)
+
+        except InferenceServerBusy as e:
+            return Response({"error": f"Inference server is busy: {str(e)}"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except InferenceUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except Exception as e:
+            return Response({"error": f"Error processing batch: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-            else:
-                labels = ["adipose", "background", "debris", "lymphocytes", "mucus", "smooth muscle",
-                          "normal colon mucosa",
-                          "cancer-associated stroma", "colorectal adenocarcinoma epithelium"]
 
-            plip_classifier = PLIPClassifier()
-            prediction = plip_classifier.predict(pil_img, candidate_labels=labels)
+@extend_schema_view(post=extend_schema(responses={201: PLIPAPITiledResultSerializer}))
+class PLIPAPITiledCreateView(generics.CreateAPIView):
+    """
+    Classifies a large region or slide export tile by tile with bounded memory.
+    Per-tile top predictions are stored with their coordinates, the submission scores are the mean tile scores,
+    and a downsampled class map is returned alongside them.
+    """
+    permission_classes = (IsAuthenticated, IsContributor)
+    parser_classes = (MultiPartParser, FormParser)
+    serializer_class = PLIPAPITiledCreateSerializer
 
-            results_sorted = dict(sorted(prediction['detailed_scores'].items(), key=lambda item: item[1], reverse=True))
+    def create(self, request, *args, **kwargs):
+        input_serializer = self.serializer_class(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
+        input_file = input_serializer.validated_data.get('image', None)
+        tile_size = input_serializer.validated_data.get('tile_size', None) or settings.PLIP_TILE_SIZE
 
+        try:
+            labels = parse_labels(input_serializer.validated_data.get('labels', None))
+
+            md5 = hashlib.md5()
+            for chunk in input_file.chunks():
+                md5.update(chunk)
+
+            plip_classifier = get_classifier(input_serializer.validated_data.get('model') or None)
+            pil_img, scale = open_for_tiling(input_file)
+            tiled = classify_tiles(pil_img, scale, labels, plip_classifier, tile_size=tile_size,
+                                   batch_size=settings.PLIP_TILE_BATCH_SIZE)
+
+            if not tiled['tiles']:
+                return Response({"error": f"Image is smaller than half a {tile_size}px tile"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            # Thumbnail in place rather than through make_thumbnail(), which would copy the full tiling raster
             pil_img.thumbnail((224, 224), Image.Resampling.LANCZOS)
             thumb_buffer = io.BytesIO()
             pil_img.save(thumb_buffer, format="JPEG")
+            del pil_img
+
+            # Tile maps score the mean over tiles, so there is no single image embedding to store
+            result = {'filename': input_file.name, 'md5': md5.hexdigest(), 'image_obj': None,
+                      'thumbnail': thumb_buffer.getvalue(), 'prediction': {'detailed_scores': tiled['detailed_scores']}}
 
             # Execute statements with atomicity to ensure no partial relationships are created
             with transaction.atomic():
-                # Only one instance of an image file is needed, so retrieve based on md5 if it exists, otherwise create
-                image_obj, created = PLIPImage.objects.get_or_create(
-                    md5=md5_checksum,
-                    defaults={"blob_image": thumb_buffer.getvalue()},
+                submission_obj = save_results(self.request.user, [result],
+                                              input_serializer.validated_data.get('expected_label', None),
+                                              plip_classifier)[0]
+
+                tile_map = PLIPTileMap.objects.create(submission=submission_obj, tile_size=tile_size, scale=scale,
+                                                      columns=tiled['grid'].shape[1], rows=tiled['grid'].shape[0],
+                                                      blob_image=render_class_map(tiled['grid']))
+
+                label_objs = get_labels(labels)
+                tiles = PLIPTile.objects.bulk_create(
+                    [PLIPTile(submission=submission_obj, x=tile['x'], y=tile['y'], width=tile['width'],
+                              height=tile['height'], label=label_objs[tile['label']], score=tile['score'])
+                     for tile in tiled['tiles']],
+                    batch_size=1000,
                 )
 
-                # If expected_label is populated, get or create it as a label object
-                expected_label_obj = None
-                expected_label = input_serializer.validated_data.get('expected_label', None)
+            output_serializer = PLIPAPITiledResultSerializer({
+                'submission': submission_obj,
+                'tile_map': tile_map,
+                'legend': class_map_legend(labels),
+                'tiles': tiles,
+            }, context={'request': request})
 
-                if expected_label:
-                    expected_label_obj, created = PLIPLabel.objects.get_or_create(
-                        label=expected_label
-                    )
+            return Response(output_serializer.data, status=status.HTTP_201_CREATED)
 
-                submission_obj = PLIPSubmission.objects.create(filename=input_file.name, image=image_obj,
-                                                               expected_label=expected_label_obj,
-                                                               user=self.request.user)
+        except InferenceServerBusy as e:
+            return Response({"error": f"Inference server is busy: {str(e)}"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-                for key, value in results_sorted.items():
-                    label_obj, created = PLIPLabel.objects.get_or_create(
-                        label=key
-                    )
+        except InferenceUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-                    PLIPScore.objects.create(
-                        label=label_obj,
-                        score=value,
-                        submission=submission_obj,
-                    )
+        except Exception as e:
+            return Response({"error": f"Error processing image: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@extend_schema_view(post=extend_schema(responses={201: PLIPSubmissionSerializer}))
+class PLIPAPIReclassifyView(generics.CreateAPIView):
+    """
+    Re-scores the image of an existing submission against a new label list from its stored embedding,
+    creating a new submission without re-uploading or re-running the vision tower
+    """
+    permission_classes = (IsAuthenticated, IsContributor)
+    serializer_class = PLIPAPIReclassifySerializer
 
-                queryset = PLIPSubmissionSerializer.setup_eager_loading(PLIPSubmission.objects.all())
-                submission_obj = queryset.get(id=submission_obj.id)
+    def create(self, request, *args, **kwargs):
+        input_serializer = self.serializer_class(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
 
-            output_serializer = PLIPSubmissionSerializer(submission_obj)
+        source_submission = get_object_or_404(PLIPSubmission.objects.select_related('image', 'expected_label'),
+                                              id=input_serializer.validated_data['submission'])
+
+        # Keep the original expected label unless the request replaces it
+        if 'expected_label' in input_serializer.validated_data:
+            expected_label = input_serializer.validated_data['expected_label']
+        else:
+            expected_label = getattr(source_submission.expected_label, 'label', None)
+
+        try:
+            labels = parse_labels(input_serializer.validated_data.get('labels', None))
+            plip_classifier = get_classifier(input_serializer.validated_data.get('model') or None)
+            image_obj = source_submission.image
+            result = {'filename': source_submission.filename, 'md5': image_obj.md5, 'image_obj': image_obj}
+
+            stored_embedding = get_stored_embedding(image_obj.md5, plip_classifier)
+
+            if stored_embedding:
+                result['embedding'] = stored_embedding[1]
+                result['embedding_stored'] = True
+
+            else:
+                # Images stored before embeddings were persisted only have their thumbnail left to embed. The
+                # thumbnail stand-in only scores this response; the next full resolution upload stores the embedding
+                result['embedding'] = embed_image(decode_upload(image_obj.thumbnail), plip_classifier)
+                result['embedding_from_thumbnail'] = True
+
+            result['prediction'] = plip_classifier.score_embedding(result['embedding'], labels)
+            submissions = save_results(self.request.user, [result], expected_label, plip_classifier)
+
+            output_serializer = PLIPSubmissionSerializer(submissions[0], context={'request': request})
 
             return Response(output_serializer.data, status=status.HTTP_201_CREATED)
 
+        except InferenceServerBusy as e:
+            return Response({"error": f"Inference server is busy: {str(e)}"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except InferenceUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
         except Exception as e:
             return Response({"error": f"Error processing image: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class PLIPAPISimilarView(APIView):
+    """
+    Finds the stored images most similar to a submission's image or an uploaded image, by cosine similarity
+    of their PLIP image embeddings. Nothing is saved; an upload is only embedded.
+    """
+    permission_classes = (IsAuthenticated,)
+    parser_classes = (MultiPartParser, FormParser)
+    serializer_class = PLIPAPISimilarSerializer
+
+    @extend_schema(request=PLIPAPISimilarSerializer, parameters=[PLIPAPIListOptionsSerializer],
+                   responses={200: PLIPAPISimilarResultSerializer})
+    def post(self, request):
+        input_serializer = self.serializer_class(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
+        data = input_serializer.validated_data
+        context = list_options(request)
+
+        if 'submission' in data:
+            source_submission = get_object_or_404(PLIPSubmission.objects.select_related('image'),
+                                                  id=data['submission'])
+
+        try:
+            plip_classifier = get_classifier(data.get('model') or None)
+
+            if 'submission' in data:
+                image_obj = source_submission.image
+                result = {'md5': image_obj.md5, 'image_obj': image_obj}
+                stored_embedding = get_stored_embedding(image_obj.md5, plip_classifier)
+                if stored_embedding:
+                    result['embedding'] = stored_embedding[1]
+                else:
+                    result['embedding'] = embed_image(decode_upload(image_obj.thumbnail), plip_classifier)
+            else:
+                result = {'md5': upload_md5(data['image']), 'image_obj': None}
+                embed_upload(result, data['image'], plip_classifier)
+
+            # The query image itself is always its own best match
+            exclude = [result['image_obj'].id] if result['image_obj'] is not None else []
+            method = data.get('method') or settings.PLIP_SIMILARITY_METHOD
+            matches = find_similar(plip_classifier, result['embedding'], k=data['k'], method=method,
+                                   nprobe=data.get('nprobe'), exclude=exclude)
+
+            output_serializer = PLIPAPISimilarResultSerializer(
+                {'model': plip_classifier.model_key, 'method': method, 'results': matches}, context=context)
+            return Response(output_serializer.data, status=status.HTTP_200_OK)
+
+        except InferenceServerBusy as e:
+            return Response({"error": f"Inference server is busy: {str(e)}"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except InferenceUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except Exception as e:
+            return Response({"error": f"Error processing image: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class PLIPAPITextSearchView(APIView):
+    """
+    Ranks archived submissions by how well their image matches a free-text query, using PLIP's shared
+    text/image embedding space. Each matching image is represented by its latest submission; pages are read
+    from the top PLIP_TEXT_SEARCH_MAX_RESULTS matches.
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = PLIPAPITextSearchSerializer
+
+    @extend_schema(request=PLIPAPITextSearchSerializer,
+                   parameters=[PLIPAPIListOptionsSerializer,
+                               OpenApiParameter('page', OpenApiTypes.INT, description="Page of ten matches")],
+                   responses={200: PLIPAPITextSearchPageSerializer})
+    def post(self, request):
+        input_serializer = self.serializer_class(data=request.data)
+        input_serializer.is_valid(raise_exception=True)
+        data = input_serializer.validated_data
+        context = list_options(request)
+
+        try:
+            plip_classifier = get_classifier(data.get('model') or None)
+            matches = search_text(plip_classifier, data['query'])
+
+        except InferenceServerBusy as e:
+            return Response({"error": f"Inference server is busy: {str(e)}"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except InferenceUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        except Exception as e:
+            return Response({"error": f"Error searching: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = PageNumberPagination()
+        paginator.page_size = 10
+        result_page = paginator.paginate_queryset(matches, request)
+        results = latest_submissions(result_page,
+                                     PLIPSubmissionSerializer.setup_eager_loading(PLIPSubmission.objects.all(), context))
+        output_serializer = PLIPAPITextSearchResultSerializer(results, many=True, context=context)
+
+        return paginator.get_paginated_response(output_serializer.data)
+
+
+class PLIPAPIAnalyticsView(APIView):
+    """
+    Agreement between PLIP's top predictions and the expected labels users gave: per-label precision and recall,
+    the confusion matrix, and confidence histograms per period. Read from summary tables kept up to date as
+    submissions are saved, so the cost does not grow with the archive.
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = PLIPAPIAnalyticsInputSerializer
+
+    @extend_schema(parameters=[PLIPAPIAnalyticsInputSerializer], responses={200: PLIPAPIAnalyticsSerializer})
+    def get(self, request):
+        input_serializer = self.serializer_class(data=request.query_params)
+        input_serializer.is_valid(raise_exception=True)
+        data = input_serializer.validated_data
+
+        summary = analytics_summary(data.get('start'), data.get('end'), data['bucket'], data.get('label') or None)
+        return Response(PLIPAPIAnalyticsSerializer(summary).data, status=status.HTTP_200_OK)
+
+
+class PLIPThumbnailView(APIView):
+    """
+    Serves the JPEG thumbnail of a stored image by md5 to authenticated users.
+    Thumbnails never change once stored, so the md5 is a strong ETag and responses may be cached privately for
+    PLIP_THUMBNAIL_MAX_AGE. With PLIP_THUMBNAIL_ACCEL_PREFIX set, Django only checks authorization and nginx
+    sends the file from the thumbnail store through X-Accel-Redirect.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    @extend_schema(responses={(200, 'image/jpeg'): OpenApiTypes.BINARY, 304: None})
+    def get(self, request, md5):
+        etag = f'"{md5}"'
+        response = get_conditional_response(request, etag=etag)
+
+        if response is None:
+            name = thumbnail_name(md5)
+            storage = get_thumbnail_storage()
+
+            if storage.exists(name):
+                if settings.PLIP_THUMBNAIL_ACCEL_PREFIX:
+                    response = HttpResponse(content_type='image/jpeg')
+                    response['X-Accel-Redirect'] = settings.PLIP_THUMBNAIL_ACCEL_PREFIX + name
+                else:
+                    response = FileResponse(storage.open(name), content_type='image/jpeg')
+
+            else:
+                # Images move_thumbnails has not reached yet still hold their thumbnail in the database
+                blob = PLIPImage.objects.filter(md5=md5).values_list('blob_image', flat=True).first()
+                if not blob:
+                    raise Http404("No thumbnail for this image")
+                response = HttpResponse(bytes(blob), content_type='image/jpeg')
+
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=settings.PLIP_THUMBNAIL_MAX_AGE, immutable=True)
+        return response
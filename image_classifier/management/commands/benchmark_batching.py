@@ -0,0 +1,70 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from django.core.management.base import BaseCommand
+
+from image_classifier.services.batching import BatchScheduler
+from image_classifier.services.registry import get_registry
+
+
+def load_images(image_dir, count):
+    """Loads up to count RGB images from a folder, or generates random 224px patches if no folder is given"""
+    if image_dir:
+        paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in ('.jpg', '.jpeg', '.png', '.tif'))
+        images = [Image.open(path).convert('RGB') for path in paths[:count]]
+        if images:
+            return images
+
+    rng = np.random.default_rng(0)
+    return [Image.fromarray(rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)) for _ in range(count)]
+
+
+class Command(BaseCommand):
+    help = "Measures PLIP embedding throughput on CPU against micro-batch size and wait window"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-sizes', default='1,2,4,8,16', help="Comma separated max batch sizes")
+        parser.add_argument('--wait-ms', default='0,5,20', help="Comma separated max wait windows in milliseconds")
+        parser.add_argument('--clients', type=int, default=16, help="Concurrent request threads")
+        parser.add_argument('--requests', type=int, default=64, help="Images embedded per configuration")
+        parser.add_argument('--image-dir', default=None, help="Folder of sample patches (random patches if omitted)")
+
+    def handle(self, *args, **options):
+        classifier = get_registry().get()
+        images = load_images(options['image_dir'], options['requests'])
+        requests = [images[i % len(images)] for i in range(options['requests'])]
+
+        # Warm up the vision tower so the first configuration is not charged for lazy initialization
+        classifier.embed_images(images[:2])
+
+        self.stdout.write(f"{'batch':>6} {'wait_ms':>8} {'img/s':>9} {'p50_ms':>9} {'p95_ms':>9} {'batches':>8}")
+
+        for batch_size in [int(value) for value in options['batch_sizes'].split(',')]:
+            for wait_ms in [float(value) for value in options['wait_ms'].split(',')]:
+                batch_count = 0
+
+                def counting_embed(batch):
+                    nonlocal batch_count
+                    batch_count += 1
+                    return classifier.embed_images(batch)
+
+                scheduler = BatchScheduler(counting_embed, max_batch_size=batch_size, max_wait_ms=wait_ms)
+
+                def timed_embed(image):
+                    start = time.perf_counter()
+                    scheduler.embed(image)
+                    return time.perf_counter() - start
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['clients']) as executor:
+                    latencies = sorted(executor.map(timed_embed, requests))
+                elapsed = time.perf_counter() - start
+
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                self.stdout.write(f"{batch_size:>6} {wait_ms:>8g} {len(requests) / elapsed:>9.1f} "
+                                  f"{statistics.median(latencies) * 1000:>9.1f} {p95 * 1000:>9.1f} {batch_count:>8}")
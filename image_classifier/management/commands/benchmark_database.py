@@ -0,0 +1,109 @@
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from authentication.models import User
+from image_classifier.services.ingest import save_results
+from image_classifier.services.result_cache import apply_cached_results
+from image_classifier.services.scoring import make_model_key
+
+
+def fake_upload(labels, rng, thumbnail):
+    """Classification result of a new image, as ingest_upload returns it, without running the model"""
+    scores = rng.dirichlet(np.ones(len(labels)))
+    return {'filename': 'benchmark.jpg', 'md5': uuid.uuid4().hex, 'image_obj': None, 'thumbnail': thumbnail,
+            'embedding': rng.standard_normal(512).astype(np.float32),
+            'prediction': {'detailed_scores': dict(zip(labels, scores.tolist()))}}
+
+
+@contextmanager
+def throwaway_database(no_pragmas=False):
+    """
+    Switches the default connection to a freshly migrated test copy of the configured database, with thumbnail
+    and vector files in a temporary directory, and drops it afterwards. SQLite copies are file backed rather than
+    the in-memory test default, so locking, WAL and the query planner behave as in production.
+    """
+    settings_dict = connection.settings_dict
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if connection.vendor == 'sqlite':
+            settings_dict.setdefault('TEST', {})['NAME'] = f"{temp_dir}/benchmark.sqlite3"
+            if no_pragmas:
+                settings_dict['OPTIONS'] = {}
+
+        connection.close()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(PLIP_THUMBNAIL_DIR=f"{temp_dir}/thumbnails", PLIP_VECTOR_DIR=f"{temp_dir}/vectors"):
+                yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+class Command(BaseCommand):
+    help = ("Measures upload persistence throughput with concurrent writers against the configured database "
+            "backend and options, in a throwaway copy of the schema. Run it once per DJANGO_DB_ENGINE to compare")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', default='1,3,6,12', help="Comma separated concurrent writer counts")
+        parser.add_argument('--uploads', type=int, default=100, help="Uploads saved by each writer")
+        parser.add_argument('--labels', type=int, default=8, help="Labels scored per upload")
+        parser.add_argument('--no-pragmas', action='store_true',
+                            help="Drop the SQLite pragmas and IMMEDIATE transactions, for a before/after comparison")
+
+    def handle(self, *args, **options):
+        with throwaway_database(no_pragmas=options['no_pragmas']):
+            self.stdout.write(f"{connection.vendor} {connection.settings_dict['OPTIONS'] or ''}")
+            user = User.objects.create_user(username='benchmark', password=uuid.uuid4().hex)
+            labels = [f"label {index}" for index in range(options['labels'])]
+
+            self.stdout.write(f"{'writers':>8} {'uploads/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+            for writers in [int(count) for count in options['writers'].split(',')]:
+                self.run_writers(writers, options['uploads'], user, labels)
+
+    def run_writers(self, writers, uploads, user, labels):
+        classifier = SimpleNamespace(model_id='benchmark/plip', model_revision='main', precision='fp32',
+                                     model_key=make_model_key('benchmark/plip', 'main', 'fp32'))
+        latencies, errors = [], []
+        start_barrier = threading.Barrier(writers)
+
+        def writer(seed):
+            rng = np.random.default_rng(seed)
+            thumbnail = rng.bytes(8 * 1024)
+            start_barrier.wait()
+            try:
+                for _ in range(uploads):
+                    # A cache lookup and the save, the database work of one upload request
+                    result = fake_upload(labels, rng, thumbnail)
+                    started = time.perf_counter()
+                    try:
+                        apply_cached_results([result], labels, classifier)
+                        save_results(user, [result], labels[0], classifier)
+                    except OperationalError as e:
+                        errors.append(str(e))
+                    else:
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000 if latencies else 0
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000 if latencies else 0
+        self.stdout.write(f"{writers:>8} {len(latencies) / elapsed:>10.1f} {p50:>8.1f} {p95:>8.1f} {len(errors):>7}")
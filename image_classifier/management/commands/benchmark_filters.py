@@ -0,0 +1,133 @@
+import statistics
+import time
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from authentication.models import User
+from image_classifier.management.commands.benchmark_database import throwaway_database
+from image_classifier.models import PLIPImage, PLIPLabel, PLIPScore, PLIPSubmission
+from image_classifier.services.filters import compile_filter
+from image_classifier.services.pagination import encode_cursor, keyset_page
+
+TISSUE_LABELS = ['tumor', 'stroma', 'necrosis', 'mucus', 'lymphocytes', 'adipose', 'debris', 'muscle',
+                 'normal mucosa', 'background']
+
+FILTERS = {
+    'one label': {'or': [{'label': 'tumor', 'min': 0.3}]},
+    'any of three': {'or': [{'label': 'tumor', 'min': 0.3}, {'label': 'necrosis', 'min': 0.3},
+                            {'label': 'mucus', 'min': 0.3}]},
+    'tumor not stroma': {'and': [{'label': 'tumor', 'min': 0.2}, {'not': {'label': 'stroma', 'min': 0.2}}]},
+    'top label': {'top': 'tumor', 'min': 0.5},
+}
+
+
+def legacy_queryset(tree):
+    """
+    The join and DISTINCT query the list views built before the filter compiler, for OR groups of labels,
+    and a top prediction derived from the scores as it had to be before it was stored on the submission
+    """
+    if 'top' in tree:
+        higher = PLIPScore.objects.filter(submission_id=OuterRef('submission_id'), score__gt=OuterRef('score'))
+        top_scores = (PLIPScore.objects.filter(submission_id=OuterRef('pk'), label__label__icontains=tree['top'],
+                                               score__gte=tree['min'])
+                      .exclude(Exists(higher)))
+        return PLIPSubmission.objects.filter(Exists(top_scores))
+    if 'or' not in tree:
+        return None
+    q_or_objects = Q()
+    for row in tree['or']:
+        q_label_object = Q(submission_scores__label__label__icontains=row['label'])
+        if 'min' in row:
+            q_label_object &= Q(submission_scores__score__gte=row['min'])
+        q_or_objects |= q_label_object
+    return PLIPSubmission.objects.filter(q_or_objects).distinct()
+
+
+def median_ms(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = ("Compares label filter queries built with joins and DISTINCT against the EXISTS filter compiler "
+            "on a synthetic archive, in a throwaway copy of the configured database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--submissions', type=int, default=100_000, help="Submissions in the synthetic archive")
+        parser.add_argument('--labels', type=int, default=200, help="Distinct labels in the archive")
+        parser.add_argument('--scores', type=int, default=8, help="Labels scored per submission")
+        parser.add_argument('--depth', type=int, default=5000, help="Rows skipped to reach the deep page")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per query, the median is reported")
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            self.stdout.write(f"Building {options['submissions']} submissions on {connection.vendor}")
+            self.build_archive(options['submissions'], options['labels'], options['scores'])
+
+            self.stdout.write(f"{'filter':<18} {'query':<9} {'page 1 ms':>10} {'deep ms':>10} {'count ms':>10}")
+            for name, tree in FILTERS.items():
+                legacy = legacy_queryset(tree)
+                if legacy is not None:
+                    self.report(name, 'legacy', options,
+                                page=lambda: list(legacy.order_by('-id')[:10]),
+                                deep=lambda: list(legacy.order_by('-id')[options['depth']:options['depth'] + 10]),
+                                count=legacy.count)
+
+                compiled = PLIPSubmission.objects.filter(compile_filter(tree))
+                deep_row = (compiled.order_by('-created_at', '-id')
+                            .values_list('created_at', 'id')[options['depth']:options['depth'] + 1].first())
+                deep_cursor = (encode_cursor(SimpleNamespace(created_at=deep_row[0], id=deep_row[1]))
+                               if deep_row else None)
+                self.report(name, 'compiled', options,
+                            page=lambda: keyset_page(PLIPSubmission.objects.filter(compile_filter(tree))),
+                            deep=lambda: keyset_page(PLIPSubmission.objects.filter(compile_filter(tree)), deep_cursor),
+                            count=lambda: PLIPSubmission.objects.filter(compile_filter(tree)).count())
+
+    def report(self, name, query, options, page, deep, count):
+        self.stdout.write(f"{name:<18} {query:<9} {median_ms(page, options['repeat']):>10.1f} "
+                          f"{median_ms(deep, options['repeat']):>10.1f} {median_ms(count, options['repeat']):>10.1f}")
+
+    def build_archive(self, submissions, labels, scores, chunk_size=5000):
+        rng = np.random.default_rng(0)
+        user = User.objects.create_user(username='benchmark', password=uuid.uuid4().hex)
+        names = TISSUE_LABELS + [f"class {index}" for index in range(max(0, labels - len(TISSUE_LABELS)))]
+        label_ids = [label.id for label in PLIPLabel.objects.bulk_create([PLIPLabel(label=name) for name in names])]
+        # Common classes dominate, as in a real archive
+        weights = 1 / np.arange(1, len(label_ids) + 1)
+        weights /= weights.sum()
+        now = timezone.now()
+
+        for start in range(0, submissions, chunk_size):
+            count = min(chunk_size, submissions - start)
+            chosen = [rng.choice(len(label_ids), size=scores, replace=False, p=weights) for _ in range(count)]
+            values = rng.dirichlet(np.full(scores, 0.5), size=count)
+
+            images = PLIPImage.objects.bulk_create([PLIPImage(md5=uuid.uuid4().hex) for _ in range(count)])
+            submission_objs = PLIPSubmission.objects.bulk_create([
+                PLIPSubmission(image=image, user=user, filename='synthetic.jpg',
+                               created_at=now - timedelta(seconds=start + index),
+                               predicted_label_id=label_ids[chosen[index][values[index].argmax()]],
+                               predicted_score=float(values[index].max()))
+                for index, image in enumerate(images)])
+
+            score_objs = []
+            for submission_obj, label_indices, label_values in zip(submission_objs, chosen, values):
+                for label_index, value in zip(label_indices, label_values):
+                    score_objs.append(PLIPScore(submission=submission_obj, label_id=label_ids[label_index],
+                                                score=float(value)))
+            PLIPScore.objects.bulk_create(score_objs, batch_size=2000)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
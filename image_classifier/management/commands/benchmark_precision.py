@@ -0,0 +1,86 @@
+import gc
+import resource
+import statistics
+import time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+
+from image_classifier.management.commands.benchmark_batching import load_images
+from image_classifier.services.plip import PRECISIONS, PLIPClassifier
+from image_classifier.services.scoring import parse_labels
+
+
+def current_rss_mb():
+    """Resident set size of this process, falling back to the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = "Compares PLIP precision modes on CPU: latency, throughput, RSS and top-1 agreement with fp32"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(PRECISIONS), help="Comma separated precision modes")
+        parser.add_argument('--image-dir', default=None, help="Folder of sample patches (random patches if omitted)")
+        parser.add_argument('--count', type=int, default=64, help="Images classified per mode")
+        parser.add_argument('--batch-size', type=int, default=8, help="Images per vision forward")
+        parser.add_argument('--labels', default=None, help="Comma separated labels (default label set if omitted)")
+
+    def handle(self, *args, **options):
+        images = load_images(options['image_dir'], options['count'])
+        labels = parse_labels(options['labels'])
+        batches = [images[i:i + options['batch_size']] for i in range(0, len(images), options['batch_size'])]
+
+        # fp32 always runs first, as the reference the other modes are compared against
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        modes = ['fp32'] + [mode for mode in modes if mode != 'fp32']
+
+        reference = None
+        self.stdout.write(f"{'mode':>6} {'p50_ms':>9} {'p95_ms':>9} {'img/s':>9} {'rss_mb':>9} "
+                          f"{'top1_agree':>11} {'cosine':>8}")
+
+        for mode in modes:
+            gc.collect()
+            baseline_rss = current_rss_mb()
+            classifier = PLIPClassifier(precision=mode)
+
+            # Warm up so lazy kernel initialization is not charged to the first batch
+            classifier.embed_images(batches[0][:2])
+
+            latencies = []
+            embeddings = []
+            start = time.perf_counter()
+            for batch in batches:
+                batch_start = time.perf_counter()
+                embeddings.append(classifier.embed_images(batch))
+                latencies.append(time.perf_counter() - batch_start)
+            elapsed = time.perf_counter() - start
+
+            embeddings = np.concatenate(embeddings)
+            predicted = [prediction['predicted_label']
+                         for prediction in classifier.score_embeddings(embeddings, labels)]
+            rss = current_rss_mb() - baseline_rss
+
+            if reference is None:
+                reference = (embeddings, predicted)
+
+            agreement = np.mean([a == b for a, b in zip(predicted, reference[1])])
+            cosine = float(np.mean(np.sum(embeddings * reference[0], axis=1)))
+
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(f"{mode:>6} {statistics.median(latencies) * 1000:>9.1f} {p95 * 1000:>9.1f} "
+                              f"{len(images) / elapsed:>9.1f} {rss:>9.1f} {agreement:>11.1%} {cosine:>8.4f}")
+
+            del classifier
+
+        self.stdout.write(f"Latency is per batch of {options['batch_size']}; rss_mb is the resident memory added "
+                          f"by loading and running each mode")
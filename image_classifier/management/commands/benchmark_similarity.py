@@ -0,0 +1,78 @@
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+
+from image_classifier.services.vector_index import VectorStore
+
+
+def clustered_embeddings(rows, dim, clusters, seed=0, chunk_rows=100_000):
+    """Yields (ids, vectors) chunks of synthetic embeddings grouped around random centers, like tissue classes"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    for start in range(0, rows, chunk_rows):
+        count = min(chunk_rows, rows - start)
+        vectors = centers[rng.integers(0, clusters, count)] + rng.standard_normal((count, dim)).astype(np.float32)
+        yield np.arange(start, start + count), vectors
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies) * 1000, latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+
+
+class Command(BaseCommand):
+    help = "Measures similarity search latency and IVF recall against the exact scan on synthetic embeddings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000, help="Embeddings in the store")
+        parser.add_argument('--dim', type=int, default=512, help="Embedding dimensions")
+        parser.add_argument('--clusters', type=int, default=100, help="Synthetic clusters the rows are drawn around")
+        parser.add_argument('--pca-dim', type=int, default=0, help="Reduce embeddings to this many dimensions")
+        parser.add_argument('--nlist', type=int, default=None, help="IVF lists (square root of rows if omitted)")
+        parser.add_argument('--nprobe', default='1,4,8,16,32', help="Comma separated IVF lists scanned per query")
+        parser.add_argument('--queries', type=int, default=100, help="Queries per configuration")
+        parser.add_argument('--k', type=int, default=10, help="Results per query")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = VectorStore(directory)
+            start = time.perf_counter()
+            stats = store.build(clustered_embeddings(options['rows'], options['dim'], options['clusters']),
+                                pca_dim=options['pca_dim'], nlist=options['nlist'])
+            self.stdout.write(f"Built {stats['rows']} rows of {stats['dim']} dims with {stats['nlist']} lists "
+                              f"in {time.perf_counter() - start:.1f}s")
+
+            # Queries are perturbed copies of stored rows, in the original embedding space
+            _, source = next(clustered_embeddings(options['rows'], options['dim'], options['clusters'],
+                                                  chunk_rows=options['queries']))
+            queries = source + 0.5 * rng.standard_normal(source.shape).astype(np.float32)
+
+            exact, latencies = [], []
+            for query in queries:
+                query_start = time.perf_counter()
+                exact.append({image_id for image_id, _ in store.search(query, options['k'], method='exact')})
+                latencies.append(time.perf_counter() - query_start)
+
+            self.stdout.write(f"{'method':>10} {'nprobe':>7} {'p50_ms':>9} {'p95_ms':>9} {'recall@k':>9}")
+            p50, p95 = percentiles(latencies)
+            self.stdout.write(f"{'exact':>10} {'-':>7} {p50:>9.2f} {p95:>9.2f} {1:>9.3f}")
+
+            for nprobe in [int(value) for value in options['nprobe'].split(',')]:
+                recalls, latencies = [], []
+                for query, expected in zip(queries, exact):
+                    query_start = time.perf_counter()
+                    found = store.search(query, options['k'], method='ivf', nprobe=nprobe)
+                    latencies.append(time.perf_counter() - query_start)
+                    recalls.append(len(expected & {image_id for image_id, _ in found}) / len(expected))
+
+                p50, p95 = percentiles(latencies)
+                self.stdout.write(f"{'ivf':>10} {nprobe:>7} {p50:>9.2f} {p95:>9.2f} "
+                                  f"{statistics.mean(recalls):>9.3f}")
+
+        self.stdout.write("Recall is the share of the exact top k the IVF search also returns")
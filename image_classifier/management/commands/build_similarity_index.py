@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from image_classifier.models import PLIPImageEmbedding
+from image_classifier.services.scoring import make_model_key
+from image_classifier.services.similarity import rebuild_vector_store
+from image_classifier.services.vector_index import get_vector_store
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the similarity search store of every model from its stored embeddings, "
+            "optionally PCA-reduced, and trains the IVF index")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-key', default=None, help="Only rebuild this model_id@revision:precision")
+        parser.add_argument('--pca-dim', type=int, default=0, help="Reduce embeddings to this many dimensions")
+        parser.add_argument('--nlist', type=int, default=None,
+                            help="IVF inverted lists (square root of the row count if omitted, 0 for exact only)")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Embeddings read per database round trip")
+
+    def handle(self, *args, **options):
+        models = (PLIPImageEmbedding.objects.order_by()
+                  .values_list('model_id', 'model_revision', 'precision').distinct())
+
+        for model_id, model_revision, precision in models:
+            if options['model_key'] and make_model_key(model_id, model_revision, precision) != options['model_key']:
+                continue
+
+            start = time.perf_counter()
+            stats = rebuild_vector_store(model_id, model_revision, precision, pca_dim=options['pca_dim'],
+                                         nlist=options['nlist'], chunk_size=options['chunk_size'])
+            status = get_vector_store(stats['model_key']).status()
+            self.stdout.write(f"{stats['model_key']}: {status['rows']} rows of {stats['dim']} dims, "
+                              f"{stats['nlist']} lists in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,63 @@
+import json
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from image_classifier.models import PLIPSubmission
+from image_classifier.serializers.plip_serializers import PLIPAPIListInputSerializer
+from image_classifier.services.export import FORMATS, LAYOUTS, ExportError, export_submissions
+from image_classifier.services.filters import FilterError, list_filter
+
+
+class Command(BaseCommand):
+    help = ("Exports submissions and their scores as CSV, JSON lines or Parquet, filtered like the list API. "
+            "Rows are streamed in chunks, so memory stays flat however large the export")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="File to write, or - for stdout")
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--layout', choices=LAYOUTS, default='long',
+                            help="A row per score, or a row per submission with a column per label")
+        parser.add_argument('--filters', default='{}',
+                            help="JSON body of the list API, e.g. '{\"min_date\": \"2026-01-01\", "
+                                 "\"filter\": {\"label\": \"tumor\", \"min\": 0.5}}'")
+        parser.add_argument('--columns', help="Comma separated labels given a score column in the wide layout "
+                                              "(every scored label if omitted)")
+        parser.add_argument('--thumbnails', action='store_true', help="Add each thumbnail as a base64 column")
+        parser.add_argument('--chunk-size', type=int, default=settings.PLIP_EXPORT_CHUNK_SIZE,
+                            help="Submissions read per query")
+
+    def handle(self, *args, **options):
+        try:
+            filters = PLIPAPIListInputSerializer(data=json.loads(options['filters']))
+        except json.JSONDecodeError as e:
+            raise CommandError(f"--filters is not valid JSON: {e}")
+        if not filters.is_valid():
+            raise CommandError(f"Invalid --filters: {filters.errors}")
+
+        columns = None
+        if options['columns']:
+            columns = [name.strip() for name in options['columns'].split(',') if name.strip()]
+
+        try:
+            queryset = PLIPSubmission.objects.filter(list_filter(filters.validated_data))
+            _, content = export_submissions(queryset, options['format'], options['layout'], columns,
+                                            options['thumbnails'], options['chunk_size'])
+        except (FilterError, ExportError) as e:
+            raise CommandError(str(e))
+
+        if options['output'] == '-':
+            self.write_chunks(content, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+            return
+
+        start = time.perf_counter()
+        with open(options['output'], 'wb') as output:
+            self.write_chunks(content, output)
+        self.stdout.write(f"Done: wrote {options['output']} in {time.perf_counter() - start:.1f}s")
+
+    def write_chunks(self, content, output):
+        for chunk in content:
+            output.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
@@ -0,0 +1,17 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from image_classifier.services.inference_client import RemotePLIPClassifier, InferenceServerError
+
+
+class Command(BaseCommand):
+    help = "Prints the shared PLIP inference server's health report, failing if it is unreachable"
+
+    def handle(self, *args, **options):
+        try:
+            report = RemotePLIPClassifier().health()
+        except InferenceServerError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from image_classifier.models import PLIPImage
+from image_classifier.services.thumbnails import save_thumbnails
+
+
+class Command(BaseCommand):
+    help = ("Moves thumbnails still stored as database blobs to the content-addressed thumbnail store in chunks, "
+            "emptying each blob once its file is written. Safe to interrupt and rerun while the site is live")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Thumbnails moved per transaction")
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help="Seconds to sleep between chunks, leaving the database to the live site")
+        parser.add_argument('--vacuum', action='store_true',
+                            help="VACUUM an SQLite database afterwards to give the freed pages back to the disk")
+
+    def handle(self, *args, **options):
+        pending = PLIPImage.objects.exclude(blob_image=b'').order_by('id')
+        remaining = pending.count()
+        self.stdout.write(f"Moving {remaining} thumbnails to the thumbnail store")
+
+        last_id, moved = 0, 0
+        while True:
+            # Keyset pages by id, so each chunk is an index range scan and no read transaction stays open
+            chunk = list(pending.filter(id__gt=last_id).values_list('id', 'md5', 'blob_image')[:options['chunk_size']])
+            if not chunk:
+                break
+
+            # Files are written before the blobs are emptied, so an interrupted run never loses a thumbnail
+            save_thumbnails({md5_checksum: bytes(blob) for _, md5_checksum, blob in chunk})
+            with transaction.atomic():
+                PLIPImage.objects.filter(id__in=[image_id for image_id, _, _ in chunk]).update(blob_image=b'')
+
+            last_id = chunk[-1][0]
+            moved += len(chunk)
+            self.stdout.write(f"{moved}/{remaining} thumbnails moved")
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            self.stdout.write("Vacuuming the database")
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+
+        self.stdout.write(f"Done: {moved} thumbnails moved")
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from image_classifier.services.registry import ModelRegistry, read_manifest, write_manifest
+
+
+class Command(BaseCommand):
+    help = ("Lists and hot swaps registry models. Changes are written to the model manifest, which every web, "
+            "worker and inference server process polls and applies without a restart")
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        subparsers.add_parser('list', help="Show every model spec and the default")
+
+        swap = subparsers.add_parser('swap', help="Point a model name at a new checkpoint or revision")
+        swap.add_argument('name')
+        swap.add_argument('--path', required=True, help="Hugging Face model id or local checkpoint directory")
+        swap.add_argument('--revision', default='main')
+        swap.add_argument('--precision', default=None, help="fp32, bf16 or int8 (PLIP_PRECISION if omitted)")
+        swap.add_argument('--default', action='store_true', help="Also make this the default model")
+        swap.add_argument('--no-check', action='store_true', help="Skip loading the checkpoint here first")
+
+        default = subparsers.add_parser('default', help="Switch the default model")
+        default.add_argument('name')
+
+    def handle(self, *args, **options):
+        path = settings.PLIP_MODEL_MANIFEST
+        manifest = read_manifest(path)
+        specs = {**settings.PLIP_MODELS, **manifest['models']}
+
+        if options['action'] == 'list':
+            default = manifest.get('default') or settings.PLIP_DEFAULT_MODEL
+            for name, spec in sorted(specs.items()):
+                marker = '*' if name == default else ' '
+                self.stdout.write(f"{marker} {name:<16} {spec.get('path')}@{spec.get('revision') or 'main'} "
+                                  f"{spec.get('precision') or settings.PLIP_PRECISION}")
+            return
+
+        if options['action'] == 'default':
+            if options['name'] not in specs:
+                raise CommandError(f"Unknown model '{options['name']}'")
+            manifest['default'] = options['name']
+            write_manifest(path, manifest)
+            self.stdout.write(f"Default model is now '{options['name']}'")
+            return
+
+        spec = {'path': options['path'], 'revision': options['revision']}
+        if options['precision']:
+            spec['precision'] = options['precision']
+
+        # A checkpoint that cannot be loaded is rejected here rather than logged by every serving process
+        if not options['no_check']:
+            try:
+                classifier = ModelRegistry._load_checkpoint(spec)
+            except Exception as e:
+                raise CommandError(f"Could not load {spec['path']}: {e}")
+            self.stdout.write(f"Loaded {classifier.model_key}")
+
+        manifest['models'][options['name']] = spec
+        if options['default']:
+            manifest['default'] = options['name']
+        write_manifest(path, manifest)
+        self.stdout.write(f"Model '{options['name']}' is picked up within "
+                          f"{settings.PLIP_MODEL_MANIFEST_POLL_SECONDS:g}s in every running process")
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from image_classifier.services.analytics import rebuild_analytics
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the analytics summary tables from every submission. Needed after submissions are deleted or "
+            "edited outside the upload paths. Safe to run while the site is live")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Submissions read per query")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counted = rebuild_analytics(chunk_size=options['chunk_size'])
+        self.stdout.write(f"Done: {counted} submissions counted in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,84 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from image_classifier.models import PLIPImage
+from image_classifier.services.inference import get_classifier
+from image_classifier.services.labels import get_labels
+from image_classifier.services.rescore import checkpoint_name, read_checkpoint, write_checkpoint, rescore_images
+from image_classifier.services.scoring import parse_labels
+
+
+class Command(BaseCommand):
+    help = ("Re-scores every stored image against a new label list, adding one submission per image. "
+            "Progress is checkpointed after each chunk, and a rerun with the same labels and model resumes. "
+            "The new submissions count towards the analytics like any other, as a second prediction for the image")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--labels', required=True, help="Comma separated labels to score against")
+        parser.add_argument('--model', default=None, help="Registry model name (default model if omitted)")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Images read, scored and written together")
+        parser.add_argument('--batch-size', type=int, default=32, help="Thumbnails per vision forward")
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help="Seconds to sleep between chunks, leaving the database to the live site")
+        parser.add_argument('--checkpoint', default=None,
+                            help="Checkpoint file (derived from the labels and model under the database folder)")
+        parser.add_argument('--restart', action='store_true', help="Ignore any checkpoint and start over")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many images")
+
+    def handle(self, *args, **options):
+        labels = parse_labels(options['labels'])
+        if not labels:
+            raise CommandError("Provide at least one label")
+
+        classifier = get_classifier(options['model'])
+        label_objs = get_labels(labels)
+
+        path = options['checkpoint'] or Path(settings.BASE_DIR) / 'database' / checkpoint_name(labels, classifier)
+        checkpoint = {} if options['restart'] else read_checkpoint(path)
+        if checkpoint:
+            self.stdout.write(f"Resuming after image {checkpoint['last_image_id']} "
+                              f"({checkpoint['images']} images already done)")
+        checkpoint = {'labels': labels, 'model_key': classifier.model_key, 'last_image_id': 0, 'images': 0,
+                      'reused': 0, 'embedded': 0, 'failed': 0, 'skipped': 0, 'submissions': 0, **checkpoint}
+
+        images = PLIPImage.objects.filter(id__gt=checkpoint['last_image_id']).order_by('id')
+        remaining = images.count()
+        if options['limit']:
+            remaining = min(remaining, options['limit'])
+        self.stdout.write(f"Re-scoring {remaining} images against {len(labels)} labels with {classifier.model_key}")
+
+        start = time.perf_counter()
+        done = 0
+        while done < remaining:
+            # Keyset pages by id rather than one long-lived cursor, so no read transaction stays open on SQLite
+            # between chunks and each page is an index range scan however far the run has got
+            chunk = list(images.filter(id__gt=checkpoint['last_image_id'])
+                         .values_list('id', flat=True)[:min(options['chunk_size'], remaining - done)])
+            if not chunk:
+                break
+
+            self.process_chunk(chunk, labels, label_objs, classifier, options, checkpoint, path)
+            done += len(chunk)
+
+            rate = done / (time.perf_counter() - start)
+            self.stdout.write(f"{done}/{remaining} images, {rate:.1f} img/s, "
+                              f"{checkpoint['reused']} reused, {checkpoint['embedded']} embedded, "
+                              f"{checkpoint['failed']} failed, {checkpoint['skipped']} already done, "
+                              f"eta {(remaining - done) / rate / 60:.1f} min")
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(f"Done: {checkpoint['submissions']} submissions created in total; "
+                          f"checkpoint {path}")
+
+    def process_chunk(self, chunk, labels, label_objs, classifier, options, checkpoint, path):
+        stats = rescore_images(chunk, labels, label_objs, classifier, batch_size=options['batch_size'])
+
+        for key, value in stats.items():
+            checkpoint[key] += value
+        checkpoint['images'] += len(chunk)
+        checkpoint['last_image_id'] = chunk[-1]
+        write_checkpoint(path, checkpoint)
@@ -0,0 +1,37 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Runs the shared PLIP inference server on a Unix domain socket"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.PLIP_INFERENCE_SOCKET, help="Unix socket path")
+        parser.add_argument('--max-pending', type=int, default=settings.PLIP_INFERENCE_MAX_PENDING,
+                            help="Requests admitted concurrently before callers start queueing")
+        parser.add_argument('--queue-timeout', type=float, default=settings.PLIP_INFERENCE_QUEUE_TIMEOUT,
+                            help="Seconds a request may wait for admission before it is answered busy")
+        parser.add_argument('--max-batch-size', type=int, default=settings.PLIP_BATCH_MAX_SIZE)
+        parser.add_argument('--max-wait-ms', type=float, default=settings.PLIP_BATCH_MAX_WAIT_MS)
+
+    def handle(self, *args, **options):
+        from image_classifier.services.inference_server import InferenceServer
+
+        server = InferenceServer(options['socket'], max_pending=options['max_pending'],
+                                 queue_timeout=options['queue_timeout'], max_batch_size=options['max_batch_size'],
+                                 max_wait_ms=options['max_wait_ms'])
+
+        # serve_forever blocks the main thread, so shut down from a helper thread on SIGTERM (docker stop)
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+        self.stdout.write(f"PLIP inference server listening on {options['socket']} "
+                          f"(default model {server.classifier.model_key})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
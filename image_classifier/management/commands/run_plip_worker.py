@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from image_classifier.services.inference import get_classifier
+from image_classifier.services.jobs import requeue_stale_jobs, claim_jobs, process_jobs
+
+
+class Command(BaseCommand):
+    help = "Drains the asynchronous PLIP job queue in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.PLIP_JOB_BATCH_SIZE,
+                            help="Jobs claimed and classified together")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        get_classifier()
+
+        while True:
+            close_old_connections()
+            requeue_stale_jobs()
+
+            jobs = claim_jobs(options['batch_size'])
+            if jobs:
+                start = time.perf_counter()
+                # Resolved per batch so a hot swapped default model is picked up
+                process_jobs(jobs, get_classifier())
+                self.stdout.write(f"Processed {len(jobs)} jobs in {time.perf_counter() - start:.2f}s")
+                continue
+
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,28 @@
+# Generated by Django 6.1.2 on 2026-10-18 14:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0008_alter_plipsubmission_expected_label'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PLIPImageEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_id', models.CharField(max_length=255)),
+                ('model_revision', models.CharField(max_length=64)),
+                ('dtype', models.CharField(max_length=16)),
+                ('vector', models.BinaryField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='image_classifier.plipimage')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('image', 'model_id', 'model_revision'), name='unique_image_embedding')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.1.2 on 2026-10-18 14:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0009_plipimageembedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PLIPTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('x', models.PositiveIntegerField()),
+                ('y', models.PositiveIntegerField()),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('label', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='image_classifier.pliplabel')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tiles', to='image_classifier.plipsubmission')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PLIPTileMap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tile_size', models.PositiveIntegerField()),
+                ('scale', models.PositiveSmallIntegerField(default=1)),
+                ('columns', models.PositiveIntegerField()),
+                ('rows', models.PositiveIntegerField()),
+                ('blob_image', models.BinaryField()),
+                ('submission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tile_map', to='image_classifier.plipsubmission')),
+            ],
+        ),
+    ]
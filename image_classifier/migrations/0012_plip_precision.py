@@ -0,0 +1,31 @@
+# Generated by Django 6.1.2 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0011_plipjob'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='plipimageembedding',
+            name='unique_image_embedding',
+        ),
+        migrations.AddField(
+            model_name='plipimageembedding',
+            name='precision',
+            field=models.CharField(default='fp32', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='plipsubmission',
+            name='precision',
+            field=models.CharField(default='fp32', max_length=8),
+        ),
+        migrations.AddConstraint(
+            model_name='plipimageembedding',
+            constraint=models.UniqueConstraint(fields=('image', 'model_id', 'model_revision', 'precision'), name='unique_image_embedding'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.1.2 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+
+def backfill_model(apps, schema_editor):
+    # Every submission before the model registry was scored by the single vinid/plip checkpoint
+    PLIPSubmission = apps.get_model('image_classifier', 'PLIPSubmission')
+    PLIPSubmission.objects.filter(model_id='').update(model_id='vinid/plip', model_revision='main')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0012_plip_precision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plipsubmission',
+            name='model_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='plipsubmission',
+            name='model_revision',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(backfill_model, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 6.1.2 on 2026-10-18 15:06
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_images(apps, schema_editor):
+    # Concurrent uploads of the same file could store its thumbnail twice; the oldest row is kept and the
+    # submissions and embeddings of the others are moved onto it before md5 becomes unique
+    PLIPImage = apps.get_model('image_classifier', 'PLIPImage')
+    PLIPImageEmbedding = apps.get_model('image_classifier', 'PLIPImageEmbedding')
+    PLIPSubmission = apps.get_model('image_classifier', 'PLIPSubmission')
+
+    duplicated = (PLIPImage.objects.values('md5').annotate(rows=Count('id')).filter(rows__gt=1)
+                  .values_list('md5', flat=True))
+    for md5 in list(duplicated):
+        keeper_id, *duplicate_ids = PLIPImage.objects.filter(md5=md5).order_by('id').values_list('id', flat=True)
+        PLIPSubmission.objects.filter(image_id__in=duplicate_ids).update(image_id=keeper_id)
+
+        kept = set(PLIPImageEmbedding.objects.filter(image_id=keeper_id)
+                   .values_list('model_id', 'model_revision', 'precision'))
+        for embedding in PLIPImageEmbedding.objects.filter(image_id__in=duplicate_ids).order_by('id'):
+            key = (embedding.model_id, embedding.model_revision, embedding.precision)
+            if key in kept:
+                embedding.delete()
+            else:
+                embedding.image_id = keeper_id
+                embedding.save(update_fields=['image'])
+                kept.add(key)
+
+        PLIPImage.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0013_plipsubmission_model'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_images, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='plipimage',
+            name='md5',
+            field=models.CharField(max_length=32, unique=True),
+        ),
+    ]
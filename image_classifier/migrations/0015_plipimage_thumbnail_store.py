@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0014_plipimage_unique_md5'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='plipimage',
+            name='blob_image',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+    ]
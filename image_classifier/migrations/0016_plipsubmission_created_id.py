@@ -0,0 +1,19 @@
+# Generated by Django 6.1.2 on 2026-10-18 15:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0015_plipimage_thumbnail_store'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plipsubmission',
+            index=models.Index(fields=['-created_at', '-id'], name='plipsubmission_created_id'),
+        ),
+    ]
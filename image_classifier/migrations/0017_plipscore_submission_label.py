@@ -0,0 +1,17 @@
+# Generated by Django 6.1.2 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0016_plipsubmission_created_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plipscore',
+            index=models.Index(fields=['submission', 'label', 'score'], name='plipscore_submission_label'),
+        ),
+    ]
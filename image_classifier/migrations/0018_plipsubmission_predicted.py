@@ -0,0 +1,56 @@
+# Generated by Django 6.1.2 on 2026-10-18 15:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def backfill_predictions(apps, schema_editor):
+    # Copies each submission's highest score onto it, one id range per UPDATE so no statement runs for long
+    PLIPScore = apps.get_model('image_classifier', 'PLIPScore')
+    PLIPSubmission = apps.get_model('image_classifier', 'PLIPSubmission')
+
+    top = PLIPScore.objects.filter(submission_id=OuterRef('pk')).order_by('-score', 'id')
+    last_id = PLIPSubmission.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    for start in range(0, last_id + 1, 10000):
+        PLIPSubmission.objects.filter(id__gte=start, id__lt=start + 10000).update(
+            predicted_label_id=Subquery(top.values('label_id')[:1]),
+            predicted_score=Subquery(top.values('score')[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0017_plipscore_submission_label'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plipsubmission',
+            name='predicted_label',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='image_classifier.pliplabel'),
+        ),
+        migrations.AddField(
+            model_name='plipsubmission',
+            name='predicted_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='plipscore',
+            index=models.Index(fields=['label', 'score'], name='plipscore_label_score'),
+        ),
+        migrations.AddIndex(
+            model_name='plipsubmission',
+            index=models.Index(fields=['predicted_label', 'predicted_score'], name='plipsubmission_predicted'),
+        ),
+        migrations.AddIndex(
+            model_name='plipsubmission',
+            index=models.Index(fields=['user', 'created_at'], name='plipsubmission_user_created'),
+        ),
+        # Last, as the UPDATE queues deferred FK checks on PostgreSQL, and no DDL may touch the table after that
+        # within the migration's transaction
+        migrations.RunPython(backfill_predictions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.1.2 on 2026-10-18 15:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0018_plipsubmission_predicted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PLIPConfidenceCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('bin', models.PositiveSmallIntegerField()),
+                ('outcome', models.CharField(choices=[('unlabelled', 'Unlabelled'), ('correct', 'Correct'), ('incorrect', 'Incorrect')], max_length=10)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('predicted_label', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='image_classifier.pliplabel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'predicted_label', 'bin', 'outcome'), name='unique_confidence_count')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PLIPConfusionCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('expected_label', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='image_classifier.pliplabel')),
+                ('predicted_label', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='image_classifier.pliplabel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'expected_label', 'predicted_label'), name='unique_confusion_count')],
+            },
+        ),
+    ]
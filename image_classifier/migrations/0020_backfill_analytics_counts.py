@@ -0,0 +1,49 @@
+from collections import Counter
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def backfill_counts(apps, schema_editor):
+    # Counts every submission into the summary tables, as rebuild_analytics does, replacing the counts of uploads
+    # saved since 0019. Reads the archive in id ranges so memory depends on the number of days and labels only
+    PLIPSubmission = apps.get_model('image_classifier', 'PLIPSubmission')
+    PLIPConfusionCount = apps.get_model('image_classifier', 'PLIPConfusionCount')
+    PLIPConfidenceCount = apps.get_model('image_classifier', 'PLIPConfidenceCount')
+
+    confusion, confidence = Counter(), Counter()
+    rows = PLIPSubmission.objects.exclude(predicted_label=None).exclude(predicted_score=None).order_by('id')
+    rows = rows.values_list('id', 'created_at', 'expected_label_id', 'predicted_label_id', 'predicted_score')
+    after_id = 0
+    while chunk := list(rows.filter(id__gt=after_id)[:10000]):
+        for _, created_at, expected_label_id, predicted_label_id, predicted_score in chunk:
+            day = timezone.localdate(created_at)
+            if expected_label_id is None:
+                outcome = 'unlabelled'
+            else:
+                confusion[(day, expected_label_id, predicted_label_id)] += 1
+                outcome = 'correct' if expected_label_id == predicted_label_id else 'incorrect'
+            confidence[(day, predicted_label_id, min(max(int(predicted_score * 10), 0), 9), outcome)] += 1
+        after_id = chunk[-1][0]
+
+    PLIPConfusionCount.objects.all().delete()
+    PLIPConfidenceCount.objects.all().delete()
+    PLIPConfusionCount.objects.bulk_create(
+        [PLIPConfusionCount(day=day, expected_label_id=expected_label_id, predicted_label_id=predicted_label_id,
+                            count=count) for (day, expected_label_id, predicted_label_id), count in confusion.items()],
+        batch_size=1000)
+    PLIPConfidenceCount.objects.bulk_create(
+        [PLIPConfidenceCount(day=day, predicted_label_id=predicted_label_id, bin=bin_index, outcome=outcome,
+                             count=count) for (day, predicted_label_id, bin_index, outcome), count in
+         confidence.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_classifier', '0019_analytics_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
@@ -1,24 +1,66 @@
 import base64
+
+import numpy as np
+
 from django.db import models
+from django.urls import reverse
 from core.models import TimestampBaseModel
 from authentication.models import User
 
+from .services.thumbnails import read_thumbnail
+
 
 class PLIPImage(TimestampBaseModel):
-    blob_image = models.BinaryField()
-    md5 = models.CharField(max_length=32, db_index=True)
+    # Emptied once move_thumbnails has written the thumbnail to the content-addressed thumbnail store
+    blob_image = models.BinaryField(blank=True, default=b'')
+    md5 = models.CharField(max_length=32, unique=True)
 
     @property
-    def image_base64(self):
-        if not self.blob_image:
+    def thumbnail(self):
+        return read_thumbnail(self.md5, self.blob_image)
+
+    @property
+    def thumbnail_url(self):
+        return reverse('plip-thumbnail', kwargs={'md5': self.md5})
+
+    @property
+    def image_base64(self) -> str:
+        thumbnail = self.thumbnail
+        if not thumbnail:
             return ""
-        encoded = base64.b64encode(self.blob_image).decode('utf-8')
+        encoded = base64.b64encode(thumbnail).decode('utf-8')
         return encoded
 
     def __str__(self):
         return self.md5
 
 
+class PLIPImageEmbedding(models.Model):
+    """
+    Normalized PLIP image embedding for a stored image, so later submissions of the same md5 can be scored
+    against new labels without decoding the upload or running the vision tower again
+    """
+    image = models.ForeignKey(PLIPImage, on_delete=models.CASCADE, related_name='embeddings')
+    model_id = models.CharField(max_length=255)
+    model_revision = models.CharField(max_length=64)
+    precision = models.CharField(max_length=8, default='fp32')
+    dtype = models.CharField(max_length=16)
+    vector = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'model_id', 'model_revision', 'precision'],
+                                    name='unique_image_embedding'),
+        ]
+
+    @property
+    def embedding(self):
+        return np.frombuffer(self.vector, dtype=self.dtype).astype(np.float32)
+
+    def __str__(self):
+        return f"{self.image_id} {self.model_id}@{self.model_revision} {self.precision}"
+
+
 class PLIPLabel(models.Model):
     label = models.CharField(max_length=100, unique=True, db_index=True)
 
@@ -31,6 +73,23 @@ class PLIPSubmission(TimestampBaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     expected_label = models.ForeignKey(PLIPLabel, on_delete=models.DO_NOTHING, blank=True, null=True)
     filename = models.CharField(max_length=100)
+    # Checkpoint, revision and inference precision of the classifier that produced the scores
+    model_id = models.CharField(max_length=255, blank=True, default='')
+    model_revision = models.CharField(max_length=64, blank=True, default='')
+    precision = models.CharField(max_length=8, default='fp32')
+    # Highest scoring label and its score, copied from the scores when they are written
+    predicted_label = models.ForeignKey(PLIPLabel, on_delete=models.DO_NOTHING, blank=True, null=True,
+                                        db_index=False, related_name='+')
+    predicted_score = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination and date ranges seek this index, in either direction
+            models.Index(fields=['-created_at', '-id'], name='plipsubmission_created_id'),
+            # Top label filters are a range scan on the score within one label
+            models.Index(fields=['predicted_label', 'predicted_score'], name='plipsubmission_predicted'),
+            models.Index(fields=['user', 'created_at'], name='plipsubmission_user_created'),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -41,9 +100,130 @@ class PLIPScore(models.Model):
     score = models.FloatField(db_index=True)
     submission = models.ForeignKey(PLIPSubmission, on_delete=models.CASCADE, related_name='submission_scores')
 
+    class Meta:
+        indexes = [
+            # Covers the correlated EXISTS of a label score filter without reading the table
+            models.Index(fields=['submission', 'label', 'score'], name='plipscore_submission_label'),
+            # Score ranges within one label, e.g. every submission scoring tumor above 0.8
+            models.Index(fields=['label', 'score'], name='plipscore_label_score'),
+        ]
+
     @property
-    def rounded_score(self):
+    def rounded_score(self) -> float:
         return round(self.score, 2)
 
     def __str__(self):
         return str(self.score)
+
+
+class PLIPConfusionCount(models.Model):
+    """
+    Submissions with an expected label per day, expected label and predicted top label. Incremented as
+    submissions are saved so the analytics never scan the submissions, and rebuilt by rebuild_analytics.
+    """
+    day = models.DateField()
+    expected_label = models.ForeignKey(PLIPLabel, on_delete=models.DO_NOTHING, db_index=False, related_name='+')
+    predicted_label = models.ForeignKey(PLIPLabel, on_delete=models.DO_NOTHING, db_index=False, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'expected_label', 'predicted_label'], name='unique_confusion_count'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.expected_label_id}->{self.predicted_label_id}: {self.count}"
+
+
+class PLIPConfidenceCount(models.Model):
+    """
+    Submissions per day, predicted top label and confidence bin, split by whether the prediction agreed with
+    the expected label. Maintained alongside PLIPConfusionCount.
+    """
+    UNLABELLED = 'unlabelled'
+    CORRECT = 'correct'
+    INCORRECT = 'incorrect'
+    OUTCOME_CHOICES = [(UNLABELLED, 'Unlabelled'), (CORRECT, 'Correct'), (INCORRECT, 'Incorrect')]
+
+    day = models.DateField()
+    predicted_label = models.ForeignKey(PLIPLabel, on_delete=models.DO_NOTHING, db_index=False, related_name='+')
+    bin = models.PositiveSmallIntegerField()
+    outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'predicted_label', 'bin', 'outcome'],
+                                    name='unique_confidence_count'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.predicted_label_id} bin {self.bin} {self.outcome}: {self.count}"
+
+
+class PLIPTileMap(models.Model):
+    """Downsampled class map of a tiled large-image submission, one color block per tile"""
+    submission = models.OneToOneField(PLIPSubmission, on_delete=models.CASCADE, related_name='tile_map')
+    tile_size = models.PositiveIntegerField()
+    scale = models.PositiveSmallIntegerField(default=1)
+    columns = models.PositiveIntegerField()
+    rows = models.PositiveIntegerField()
+    blob_image = models.BinaryField()
+
+    @property
+    def image_base64(self) -> str:
+        if not self.blob_image:
+            return ""
+        return base64.b64encode(self.blob_image).decode('utf-8')
+
+    @property
+    def resolution(self) -> float:
+        """Fraction of the upload's native resolution its tiles were classified at"""
+        return 1 / self.scale
+
+    def __str__(self):
+        return str(self.submission_id)
+
+
+class PLIPTile(models.Model):
+    """Top prediction for one tile of a tiled submission, in original image pixel coordinates"""
+    submission = models.ForeignKey(PLIPSubmission, on_delete=models.CASCADE, related_name='tiles')
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    label = models.ForeignKey(PLIPLabel, on_delete=models.DO_NOTHING)
+    score = models.FloatField()
+
+    def __str__(self):
+        return f"{self.submission_id} ({self.x}, {self.y})"
+
+
+class PLIPJob(TimestampBaseModel):
+    """
+    Queued asynchronous classification of an upload, drained in batches by the run_plip_worker command
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=100)
+    upload = models.BinaryField()
+    labels = models.CharField(max_length=255, blank=True)
+    expected_label = models.CharField(max_length=255, blank=True, null=True)
+    submission = models.ForeignKey(PLIPSubmission, on_delete=models.SET_NULL, blank=True, null=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=64, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        return str(self.id)
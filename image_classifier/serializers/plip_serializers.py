@@ -1,12 +1,42 @@
+from django.db.models import Prefetch
+from django.urls import reverse
 from rest_framework import serializers
 from rest_framework.fields import ReadOnlyField
 
-from ..models import PLIPImage, PLIPSubmission, PLIPScore, PLIPLabel
+from ..models import PLIPImage, PLIPSubmission, PLIPScore, PLIPLabel, PLIPTile, PLIPTileMap, PLIPJob
+from ..services.analytics import BUCKETS
+from ..services.export import FORMATS, LAYOUTS
+from ..services.pagination import COUNT_MODES, decode_cursor
+
+
+THUMBNAIL_MODES = ('url', 'base64', 'none')
+
+
+def absolute_url(url, context) -> str:
+    request = context.get('request', None)
+    return request.build_absolute_uri(url) if request else url
 
 
 class PLIPImageSerializer(serializers.ModelSerializer):
+    """
+    Image with its thumbnail URL. The inline base64 thumbnail is only added when the serializer context asks
+    for thumbnails='base64', and thumbnails='none' leaves out both.
+    """
+    thumbnail_url = serializers.SerializerMethodField()
     image_base64 = ReadOnlyField()
 
+    def get_fields(self):
+        fields = super().get_fields()
+        thumbnails = self.context.get('thumbnails', 'url')
+        if thumbnails != 'base64':
+            fields.pop('image_base64')
+        if thumbnails == 'none':
+            fields.pop('thumbnail_url')
+        return fields
+
+    def get_thumbnail_url(self, obj) -> str:
+        return absolute_url(obj.thumbnail_url, self.context)
+
     class Meta:
         model = PLIPImage
         exclude = ('blob_image',)
@@ -29,30 +59,156 @@ class PLIPScoreSerializer(serializers.ModelSerializer):
 
 
 class PLIPSubmissionSerializer(serializers.ModelSerializer):
+    """
+    Submission with its image, scores and top prediction. The serializer context can narrow the output:
+    fields (set of field names to keep), scores=False to drop the full score list, and thumbnails
+    (see PLIPImageSerializer).
+    """
     image = PLIPImageSerializer(read_only=True)
     expected_label = serializers.SlugRelatedField(many=False, read_only=True, slug_field='label')
     submission_scores = PLIPScoreSerializer(many=True, read_only=True)
+    top_label = serializers.SerializerMethodField()
+    top_score = serializers.SerializerMethodField()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get('fields'):
+            fields = {name: field for name, field in fields.items() if name in self.context['fields']}
+        if not self.context.get('scores', True):
+            fields.pop('submission_scores', None)
+        if self.context.get('thumbnails', 'url') == 'none':
+            fields.pop('image', None)
+        return fields
+
+    def get_top_label(self, obj) -> str | None:
+        return obj.predicted_label.label if obj.predicted_label_id else None
+
+    def get_top_score(self, obj) -> float | None:
+        return obj.predicted_score
 
     @staticmethod
-    def setup_eager_loading(queryset):
-        queryset = (queryset.select_related('image').prefetch_related('submission_scores__label'))
+    def setup_eager_loading(queryset, context=None):
+        """Loads only the relations the serializer context will output"""
+        context = context or {}
+
+        def wanted(*names):
+            return not context.get('fields') or any(name in context['fields'] for name in names)
+
+        if wanted('image') and context.get('thumbnails', 'url') != 'none':
+            queryset = queryset.select_related('image')
+            # Blobs of images not yet moved to the thumbnail store are only needed to inline them
+            if context.get('thumbnails', 'url') != 'base64':
+                queryset = queryset.defer('image__blob_image')
+        if wanted('expected_label'):
+            queryset = queryset.select_related('expected_label')
+        if wanted('top_label'):
+            queryset = queryset.select_related('predicted_label')
+        if wanted('submission_scores') and context.get('scores', True):
+            # Highest score first; the (submission, label, score) index would otherwise order them by label
+            scores = PLIPScore.objects.select_related('label').order_by('-score', 'id')
+            queryset = queryset.prefetch_related(Prefetch('submission_scores', queryset=scores))
         return queryset
 
     class Meta:
         model = PLIPSubmission
-        fields = '__all__'
+        fields = ('id', 'image', 'expected_label', 'submission_scores', 'top_label', 'top_score', 'created_at',
+                  'filename', 'user')
+
+
+class PLIPTileSerializer(serializers.ModelSerializer):
+    label = serializers.SlugRelatedField(many=False, read_only=True, slug_field='label')
+
+    class Meta:
+        model = PLIPTile
+        fields = ('x', 'y', 'width', 'height', 'label', 'score')
+
+
+class PLIPTileMapSerializer(serializers.ModelSerializer):
+    image_base64 = ReadOnlyField()
+    resolution = ReadOnlyField(help_text="Fraction of native resolution the tiles were classified at, 1 / scale. "
+                                         "Tiles always cover tile_size original pixels")
+
+    class Meta:
+        model = PLIPTileMap
+        exclude = ('id', 'submission', 'blob_image')
+
+
+class PLIPJobSerializer(serializers.ModelSerializer):
+    submission = PLIPSubmissionSerializer(read_only=True)
+    status_url = serializers.SerializerMethodField()
+
+    def get_status_url(self, obj) -> str:
+        return absolute_url(reverse('plip-job-status', kwargs={'pk': obj.pk}), self.context)
+
+    class Meta:
+        model = PLIPJob
+        fields = ('id', 'status', 'status_url', 'filename', 'error', 'created_at', 'started_at', 'finished_at',
+                  'submission')
 
 
 class PLIPAPICreateSerializer(serializers.Serializer):
     image = serializers.ImageField(required=True)
     expected_label = serializers.CharField(required=True, allow_blank=False, allow_null=True, max_length=255)
     labels = serializers.CharField(required=True, allow_blank=True, allow_null=False, max_length=255)
+    model = serializers.CharField(required=False, allow_blank=True, max_length=64,
+                                  help_text="Registry model name (default model if omitted)")
+
+
+class PLIPAPIBatchCreateSerializer(serializers.Serializer):
+    images = serializers.ListField(child=serializers.FileField(), required=False)
+    archive = serializers.FileField(required=False, help_text="zip or tar archive of image patches")
+    expected_label = serializers.CharField(required=False, allow_blank=False, allow_null=True, max_length=255)
+    labels = serializers.CharField(required=False, allow_blank=True, allow_null=False, max_length=255)
+    model = serializers.CharField(required=False, allow_blank=True, max_length=64,
+                                  help_text="Registry model name (default model if omitted)")
+
+    def validate(self, attrs):
+        if not attrs.get('images') and not attrs.get('archive'):
+            raise serializers.ValidationError("Provide image files, an archive, or both.")
+        return attrs
+
+
+class PLIPAPIBatchResultSerializer(serializers.Serializer):
+    filename = serializers.CharField()
+    error = serializers.CharField(required=False)
+    submission = PLIPSubmissionSerializer(required=False)
+
+
+class PLIPAPIBatchResponseSerializer(serializers.Serializer):
+    results = PLIPAPIBatchResultSerializer(many=True, help_text="A submission or an error per file, in upload order")
+
+
+class PLIPAPITiledCreateSerializer(serializers.Serializer):
+    # Plain FileField: ImageField validation would fully decode the large upload before tiling
+    image = serializers.FileField(required=True)
+    expected_label = serializers.CharField(required=False, allow_blank=False, allow_null=True, max_length=255)
+    labels = serializers.CharField(required=False, allow_blank=True, allow_null=False, max_length=255)
+    model = serializers.CharField(required=False, allow_blank=True, max_length=64,
+                                  help_text="Registry model name (default model if omitted)")
+    tile_size = serializers.IntegerField(required=False, min_value=32, max_value=2048)
+
+
+class PLIPAPITiledResultSerializer(serializers.Serializer):
+    submission = PLIPSubmissionSerializer()
+    tile_map = PLIPTileMapSerializer()
+    legend = serializers.DictField(child=serializers.CharField())
+    tiles = PLIPTileSerializer(many=True)
+
+
+class PLIPAPIReclassifySerializer(serializers.Serializer):
+    submission = serializers.IntegerField(required=True)
+    expected_label = serializers.CharField(required=False, allow_blank=False, allow_null=True, max_length=255)
+    labels = serializers.CharField(required=True, allow_blank=True, allow_null=False, max_length=255)
+    model = serializers.CharField(required=False, allow_blank=True, max_length=64,
+                                  help_text="Registry model name (default model if omitted)")
 
 
 class PLIPAPIListLabelSerializer(serializers.Serializer):
     label = serializers.CharField(required=True, allow_blank=False, allow_null=False, max_length=255)
     min = serializers.FloatField(required=False, allow_null=True)
     max = serializers.FloatField(required=False, allow_null=True)
+    top = serializers.BooleanField(required=False, default=False,
+                                   help_text="Bound the submission's top prediction rather than any of its scores")
 
 
 class PLIPAPIListInputSerializer(serializers.Serializer):
@@ -60,4 +216,183 @@ class PLIPAPIListInputSerializer(serializers.Serializer):
     min_date = serializers.DateField(required=False, allow_null=True,
                                      format='%Y-%m-%d %H:%M:%S', input_formats=['%Y-%m-%d', '%Y-%m-%d %H:%M:%S'])
     max_date = serializers.DateField(required=False, allow_null=True,
-                                     format='%Y-%m-%d %H:%M:%S', input_formats=['%Y-%m-%d', '%Y-%m-%d %H:%M:%S'])
\ No newline at end of file
+                                     format='%Y-%m-%d %H:%M:%S', input_formats=['%Y-%m-%d', '%Y-%m-%d %H:%M:%S'])
+    filter = serializers.JSONField(required=False, help_text=(
+        "Filter tree of {and: [...]}, {or: [...]}, {not: {...}}, {label, min, max}, {top, min, max} and {expected} "
+        "nodes, e.g. {\"and\": [{\"label\": \"tumor\", \"min\": 0.5}, "
+        "{\"not\": {\"label\": \"stroma\", \"min\": 0.2}}]}"))
+
+
+class PLIPAPIListOptionsSerializer(serializers.Serializer):
+    fields = serializers.CharField(required=False, allow_blank=True,
+                                   help_text="Comma separated submission fields to return, e.g. id,created_at,top_label")
+    scores = serializers.BooleanField(required=False, default=True,
+                                      help_text="Include the full score list of each submission")
+    thumbnails = serializers.ChoiceField(choices=THUMBNAIL_MODES, required=False, default='url',
+                                         help_text="Thumbnail URLs, inline base64 thumbnails, or neither")
+
+    def validate_fields(self, value):
+        fields = {name.strip() for name in value.split(',') if name.strip()}
+        unknown = fields - set(PLIPSubmissionSerializer().get_fields())
+        if unknown:
+            raise serializers.ValidationError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return fields or None
+
+
+class PLIPAPIListPageSerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False, allow_blank=True,
+                                   help_text="Cursor from the previous page's next link (first page if omitted)")
+    count = serializers.ChoiceField(choices=COUNT_MODES, required=False, default='none',
+                                    help_text="Leave out the total, count it exactly, reuse a cached count for the "
+                                              "same filters, or estimate it")
+
+    def validate_cursor(self, value):
+        if value:
+            try:
+                decode_cursor(value)
+            except ValueError as e:
+                raise serializers.ValidationError(str(e))
+        return value or None
+
+
+class PLIPAPIListPageResultSerializer(serializers.Serializer):
+    next = serializers.URLField(allow_null=True)
+    count = serializers.IntegerField(required=False)
+    count_approximate = serializers.BooleanField(required=False)
+    results = PLIPSubmissionSerializer(many=True)
+
+
+class PLIPAPISimilarSerializer(serializers.Serializer):
+    submission = serializers.IntegerField(required=False, help_text="Find images similar to this submission's image")
+    # Plain FileField: the upload is decoded at reduced scale by the ingestion service
+    image = serializers.FileField(required=False, help_text="Or find images similar to an uploaded image")
+    k = serializers.IntegerField(required=False, default=10, min_value=1, max_value=100)
+    method = serializers.ChoiceField(choices=('exact', 'ivf'), required=False,
+                                     help_text="Brute force scan or approximate IVF index (server default if omitted)")
+    nprobe = serializers.IntegerField(required=False, min_value=1, max_value=1024,
+                                      help_text="Inverted lists scanned by the IVF index")
+    model = serializers.CharField(required=False, allow_blank=True, max_length=64,
+                                  help_text="Registry model name (default model if omitted)")
+
+    def validate(self, attrs):
+        if ('submission' in attrs) == ('image' in attrs):
+            raise serializers.ValidationError("Provide either a submission id or an image.")
+        return attrs
+
+
+class PLIPAPISimilarImageSerializer(serializers.Serializer):
+    image = serializers.IntegerField(source='image.id')
+    md5 = serializers.CharField(source='image.md5')
+    similarity = serializers.FloatField()
+    latest_submission = serializers.IntegerField(source='image.latest_submission', allow_null=True)
+    thumbnail_url = serializers.SerializerMethodField()
+    image_base64 = serializers.CharField(source='image.image_base64')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        thumbnails = self.context.get('thumbnails', 'url')
+        if thumbnails != 'base64':
+            fields.pop('image_base64')
+        if thumbnails == 'none':
+            fields.pop('thumbnail_url')
+        return fields
+
+    def get_thumbnail_url(self, obj) -> str:
+        return absolute_url(obj['image'].thumbnail_url, self.context)
+
+
+class PLIPAPISimilarResultSerializer(serializers.Serializer):
+    model = serializers.CharField()
+    method = serializers.CharField()
+    results = PLIPAPISimilarImageSerializer(many=True)
+
+
+class PLIPAPITextSearchSerializer(serializers.Serializer):
+    query = serializers.CharField(required=True, allow_blank=False, max_length=300,
+                                  help_text="Free-text description, e.g. 'tumor budding at invasive front'")
+    model = serializers.CharField(required=False, allow_blank=True, max_length=64,
+                                  help_text="Registry model name (default model if omitted)")
+
+
+class PLIPAPITextSearchResultSerializer(serializers.Serializer):
+    similarity = serializers.FloatField()
+    submission = PLIPSubmissionSerializer()
+
+
+class PLIPAPITextSearchPageSerializer(serializers.Serializer):
+    count = serializers.IntegerField(help_text="Matches available to page through")
+    next = serializers.URLField(allow_null=True)
+    previous = serializers.URLField(allow_null=True)
+    results = PLIPAPITextSearchResultSerializer(many=True)
+
+
+class PLIPAPIExportOptionsSerializer(serializers.Serializer):
+    # Not named format, which REST framework reads to pick a renderer
+    file_format = serializers.ChoiceField(choices=FORMATS, required=False, default='csv',
+                                          help_text="CSV, JSON lines, or Parquet when pyarrow is installed")
+    layout = serializers.ChoiceField(choices=LAYOUTS, required=False, default='long',
+                                     help_text="A row per score, or a row per submission with a column per label")
+    columns = serializers.CharField(required=False, allow_blank=True, help_text=(
+        "Comma separated labels given a score column in the wide layout (every scored label if omitted)"))
+    thumbnails = serializers.BooleanField(required=False, default=False,
+                                          help_text="Add each thumbnail as a base64 column")
+
+    def validate_columns(self, value):
+        return [name.strip() for name in value.split(',') if name.strip()] or None
+
+
+class PLIPAPIAnalyticsInputSerializer(serializers.Serializer):
+    start = serializers.DateField(required=False, help_text="First day included (all history if omitted)")
+    end = serializers.DateField(required=False, help_text="Last day included (up to today if omitted)")
+    bucket = serializers.ChoiceField(choices=BUCKETS, required=False, default='week',
+                                     help_text="Period covered by each confidence histogram")
+    label = serializers.CharField(required=False, allow_blank=True, max_length=100,
+                                  help_text="Limit the histograms to submissions predicted as this label")
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("start must not be after end.")
+        return attrs
+
+
+class PLIPAnalyticsLabelSerializer(serializers.Serializer):
+    label = serializers.CharField()
+    support = serializers.IntegerField(help_text="Submissions expected to be this label")
+    predicted = serializers.IntegerField(help_text="Labelled submissions predicted as this label")
+    true_positives = serializers.IntegerField()
+    precision = serializers.FloatField(allow_null=True)
+    recall = serializers.FloatField(allow_null=True)
+
+
+class PLIPAnalyticsConfusionSerializer(serializers.Serializer):
+    expected = serializers.CharField()
+    predicted = serializers.CharField()
+    count = serializers.IntegerField()
+
+
+class PLIPAnalyticsHistogramSerializer(serializers.Serializer):
+    period = serializers.DateField(help_text="First day of the period")
+    counts = serializers.ListField(child=serializers.IntegerField(), help_text="Submissions per confidence bin")
+    correct = serializers.ListField(child=serializers.IntegerField(),
+                                    help_text="Labelled submissions per bin whose prediction matched")
+    incorrect = serializers.ListField(child=serializers.IntegerField(),
+                                      help_text="Labelled submissions per bin whose prediction did not match")
+
+
+class PLIPAPIAnalyticsSerializer(serializers.Serializer):
+    start = serializers.DateField(allow_null=True)
+    end = serializers.DateField(allow_null=True)
+    bucket = serializers.CharField()
+    label = serializers.CharField(allow_null=True, help_text="Predicted label the totals and histograms cover")
+    bin_edges = serializers.ListField(child=serializers.FloatField(),
+                                      help_text="Top prediction score edges of the histogram bins")
+    submissions = serializers.IntegerField(help_text="Submissions in the histograms")
+    labelled = serializers.IntegerField(help_text="Submissions in the histograms with an expected label")
+    accuracy = serializers.FloatField(allow_null=True,
+                                      help_text="Share of those labelled submissions predicted correctly")
+    overall_labelled = serializers.IntegerField(help_text="Submissions with an expected label, whatever the prediction")
+    overall_accuracy = serializers.FloatField(allow_null=True,
+                                              help_text="Share of all labelled submissions predicted correctly")
+    labels = PLIPAnalyticsLabelSerializer(many=True, help_text="Precision and recall of every label")
+    confusion = PLIPAnalyticsConfusionSerializer(many=True, help_text="Cells of the confusion matrix of every label")
+    histograms = PLIPAnalyticsHistogramSerializer(many=True)
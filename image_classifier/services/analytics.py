@@ -0,0 +1,250 @@
+import hashlib
+import json
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from ..models import PLIPConfidenceCount, PLIPConfusionCount, PLIPSubmission
+
+CONFIDENCE_BINS = 10
+BUCKETS = ('day', 'week', 'month')
+
+
+def confidence_bin(score) -> int:
+    """Equal-width bin of a top prediction score in [0, 1], with 1.0 in the last bin"""
+    return min(max(int(score * CONFIDENCE_BINS), 0), CONFIDENCE_BINS - 1)
+
+
+def period_start(day, bucket):
+    """First day of the day, ISO week or month containing day"""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def count_submissions(rows):
+    """
+    Tallies submissions into the keys of the two summary tables. Submissions without a prediction are skipped.
+
+    Args:
+        rows: iterable of (created_at, expected_label_id, predicted_label_id, predicted_score)
+
+    Returns:
+        tuple: (Counter of (day, expected_label_id, predicted_label_id),
+                Counter of (day, predicted_label_id, bin, outcome))
+    """
+    confusion, confidence = Counter(), Counter()
+    for created_at, expected_label_id, predicted_label_id, predicted_score in rows:
+        if predicted_label_id is None or predicted_score is None:
+            continue
+        day = timezone.localdate(created_at)
+        if expected_label_id is None:
+            outcome = PLIPConfidenceCount.UNLABELLED
+        else:
+            confusion[(day, expected_label_id, predicted_label_id)] += 1
+            outcome = (PLIPConfidenceCount.CORRECT if expected_label_id == predicted_label_id
+                       else PLIPConfidenceCount.INCORRECT)
+        confidence[(day, predicted_label_id, confidence_bin(predicted_score), outcome)] += 1
+    return confusion, confidence
+
+
+def _increment(model, key_fields, counts):
+    """
+    Adds counts to a summary table in one statement per table. The upsert adds to an existing row in place, so
+    concurrent writers never overwrite each other's counts.
+    """
+    if not counts:
+        return
+    quote_name = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in key_fields]
+    table, count = quote_name(model._meta.db_table), quote_name('count')
+    sql = (f"INSERT INTO {table} ({', '.join(quote_name(column) for column in columns)}, {count}) "
+           f"VALUES ({', '.join(['%s'] * (len(columns) + 1))}) "
+           f"ON CONFLICT ({', '.join(quote_name(column) for column in columns)}) "
+           f"DO UPDATE SET {count} = {table}.{count} + EXCLUDED.{count}")
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(*key, value) for key, value in counts.items()])
+
+
+def record_submissions(submissions):
+    """Adds newly saved submissions to the summary tables, within the transaction that saves them"""
+    confusion, confidence = count_submissions(
+        (submission.created_at, submission.expected_label_id, submission.predicted_label_id,
+         submission.predicted_score) for submission in submissions)
+    _increment(PLIPConfusionCount, ['day', 'expected_label', 'predicted_label'], confusion)
+    _increment(PLIPConfidenceCount, ['day', 'predicted_label', 'bin', 'outcome'], confidence)
+
+
+def _scan(after_id, up_to_id=None, chunk_size=5000):
+    """
+    Tallies submissions with ids in (after_id, up_to_id], reading them in keyset chunks by id
+
+    Returns:
+        tuple: (confusion Counter, confidence Counter, (number, sum of ids) of the submissions read)
+    """
+    confusion, confidence = Counter(), Counter()
+    scanned, id_sum = 0, 0
+    rows = PLIPSubmission.objects.order_by('id').values_list('id', 'created_at', 'expected_label_id',
+                                                             'predicted_label_id', 'predicted_score')
+    if up_to_id is not None:
+        rows = rows.filter(id__lte=up_to_id)
+    while True:
+        chunk = list(rows.filter(id__gt=after_id)[:chunk_size])
+        if not chunk:
+            return confusion, confidence, (scanned, id_sum)
+        chunk_confusion, chunk_confidence = count_submissions(row[1:] for row in chunk)
+        confusion.update(chunk_confusion)
+        confidence.update(chunk_confidence)
+        scanned += len(chunk)
+        id_sum += sum(row[0] for row in chunk)
+        after_id = chunk[-1][0]
+
+
+def _lock_summary_tables():
+    """
+    Holds off uploads adding to the summary tables until the current transaction ends. PostgreSQL takes a lock
+    that conflicts with their upserts but not with reads; SQLite's IMMEDIATE transactions already hold the write
+    lock from the start.
+    """
+    if connection.vendor == 'postgresql':
+        tables = ', '.join(connection.ops.quote_name(model._meta.db_table)
+                           for model in (PLIPConfusionCount, PLIPConfidenceCount))
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE")
+
+
+def rebuild_analytics(chunk_size=5000) -> int:
+    """
+    Recomputes both summary tables from the submissions, e.g. after submissions were deleted. The archive is
+    read outside any transaction; the tables are then replaced in one transaction that locks out uploads'
+    upserts and also counts the submissions saved meanwhile, so no upload's counts are lost or counted twice.
+
+    Returns:
+        int: submissions counted
+    """
+    last_id = PLIPSubmission.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    confusion, confidence, scanned = _scan(0, last_id, chunk_size)
+
+    with transaction.atomic():
+        # Uploads that incremented the tables commit before the lock is granted, later ones wait for the swap
+        _lock_summary_tables()
+
+        # Ids are not handed out in commit order on PostgreSQL, so uploads in flight when the scan began may have
+        # committed since with ids it already passed. Rare, and counted again from scratch while uploads wait
+        existing = PLIPSubmission.objects.filter(id__lte=last_id).aggregate(count=Count('id'), id_sum=Sum('id'))
+        if (existing['count'], existing['id_sum'] or 0) != scanned:
+            confusion, confidence, _ = _scan(0, last_id, chunk_size)
+
+        # Submissions saved during the scan were added to the rows about to be replaced
+        late_confusion, late_confidence, _ = _scan(last_id, chunk_size=chunk_size)
+        confusion.update(late_confusion)
+        confidence.update(late_confidence)
+
+        PLIPConfusionCount.objects.all().delete()
+        PLIPConfidenceCount.objects.all().delete()
+        PLIPConfusionCount.objects.bulk_create(
+            [PLIPConfusionCount(day=day, expected_label_id=expected_label_id, predicted_label_id=predicted_label_id,
+                                count=count) for (day, expected_label_id, predicted_label_id), count in
+             confusion.items()], batch_size=1000)
+        PLIPConfidenceCount.objects.bulk_create(
+            [PLIPConfidenceCount(day=day, predicted_label_id=predicted_label_id, bin=bin_index, outcome=outcome,
+                                 count=count) for (day, predicted_label_id, bin_index, outcome), count in
+             confidence.items()], batch_size=1000)
+
+    return sum(confidence.values())
+
+
+def analytics_summary(start=None, end=None, bucket='week', label=None) -> dict:
+    """
+    Agreement between predicted and expected labels from the summary tables alone, so the cost depends on the
+    number of days and labels rather than the size of the archive. Each summary is reused for
+    PLIP_ANALYTICS_CACHE_SECONDS.
+
+    Args:
+        start, end: inclusive date range, open ended when None
+        bucket: period of each confidence histogram, one of BUCKETS
+        label: predicted label the totals and histograms are limited to, all labels when None
+
+    Returns:
+        dict: submissions, labelled and accuracy within the label filter, the same totals over every label as
+        overall_labelled and overall_accuracy, per-label precision and recall and confusion matrix cells over
+        every label, and per-period histograms of the top prediction score split by outcome
+    """
+    key_data = json.dumps([start, end, bucket, label], default=str)
+    key = 'plip-analytics:' + hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+    summary = cache.get(key)
+    if summary is None:
+        summary = _summarize(start, end, bucket, label)
+        cache.set(key, summary, settings.PLIP_ANALYTICS_CACHE_SECONDS)
+    return summary
+
+
+def _summarize(start, end, bucket, label):
+    date_filters = {}
+    if start:
+        date_filters['day__gte'] = start
+    if end:
+        date_filters['day__lte'] = end
+
+    cells = list(PLIPConfusionCount.objects.filter(**date_filters)
+                 .values('expected_label__label', 'predicted_label__label')
+                 .annotate(total=Sum('count')).order_by('expected_label__label', 'predicted_label__label'))
+    confusion = [{'expected': cell['expected_label__label'], 'predicted': cell['predicted_label__label'],
+                  'count': cell['total']} for cell in cells]
+
+    support, predicted, true_positives = Counter(), Counter(), Counter()
+    for cell in confusion:
+        support[cell['expected']] += cell['count']
+        predicted[cell['predicted']] += cell['count']
+        if cell['expected'] == cell['predicted']:
+            true_positives[cell['expected']] += cell['count']
+    labels = [{'label': name, 'support': support[name], 'predicted': predicted[name],
+               'true_positives': true_positives[name],
+               'precision': true_positives[name] / predicted[name] if predicted[name] else None,
+               'recall': true_positives[name] / support[name] if support[name] else None}
+              for name in sorted(support.keys() | predicted.keys())]
+
+    counts = PLIPConfidenceCount.objects.filter(**date_filters)
+    if label:
+        counts = counts.filter(predicted_label__label__iexact=label)
+    # Grouped by day in the database and into periods here; truncating dates in SQL is a per-row function call
+    # on SQLite
+    rows = counts.values('day', 'bin', 'outcome').annotate(total=Sum('count')).order_by('day')
+
+    histograms = {}
+    for row in rows:
+        period = period_start(row['day'], bucket)
+        histogram = histograms.setdefault(period, {
+            'period': period, 'counts': [0] * CONFIDENCE_BINS,
+            PLIPConfidenceCount.CORRECT: [0] * CONFIDENCE_BINS, PLIPConfidenceCount.INCORRECT: [0] * CONFIDENCE_BINS})
+        histogram['counts'][row['bin']] += row['total']
+        if row['outcome'] != PLIPConfidenceCount.UNLABELLED:
+            histogram[row['outcome']][row['bin']] += row['total']
+
+    # Totals of the histograms, so they are limited to the label like the histograms are
+    correct = sum(sum(histogram[PLIPConfidenceCount.CORRECT]) for histogram in histograms.values())
+    labelled = correct + sum(sum(histogram[PLIPConfidenceCount.INCORRECT]) for histogram in histograms.values())
+    overall_labelled = sum(support.values())
+    overall_correct = sum(true_positives.values())
+    return {
+        'start': start,
+        'end': end,
+        'bucket': bucket,
+        'label': label,
+        'bin_edges': [index / CONFIDENCE_BINS for index in range(CONFIDENCE_BINS + 1)],
+        'submissions': sum(sum(histogram['counts']) for histogram in histograms.values()),
+        'labelled': labelled,
+        'accuracy': correct / labelled if labelled else None,
+        'overall_labelled': overall_labelled,
+        'overall_accuracy': overall_correct / overall_labelled if overall_labelled else None,
+        'labels': labels,
+        'confusion': confusion,
+        'histograms': list(histograms.values()),
+    }
@@ -0,0 +1,122 @@
+import hashlib
+import tarfile
+import zipfile
+from itertools import islice
+from pathlib import PurePosixPath
+
+from django.conf import settings
+
+from .decode import decode_upload, make_thumbnail
+from .embeddings import get_stored_embedding
+from .result_cache import apply_cached_results
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.webp')
+
+
+def _archive_members(archive_file):
+    """
+    Yields (filename, read) for every image member of a zip or tar archive, where read() returns the member's
+    bytes and is only valid until the next member. Hidden files, directories and members over
+    PLIP_BATCH_MAX_MEMBER_BYTES are skipped.
+    """
+    max_member_bytes = getattr(settings, 'PLIP_BATCH_MAX_MEMBER_BYTES', 25 * 1024 * 1024)
+
+    def wanted(name, size):
+        path = PurePosixPath(name)
+        return (path.suffix.lower() in IMAGE_EXTENSIONS and size <= max_member_bytes
+                and not any(part.startswith(('.', '__MACOSX')) for part in path.parts))
+
+    archive_file.seek(0)
+    if zipfile.is_zipfile(archive_file):
+        archive_file.seek(0)
+        with zipfile.ZipFile(archive_file) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and wanted(info.filename, info.file_size):
+                    yield PurePosixPath(info.filename).name, lambda: archive.read(info)
+        return
+
+    archive_file.seek(0)
+    with tarfile.open(fileobj=archive_file, mode='r:*') as archive:
+        for member in archive:
+            if member.isfile() and wanted(member.name, member.size):
+                yield PurePosixPath(member.name).name, lambda: archive.extractfile(member).read()
+
+
+def count_archive_files(archive_file) -> int:
+    """Number of image members iter_archive_files() yields, counted from the member headers without reading them"""
+    return sum(1 for _ in _archive_members(archive_file))
+
+
+def iter_archive_files(archive_file):
+    """
+    Yields (filename, bytes) for every image member of a zip or tar archive, reading one member at a time.
+    Hidden files, directories and members over PLIP_BATCH_MAX_MEMBER_BYTES are skipped.
+    """
+    for filename, read in _archive_members(archive_file):
+        yield filename, read()
+
+
+def classify_files(files, labels, classifier, chunk_size=32):
+    """
+    Classifies (filename, bytes) pairs, taking cached results and stored embeddings where they exist and running
+    the rest through batched vision forwards of up to chunk_size images. Files that cannot be decoded get an
+    'error' entry.
+    files may be any iterable and is consumed chunk_size files at a time, so only one chunk of file contents
+    and decoded images is held in memory, about chunk_size * PLIP_BATCH_MAX_MEMBER_BYTES at most, however many
+    files there are.
+
+    Returns:
+        list: one dict per file with filename, md5, image_obj, embedding, thumbnail and prediction or error
+    """
+    results = []
+    # Embedding and thumbnail, or error, of every file decoded so far by md5, shared by duplicates in later chunks
+    encoded = {}
+    files = iter(files)
+    while chunk := list(islice(files, chunk_size)):
+        results.extend(_classify_chunk(chunk, labels, classifier, encoded))
+    return results
+
+
+def _classify_chunk(files, labels, classifier, encoded):
+    results = [{'filename': filename, 'md5': hashlib.md5(content).hexdigest(), 'image_obj': None}
+               for filename, content in files]
+    apply_cached_results(results, labels, classifier)
+    pending = {}
+
+    for result, (filename, content) in zip(results, files):
+        if result.get('cached') or result['md5'] in encoded:
+            continue
+
+        stored_embedding = get_stored_embedding(result['md5'], classifier)
+        if stored_embedding:
+            result['image_obj'], result['embedding'] = stored_embedding
+            result['embedding_stored'] = True
+        else:
+            # Duplicate files in one batch share a single decode and forward
+            pending.setdefault(result['md5'], content)
+
+    decoded = {}
+    for md5_checksum, content in pending.items():
+        try:
+            decoded[md5_checksum] = decode_upload(content)
+        except Exception as e:
+            encoded[md5_checksum] = {'error': f"Error processing image: {str(e)}"}
+
+    if decoded:
+        embeddings = classifier.embed_images(list(decoded.values()))
+        for (md5_checksum, pil_img), embedding in zip(decoded.items(), embeddings):
+            encoded[md5_checksum] = {'embedding': embedding, 'thumbnail': make_thumbnail(pil_img)}
+
+    for result in results:
+        if 'embedding' not in result and not result.get('cached'):
+            result.update(encoded[result['md5']])
+
+    scored = [result for result in results if 'error' not in result and not result.get('cached')]
+    if scored:
+        predictions = classifier.score_embeddings([result['embedding'] for result in scored], labels)
+        for result, prediction in zip(scored, predictions):
+            result['prediction'] = prediction
+
+    return results
+
@@ -0,0 +1,115 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of a batched embedding function.
+    Images submitted by concurrent request threads are collected for up to max_wait_ms or until
+    max_batch_size is reached, run through one forward pass, and the results fanned back out to the callers.
+    Callers may pass their own embed_fn per image, e.g. the bound embed_images of the model they resolved;
+    a collected batch then runs one forward per distinct function.
+    """
+
+    def __init__(self, embed_fn=None, max_batch_size=8, max_wait_ms=5.0):
+        self._embed_fn = embed_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, image, embed_fn=None) -> Future:
+        """Queues an image for the next batch and returns a future resolving to its embedding"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((image, embed_fn or self._embed_fn, future))
+        return future
+
+    def embed(self, image, embed_fn=None, timeout=None):
+        """Blocks until the image has been embedded as part of a batch"""
+        return self.submit(image, embed_fn).result(timeout=timeout)
+
+    def _ensure_worker(self):
+        # Worker threads do not survive a fork, so restart the worker in each gunicorn child process
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='plip-batch-scheduler', daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self):
+        """Waits for a first image, then gathers more until the batch is full or the wait window closes"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window closed, but still take anything already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            groups = {}
+            for image, embed_fn, future in self._collect_batch():
+                groups.setdefault(embed_fn, []).append((image, future))
+
+            for embed_fn, group in groups.items():
+                try:
+                    embeddings = embed_fn([image for image, future in group])
+                    # zip() would otherwise leave the callers past the last row waiting forever
+                    if len(embeddings) != len(group):
+                        raise ValueError(f"Embedding function returned {len(embeddings)} rows for {len(group)} images")
+                except Exception as e:
+                    for image, future in group:
+                        future.set_exception(e)
+                    continue
+
+                for (image, future), embedding in zip(group, embeddings):
+                    future.set_result(embedding)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> BatchScheduler:
+    """
+    Returns the process-wide scheduler. Callers pass the embed_images of the classifier they resolved,
+    so a hot-swapped model never embeds an image its caller will record under the previous revision.
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BatchScheduler(
+                max_batch_size=getattr(settings, 'PLIP_BATCH_MAX_SIZE', 8),
+                max_wait_ms=getattr(settings, 'PLIP_BATCH_MAX_WAIT_MS', 5.0),
+            )
+    return _scheduler
+
+
+def embed_image(image, classifier):
+    """
+    Embeds one image, batched with concurrent requests of this process for an in-process model. A remote
+    classifier goes straight to the inference server, which already batches requests across workers, so waiting
+    for a batch here would only add latency.
+    """
+    if classifier.remote:
+        return classifier.embed_images([image])[0]
+    return get_scheduler().embed(image, classifier.embed_images)
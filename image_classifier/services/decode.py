@@ -0,0 +1,101 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from django.conf import settings
+
+
+# CLIP input geometry and normalization, as in the vinid/plip preprocessor config
+MODEL_INPUT_SIZE = 224
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+THUMBNAIL_SIZE = (224, 224)
+
+
+def check_dimensions(size, max_pixels=None):
+    """Raises ValueError for images with no pixels or more than max_pixels (default PLIP_MAX_IMAGE_PIXELS)"""
+    if max_pixels is None:
+        max_pixels = getattr(settings, 'PLIP_MAX_IMAGE_PIXELS', 50_000_000)
+
+    width, height = size
+    if not width or not height:
+        raise ValueError("Image has no pixels")
+    if width * height > max_pixels:
+        raise ValueError(f"Image of {width}x{height} pixels is over the {max_pixels} pixel limit")
+
+
+def header_size(head: bytes):
+    """Returns (width, height) parsed from the leading bytes of an image file, or None if they are not enough"""
+    try:
+        with Image.open(io.BytesIO(head)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def decode_upload(source, target=MODEL_INPUT_SIZE, max_pixels=None):
+    """
+    Decodes an upload straight to a reduced RGB image whose shortest edge is still at least target pixels.
+    The header is read first and images over max_pixels are rejected before any pixel data is decoded.
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale by the DCT decoder via draft(); other formats are
+    box-reduced by an integer factor that keeps at least twice the target resolution for the final resample.
+
+    Args:
+        source: bytes, a path or a file-like object
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif hasattr(source, 'seek'):
+        source.seek(0)
+
+    image = Image.open(source)
+    check_dimensions(image.size, max_pixels)
+
+    if image.format == 'JPEG':
+        image.draft('RGB', (target, target))
+    image.load()
+    # Palette indices and 1-bit or 16-bit samples can not be box-averaged, so those are converted before reducing
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    factor = min(image.size) // (target * 2)
+    if factor >= 2:
+        image = image.reduce(factor)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def fit_to_model(image, size=MODEL_INPUT_SIZE):
+    """Resizes the shortest edge to size with bicubic resampling and center crops to size x size"""
+    width, height = image.size
+    if (width, height) == (size, size):
+        return image
+
+    if width <= height:
+        resized = (size, int(size * height / width))
+    else:
+        resized = (int(size * width / height), size)
+    image = image.resize(resized, Image.Resampling.BICUBIC)
+
+    left, top = (resized[0] - size) // 2, (resized[1] - size) // 2
+    return image.crop((left, top, left + size, top + size))
+
+
+def to_pixel_values(images, size=MODEL_INPUT_SIZE) -> np.ndarray:
+    """Builds the normalized float32 NCHW model input for a batch of RGB images in one vectorized pass"""
+    batch = np.stack([np.asarray(fit_to_model(image, size), dtype=np.uint8) for image in images])
+    pixel_values = (batch.astype(np.float32) * np.float32(1 / 255) - CLIP_MEAN) / CLIP_STD
+    return np.ascontiguousarray(pixel_values.transpose(0, 3, 1, 2))
+
+
+def make_thumbnail(image) -> bytes:
+    """JPEG thumbnail of at most 224px from the already reduced decode, leaving the image itself untouched"""
+    thumbnail = image.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG")
+    return buffer.getvalue()
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+from ..models import PLIPImageEmbedding
+from .vector_index import append_embeddings
+
+
+def get_stored_embedding(md5_checksum: str, classifier):
+    """
+    Looks up the embedding stored for an image md5 by the classifier's model revision and precision.
+
+    Returns:
+        tuple: (PLIPImage, np.ndarray) or None if the image has not been embedded by this model yet
+    """
+    embedding_obj = (PLIPImageEmbedding.objects.select_related('image')
+                     .filter(image__md5=md5_checksum, model_id=classifier.model_id,
+                             model_revision=classifier.model_revision, precision=classifier.precision)
+                     .first())
+
+    if embedding_obj is None:
+        return None
+    return embedding_obj.image, embedding_obj.embedding
+
+
+def get_stored_embeddings(image_ids, classifier) -> dict:
+    """Embeddings stored by the classifier's model revision and precision, mapped by image id"""
+    embedding_objs = (PLIPImageEmbedding.objects
+                      .filter(image_id__in=image_ids, model_id=classifier.model_id,
+                              model_revision=classifier.model_revision, precision=classifier.precision)
+                      .only('image_id', 'dtype', 'vector'))
+    return {embedding_obj.image_id: embedding_obj.embedding for embedding_obj in embedding_objs}
+
+
+def store_embeddings(image_ids, embeddings, classifier, batch_size=500):
+    """
+    Persists image embeddings in the configured compact dtype with one insert per batch_size rows, keeping any
+    existing row for the same image and model. Only the rows actually inserted, as reported by RETURNING, are
+    added to the model's similarity search store once the transaction commits, so an image stored concurrently
+    by another worker is never indexed twice.
+    """
+    dtype = getattr(settings, 'PLIP_EMBEDDING_DTYPE', 'float16')
+    quote_name = connection.ops.quote_name
+    fields = ['image', 'model_id', 'model_revision', 'precision', 'dtype', 'vector']
+    columns = [quote_name(PLIPImageEmbedding._meta.get_field(name).column) for name in fields]
+    row = f"({', '.join(['%s'] * len(columns))})"
+
+    rows = [(image_id, classifier.model_id, classifier.model_revision, classifier.precision, dtype,
+             embedding.astype(dtype).tobytes()) for image_id, embedding in zip(image_ids, embeddings)]
+    inserted = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(f"INSERT INTO {quote_name(PLIPImageEmbedding._meta.db_table)} ({', '.join(columns)}) "
+                           f"VALUES {', '.join([row] * len(batch))} "
+                           f"ON CONFLICT ({', '.join(columns[:4])}) DO NOTHING RETURNING {columns[0]}",
+                           [value for values in batch for value in values])
+            inserted.update(image_id for image_id, in cursor.fetchall())
+
+    new = [(image_id, embedding) for image_id, embedding in zip(image_ids, embeddings) if image_id in inserted]
+    if new:
+        model_key = classifier.model_key
+        new_ids, new_embeddings = [image_id for image_id, _ in new], [embedding for _, embedding in new]
+        transaction.on_commit(lambda: append_embeddings(model_key, new_ids, new_embeddings))
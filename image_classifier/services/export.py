@@ -0,0 +1,234 @@
+import csv
+import io
+import json
+from itertools import chain
+
+from django.db.models import Exists, OuterRef, Prefetch
+
+from ..models import PLIPLabel, PLIPScore
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+LAYOUTS = ('long', 'wide')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+SUBMISSION_COLUMNS = ['submission_id', 'created_at', 'filename', 'md5', 'user_id', 'expected_label',
+                      'predicted_label', 'predicted_score', 'model_id', 'model_revision', 'precision']
+# Text written at a time to the response, so a long export is not sent one row per chunk
+WRITE_SIZE = 64 * 1024
+
+
+class ExportError(ValueError):
+    pass
+
+
+def export_queryset(queryset, thumbnails=False):
+    """
+    Submissions in id order with only the columns an export reads. Image blobs are left out unless thumbnails
+    are exported, and each chunk of the iterator prefetches its scores and their label names in one query.
+    """
+    fields = ['id', 'created_at', 'filename', 'user', 'model_id', 'model_revision', 'precision', 'predicted_score',
+              'image', 'image__md5', 'expected_label', 'expected_label__label', 'predicted_label',
+              'predicted_label__label']
+    if thumbnails:
+        fields.append('image__blob_image')
+    scores = (PLIPScore.objects.select_related('label').only('submission', 'score', 'label', 'label__label')
+              .order_by('-score', 'id'))
+    return (queryset.order_by('id').select_related('image', 'expected_label', 'predicted_label').only(*fields)
+            .prefetch_related(Prefetch('submission_scores', queryset=scores)))
+
+
+def scored_labels(queryset) -> list:
+    """Names of the labels scored for any submission of the queryset, the columns of a wide export"""
+    scored = PLIPScore.objects.filter(label_id=OuterRef('pk'), submission__in=queryset.order_by().values('pk'))
+    return list(PLIPLabel.objects.filter(Exists(scored)).order_by('label').values_list('label', flat=True))
+
+
+def export_columns(layout, labels=(), thumbnails=False) -> list:
+    """Column names of an export: the submission, then label and score or one score_<label> column per label"""
+    columns = list(SUBMISSION_COLUMNS)
+    if thumbnails:
+        columns.append('thumbnail_base64')
+    if layout == 'long':
+        return columns + ['label', 'score']
+    return columns + [f'score_{label}' for label in labels]
+
+
+def iter_rows(queryset, layout='long', labels=(), thumbnails=False, chunk_size=2000):
+    """
+    Yields export rows as dicts, reading chunk_size submissions per query so memory does not grow with the
+    export. Long rows are one per score, highest first, and a single row with no label or score for a submission
+    without scores; wide rows are one per submission with a score for each of labels, None where a label was not
+    scored.
+    """
+    for submission in export_queryset(queryset, thumbnails).iterator(chunk_size=chunk_size):
+        row = {
+            'submission_id': submission.id,
+            'created_at': submission.created_at,
+            'filename': submission.filename,
+            'md5': submission.image.md5,
+            'user_id': submission.user_id,
+            'expected_label': submission.expected_label.label if submission.expected_label else None,
+            'predicted_label': submission.predicted_label.label if submission.predicted_label else None,
+            'predicted_score': submission.predicted_score,
+            'model_id': submission.model_id,
+            'model_revision': submission.model_revision,
+            'precision': submission.precision,
+        }
+        if thumbnails:
+            row['thumbnail_base64'] = submission.image.image_base64
+
+        scores = submission.submission_scores.all()
+        if layout == 'long':
+            for score in scores:
+                yield {**row, 'label': score.label.label, 'score': score.score}
+            if not scores:
+                yield {**row, 'label': None, 'score': None}
+        else:
+            by_label = {score.label.label: score.score for score in scores}
+            yield {**row, **{f'score_{label}': by_label.get(label) for label in labels}}
+
+
+def _batched(lines):
+    """Joins lines of text into writes of about WRITE_SIZE characters"""
+    batch, size = [], 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= WRITE_SIZE:
+            yield ''.join(batch)
+            batch, size = [], 0
+    if batch:
+        yield ''.join(batch)
+
+
+class _Echo:
+    """File-like object that returns what is written to it, so csv.writer hands back each formatted line"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def write_csv(rows, columns):
+    writer = csv.writer(_Echo())
+    lines = (writer.writerow([_csv_value(row[column]) for column in columns]) for row in rows)
+    yield from _batched(chain([writer.writerow(columns)], lines))
+
+
+def write_jsonl(rows, columns):
+    yield from _batched(json.dumps({column: row[column] for column in columns}, default=_json_default) + '\n'
+                        for row in rows)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only stream that keeps what was written until it is taken, for a Parquet writer to stream into"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def write_parquet(rows, columns, row_group_size=10000):
+    """
+    Streams rows as a Parquet file, one row group of row_group_size rows at a time. pyarrow is imported here so
+    the other formats keep working where it is not installed.
+
+    Raises:
+        ExportError: if pyarrow is not installed, before anything is written
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportError("Parquet exports need pyarrow, install it with pip install pyarrow")
+
+    types = {'submission_id': pyarrow.int64(), 'user_id': pyarrow.int64(),
+             'created_at': pyarrow.timestamp('us', tz='UTC'), 'predicted_score': pyarrow.float64(),
+             'score': pyarrow.float64()}
+    schema = pyarrow.schema([(column, types.get(column, pyarrow.float64() if column.startswith('score_')
+                                                else pyarrow.string())) for column in columns])
+
+    def generate():
+        sink = _ChunkSink()
+        with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= row_group_size:
+                    writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                    batch = []
+                    yield sink.take()
+            if batch:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+        yield sink.take()
+
+    return generate()
+
+
+def export_submissions(queryset, format='csv', layout='long', labels=None, thumbnails=False, chunk_size=2000):
+    """
+    Streams the submissions of a queryset with their scores as CSV or JSONL text, or Parquet bytes. Submissions
+    are read in id order, chunk_size at a time with one query for their scores, so memory stays flat however
+    many rows are exported.
+
+    Args:
+        queryset: PLIPSubmission queryset, e.g. filtered with list_filter
+        format: one of FORMATS
+        layout: 'long' for a row per score, 'wide' for a row per submission with a score_<label> column per label
+        labels: label columns of a wide export, every label scored in the queryset when None
+        thumbnails: add each thumbnail as base64, read from the thumbnail store or the database
+
+    Returns:
+        tuple: (column names, iterator of str or bytes)
+
+    Raises:
+        ExportError: for an unknown format or layout, or a Parquet export without pyarrow installed
+    """
+    if format not in FORMATS:
+        raise ExportError(f"format must be one of {', '.join(FORMATS)}")
+    if layout not in LAYOUTS:
+        raise ExportError(f"layout must be one of {', '.join(LAYOUTS)}")
+
+    if layout == 'wide' and labels is None:
+        labels = scored_labels(queryset)
+    columns = export_columns(layout, labels or (), thumbnails)
+    rows = iter_rows(queryset, layout, labels or (), thumbnails, chunk_size)
+
+    if format == 'parquet':
+        return columns, write_parquet(rows, columns)
+    if format == 'jsonl':
+        return columns, write_jsonl(rows, columns)
+    return columns, write_csv(rows, columns)
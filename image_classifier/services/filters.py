@@ -0,0 +1,156 @@
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+
+from ..models import PLIPLabel, PLIPScore
+
+# Above this many matching labels the ids are selected in a subquery rather than inlined as parameters
+MAX_INLINE_LABEL_IDS = 500
+
+
+PREDICATE_KINDS = ('label', 'top', 'expected')
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _predicate_key(node):
+    """(kind, text) of a label, top or expected predicate"""
+    kind = next(kind for kind in PREDICATE_KINDS if kind in node)
+    return kind, node[kind].strip()
+
+
+def _walk(node, predicates, depth=0):
+    """Validates a filter tree and collects its label and expected label predicates"""
+    if depth > 16:
+        raise FilterError("Filter groups are nested too deeply")
+    if not isinstance(node, dict) or len(node.keys() & {'and', 'or', 'not', *PREDICATE_KINDS}) != 1:
+        raise FilterError("Each filter must be one of and, or, not, label, top or expected")
+
+    if 'and' in node or 'or' in node:
+        children = node.get('and', node.get('or'))
+        if not isinstance(children, list):
+            raise FilterError("and/or groups take a list of filters")
+        for child in children:
+            _walk(child, predicates, depth + 1)
+    elif 'not' in node:
+        _walk(node['not'], predicates, depth + 1)
+    else:
+        text = next(node[kind] for kind in PREDICATE_KINDS if kind in node)
+        if not isinstance(text, str) or not text.strip():
+            raise FilterError("label, top and expected filters take a non-empty label")
+        for bound in ('min', 'max'):
+            if node.get(bound) not in (None, ''):
+                try:
+                    float(node[bound])
+                except (TypeError, ValueError):
+                    raise FilterError(f"{bound} must be a number")
+        predicates.append(node)
+
+    if len(predicates) > settings.PLIP_FILTER_MAX_PREDICATES:
+        raise FilterError(f"A filter may use at most {settings.PLIP_FILTER_MAX_PREDICATES} labels")
+
+
+def resolve_labels(predicates) -> dict:
+    """
+    Ids of the labels each predicate's text matches, from one query over the small label table:
+    label and top filters match label names containing the text and expected filters match the name exactly,
+    both case-insensitively.
+
+    Returns:
+        dict: ('label', 'top' or 'expected', text) mapped to a list of label ids
+    """
+    keys = {_predicate_key(node) for node in predicates}
+    if not keys:
+        return {}
+
+    lookups = [Q(label__iexact=text) if kind == 'expected' else Q(label__icontains=text) for kind, text in keys]
+    labels = PLIPLabel.objects.filter(reduce(or_, lookups)).values_list('id', 'label')
+
+    resolved = {key: [] for key in keys}
+    for label_id, label in labels:
+        for kind, text in keys:
+            if (text.lower() == label.lower()) if kind == 'expected' else (text.lower() in label.lower()):
+                resolved[(kind, text)].append(label_id)
+    return resolved
+
+
+def _compile(node, resolved) -> Q:
+    if 'and' in node:
+        return reduce(and_, [_compile(child, resolved) for child in node['and']], Q())
+    if 'or' in node:
+        children = [_compile(child, resolved) for child in node['or']]
+        return reduce(or_, children) if children else Q()
+    if 'not' in node:
+        return ~_compile(node['not'], resolved)
+
+    kind, text = _predicate_key(node)
+    label_ids = resolved[(kind, text)]
+    if not label_ids:
+        return Q(pk__in=[])
+    if kind == 'expected':
+        return Q(expected_label_id__in=label_ids)
+    if len(label_ids) > MAX_INLINE_LABEL_IDS:
+        label_ids = PLIPLabel.objects.filter(label__icontains=text).values('id')
+
+    if kind == 'top':
+        # The stored top prediction, a range scan of the (predicted_label, predicted_score) index
+        q_top = Q(predicted_label_id__in=label_ids)
+        if node.get('min') not in (None, ''):
+            q_top &= Q(predicted_score__gte=float(node['min']))
+        if node.get('max') not in (None, ''):
+            q_top &= Q(predicted_score__lte=float(node['max']))
+        return q_top
+
+    scores = PLIPScore.objects.filter(submission_id=OuterRef('pk'), label_id__in=label_ids)
+    if node.get('min') not in (None, ''):
+        scores = scores.filter(score__gte=float(node['min']))
+    if node.get('max') not in (None, ''):
+        scores = scores.filter(score__lte=float(node['max']))
+    return Q(Exists(scores))
+
+
+def compile_filter(tree) -> Q:
+    """
+    Compiles a filter tree into a Q over PLIPSubmission. Nodes are:
+    {'and': [...]}, {'or': [...]}, {'not': node}, {'label': text, 'min': score, 'max': score} for a score of a
+    label containing text within the bounds, {'top': text, 'min': score, 'max': score} for a top prediction of
+    such a label, and {'expected': text} for an expected label named text.
+
+    Label texts are resolved to label ids first, so each score predicate is a correlated EXISTS on
+    PLIPScore (submission, label, score) instead of a join, and each top prediction predicate reads the
+    submission's own predicted label columns. Rows are never multiplied and no DISTINCT is needed.
+
+    Raises:
+        FilterError: if the tree is malformed or uses more than PLIP_FILTER_MAX_PREDICATES labels
+    """
+    if not tree:
+        return Q()
+    predicates = []
+    _walk(tree, predicates)
+    return _compile(tree, resolve_labels(predicates))
+
+
+def list_filter(data) -> Q:
+    """
+    Q over PLIPSubmission for the list view's validated input: min_date AND max_date AND the labels list,
+    a shorthand for an OR group of label or top predicates, AND the filter tree.
+
+    Raises:
+        FilterError: if the filter tree is malformed or uses too many labels
+    """
+    q_and_objects = Q()
+    if data.get('min_date'):
+        q_and_objects &= Q(created_at__gte=data['min_date'])
+    if data.get('max_date'):
+        q_and_objects &= Q(created_at__lte=data['max_date'])
+
+    labels = data.get('labels')
+    tree = {'and': [{'or': [{'top' if obj.get('top') else 'label': obj['label'], 'min': obj.get('min'),
+                             'max': obj.get('max')} for obj in labels]}] if labels else []}
+    if data.get('filter'):
+        tree['and'].append(data['filter'])
+    return q_and_objects & compile_filter(tree)
@@ -0,0 +1,42 @@
+from django.conf import settings
+
+
+class InferenceUnavailable(Exception):
+    """Raised when a process whose deployment role excludes inference is asked to classify"""
+    pass
+
+
+def inference_enabled() -> bool:
+    return getattr(settings, 'PLIP_DEPLOYMENT_ROLE', 'full') != 'browse'
+
+
+def get_classifier(name=None):
+    """
+    Returns the classifier for a registry model name, or the default model, on the configured inference backend.
+    'local' loads models into this process, 'remote' talks to the shared inference server and never imports torch.
+    Torch and transformers are only imported here, on first use, so processes that never classify never load them.
+    """
+    if not inference_enabled():
+        raise InferenceUnavailable("Classification is not served by this browse-only process")
+
+    if getattr(settings, 'PLIP_INFERENCE_BACKEND', 'local') == 'remote':
+        from .inference_client import RemotePLIPClassifier
+        return RemotePLIPClassifier(name)
+
+    from .registry import get_registry
+    return get_registry().get(name)
+
+
+def warm_up():
+    """
+    Loads the local model ahead of the first request in server processes.
+    Called from the WSGI entry point rather than AppConfig.ready(), so migrate, collectstatic
+    and other management commands do not import torch.
+    """
+    if not inference_enabled() or getattr(settings, 'PLIP_INFERENCE_BACKEND', 'local') != 'local':
+        return
+
+    try:
+        get_classifier()
+    except Exception as e:
+        print(f"Could not ready PLIPClassifier {e}")
@@ -0,0 +1,129 @@
+import socket
+import threading
+
+import numpy as np
+
+from django.conf import settings
+
+from . import inference_protocol as protocol
+from .decode import fit_to_model
+from .scoring import DEFAULT_LABELS, EmbeddingScorer
+
+
+class InferenceServerError(Exception):
+    pass
+
+
+class InferenceServerBusy(InferenceServerError):
+    pass
+
+
+class RemotePLIPClassifier(EmbeddingScorer):
+    """
+    Client for one registry model of the shared PLIP inference server, exposing the same interface as
+    PLIPClassifier without importing torch. Label embeddings are cached locally, so only image embedding needs
+    a round trip. Every response carries the key of the model that produced it; when the server has hot swapped
+    the model, the client refreshes its identity and drops label embeddings of the old weights.
+    """
+    remote = True
+    _instances = {}
+    _instance_lock = threading.Lock()
+
+    def __new__(cls, name=None):
+        """One client per process and model name; each thread keeps its own persistent connection"""
+        with cls._instance_lock:
+            if name not in cls._instances:
+                # Only keep the instance once the server has answered, so a later call can retry
+                instance = super(RemotePLIPClassifier, cls).__new__(cls)
+                instance._initialize_client(name)
+                cls._instances[name] = instance
+        return cls._instances[name]
+
+    def _initialize_client(self, name):
+        self.name = name
+        self.socket_path = getattr(settings, 'PLIP_INFERENCE_SOCKET', '/run/plip/inference.sock')
+        self.timeout = getattr(settings, 'PLIP_INFERENCE_TIMEOUT', 30)
+        self._local = threading.local()
+        self._init_text_cache()
+        self._refresh_identity()
+
+        self.embed_labels(DEFAULT_LABELS)
+
+    def _refresh_identity(self):
+        info = self.health()
+        self.model_id = info['model_id']
+        self.model_revision = info['model_revision']
+        self.precision = info.get('precision', 'fp32')
+        self.logit_scale = info['logit_scale']
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _drop_connection(self, sock):
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _request(self, op, payload=b''):
+        # Retry once on a fresh connection when the connection was reset or refused, in case the server restarted
+        # since the last request. A timeout is not retried: a second wait would outlast the web worker's timeout
+        for attempt in range(2):
+            sock = getattr(self._local, 'sock', None)
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                protocol.send_message(sock, op, payload)
+                message = protocol.recv_message(sock)
+                if message is None:
+                    raise ConnectionError("Inference server closed the connection")
+                break
+            except TimeoutError as e:
+                # The answer may still arrive, so the connection can not be reused
+                self._drop_connection(sock)
+                raise InferenceServerBusy(f"Inference server did not answer within {self.timeout}s") from e
+            except ConnectionError as e:
+                self._drop_connection(sock)
+                if attempt:
+                    raise InferenceServerError(f"Inference server unavailable: {e}") from e
+            except (OSError, protocol.ProtocolError) as e:
+                self._drop_connection(sock)
+                raise InferenceServerError(f"Inference server unavailable: {e}") from e
+
+        status, response = message
+        if status == protocol.STATUS_BUSY:
+            raise InferenceServerBusy(response.decode('utf-8'))
+        if status != protocol.STATUS_OK:
+            raise InferenceServerError(response.decode('utf-8'))
+        return response
+
+    def health(self) -> dict:
+        return protocol.unpack_json(self._request(protocol.OP_HEALTH, (self.name or '').encode('utf-8')))
+
+    def _request_named(self, op, payload):
+        """Sends a request for this client's model and returns the payload, following a server side swap"""
+        model_key, response = protocol.unpack_named(self._request(op, protocol.pack_named(self.name, payload)))
+        if model_key != self.model_key:
+            with self._text_cache_lock:
+                self._text_cache.clear()
+                self._query_cache.clear()
+            self._refresh_identity()
+        return response
+
+    def embed_images(self, images: list) -> np.ndarray:
+        """
+        Sends 224px center-cropped RGB pixels to the server and returns the L2-normalized float32 embeddings,
+        one row per image. Cropping client side keeps the payload at a fixed 150 KB per image.
+        """
+        arrays = [np.asarray(fit_to_model(image.convert('RGB'))) for image in images]
+        return protocol.unpack_matrix(self._request_named(protocol.OP_EMBED_IMAGES, protocol.pack_images(arrays)))
+
+    def _encode_labels(self, labels: list) -> np.ndarray:
+        return protocol.unpack_matrix(self._request_named(protocol.OP_EMBED_LABELS, protocol.pack_json(labels)))
+
+    def _encode_queries(self, queries: list) -> np.ndarray:
+        return np.concatenate([protocol.unpack_matrix(self._request_named(protocol.OP_EMBED_QUERY,
+                                                                          protocol.pack_json(query)))
+                               for query in queries])
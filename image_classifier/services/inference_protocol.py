@@ -0,0 +1,127 @@
+"""
+Binary framing shared by the PLIP inference server and its torch-free client.
+
+Every message is a 9 byte header (magic, op or status code, payload length) followed by the payload.
+Images travel as raw RGB uint8 pixels and embeddings as little-endian float32 matrices,
+so neither side pays for re-encoding or JSON number formatting on the hot path.
+Embedding requests are prefixed with the registry model name (empty for the default model),
+and their responses with the model key of the weights that produced them.
+"""
+import json
+import struct
+
+import numpy as np
+
+
+MAGIC = b'PLIP'
+HEADER = struct.Struct('!4sBI')
+MAX_PAYLOAD = 256 * 1024 * 1024
+
+# Request ops
+OP_EMBED_IMAGES = 1
+OP_EMBED_LABELS = 2
+OP_HEALTH = 3
+OP_EMBED_QUERY = 4
+
+# Response statuses
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_BUSY = 2
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("Connection closed mid-message")
+        received += count
+    return bytes(buffer)
+
+
+def send_message(sock, code, payload=b''):
+    sock.sendall(HEADER.pack(MAGIC, code, len(payload)) + payload)
+
+
+def recv_message(sock):
+    """
+    Returns:
+        tuple: (code, payload), or None if the peer closed the connection between messages
+    """
+    first = sock.recv(HEADER.size)
+    if not first:
+        return None
+
+    header = first if len(first) == HEADER.size else first + _recv_exact(sock, HEADER.size - len(first))
+    magic, code, length = HEADER.unpack(header)
+
+    if magic != MAGIC:
+        raise ProtocolError("Bad message magic")
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Payload of {length} bytes exceeds limit")
+
+    return code, _recv_exact(sock, length) if length else b''
+
+
+def pack_images(arrays):
+    """Packs HxWx3 uint8 arrays as a count followed by (height, width, pixels) records"""
+    parts = [struct.pack('!I', len(arrays))]
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        parts.append(struct.pack('!II', array.shape[0], array.shape[1]))
+        parts.append(array.tobytes())
+    return b''.join(parts)
+
+
+def unpack_images(payload):
+    (count,) = struct.unpack_from('!I', payload, 0)
+    offset = 4
+    arrays = []
+
+    for _ in range(count):
+        height, width = struct.unpack_from('!II', payload, offset)
+        offset += 8
+        size = height * width * 3
+        arrays.append(np.frombuffer(payload, dtype=np.uint8, count=size, offset=offset).reshape(height, width, 3))
+        offset += size
+    return arrays
+
+
+def pack_matrix(matrix):
+    matrix = np.ascontiguousarray(matrix, dtype='<f4')
+    return struct.pack('!II', *matrix.shape) + matrix.tobytes()
+
+
+def unpack_matrix(payload):
+    rows, cols = struct.unpack_from('!II', payload, 0)
+    return np.frombuffer(payload, dtype='<f4', count=rows * cols, offset=8).reshape(rows, cols)
+
+
+def pack_named(name, payload):
+    """Prefixes a payload with a short utf-8 string: a model name in requests, a model key in responses"""
+    encoded = (name or '').encode('utf-8')
+    return struct.pack('!H', len(encoded)) + encoded + payload
+
+
+def unpack_named(payload):
+    """
+    Returns:
+        tuple: (name, remaining payload)
+    """
+    (length,) = struct.unpack_from('!H', payload, 0)
+    return payload[2:2 + length].decode('utf-8'), payload[2 + length:]
+
+
+def pack_json(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def unpack_json(payload):
+    return json.loads(payload.decode('utf-8'))
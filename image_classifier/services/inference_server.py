@@ -0,0 +1,142 @@
+import os
+import socketserver
+import threading
+import time
+
+from PIL import Image
+
+from . import inference_protocol as protocol
+from .batching import BatchScheduler
+from .registry import get_registry
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Local inference daemon holding the single shared copy of each registry model.
+    Web workers connect over a Unix domain socket; image requests from every connection are queued on one
+    BatchScheduler, and at most max_pending requests are admitted at a time, the rest waiting up to
+    queue_timeout seconds before being answered BUSY.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, max_pending=32, queue_timeout=10.0, max_batch_size=8, max_wait_ms=5.0,
+                 registry=None):
+        self.socket_path = socket_path
+        self.registry = registry or get_registry()
+        # Load the default model before accepting connections
+        self.classifier = self.registry.get()
+        self.scheduler = BatchScheduler(max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._admission = threading.BoundedSemaphore(max_pending)
+
+        self._stats_lock = threading.Lock()
+        self.started_at = time.time()
+        self.stats = {'requests': 0, 'images': 0, 'errors': 0, 'rejected': 0, 'in_flight': 0}
+
+        # Remove a stale socket left behind by a previous run
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        super().__init__(socket_path, InferenceRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def record(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def health(self, name=None):
+        """Server state, and the identity of the named model (or the default) as currently served"""
+        classifier = self.registry.get(name or None)
+        with self._stats_lock:
+            stats = dict(self.stats)
+
+        return {
+            'status': 'ok',
+            'pid': os.getpid(),
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'model_id': classifier.model_id,
+            'model_revision': classifier.model_revision,
+            'model_key': classifier.model_key,
+            'precision': classifier.precision,
+            'logit_scale': classifier.logit_scale,
+            'models': self.registry.status(),
+            'max_pending': self.max_pending,
+            'queued_images': self.scheduler._queue.qsize(),
+            **stats,
+        }
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+
+        while True:
+            try:
+                message = protocol.recv_message(self.request)
+            except (ConnectionError, protocol.ProtocolError):
+                return
+
+            if message is None:
+                return
+
+            op, payload = message
+
+            # Health checks bypass admission so an overloaded server still reports its state
+            if op == protocol.OP_HEALTH:
+                try:
+                    status, response = protocol.STATUS_OK, protocol.pack_json(server.health(payload.decode('utf-8')))
+                except Exception as e:
+                    status, response = protocol.STATUS_ERROR, str(e).encode('utf-8')
+                protocol.send_message(self.request, status, response)
+                continue
+
+            if not server._admission.acquire(timeout=server.queue_timeout):
+                server.record(rejected=1)
+                protocol.send_message(self.request, protocol.STATUS_BUSY, b'Inference queue is full')
+                continue
+
+            server.record(requests=1, in_flight=1)
+            try:
+                status, response = self.dispatch(op, payload)
+            except Exception as e:
+                server.record(errors=1)
+                status, response = protocol.STATUS_ERROR, str(e).encode('utf-8')
+            finally:
+                server.record(in_flight=-1)
+                server._admission.release()
+
+            protocol.send_message(self.request, status, response)
+
+    def dispatch(self, op, payload):
+        server = self.server
+
+        name, payload = protocol.unpack_named(payload)
+        # Resolved once per request, so a hot swap mid-request cannot mix two models in one response
+        classifier = server.registry.get(name or None)
+
+        if op == protocol.OP_EMBED_IMAGES:
+            images = [Image.fromarray(array, 'RGB') for array in protocol.unpack_images(payload)]
+            futures = [server.scheduler.submit(image, classifier.embed_images) for image in images]
+            embeddings = [future.result() for future in futures]
+            server.record(images=len(images))
+            return protocol.STATUS_OK, protocol.pack_named(classifier.model_key, protocol.pack_matrix(embeddings))
+
+        if op == protocol.OP_EMBED_LABELS:
+            labels = protocol.unpack_json(payload)
+            return protocol.STATUS_OK, protocol.pack_named(classifier.model_key,
+                                                           protocol.pack_matrix(classifier.embed_labels(labels)))
+
+        if op == protocol.OP_EMBED_QUERY:
+            # Through the server's query cache, so searches do not evict labels every web worker shares
+            query = protocol.unpack_json(payload)
+            return protocol.STATUS_OK, protocol.pack_named(classifier.model_key,
+                                                           protocol.pack_matrix([classifier.embed_query(query)]))
+
+        return protocol.STATUS_ERROR, f"Unknown op {op}".encode('utf-8')
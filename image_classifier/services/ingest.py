@@ -0,0 +1,143 @@
+import hashlib
+
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+
+from ..models import PLIPImage, PLIPScore, PLIPSubmission
+from .analytics import record_submissions
+from .batching import embed_image
+from .decode import check_dimensions, decode_upload, header_size, make_thumbnail
+from .embeddings import get_stored_embedding, store_embeddings
+from .labels import get_labels
+from .result_cache import apply_cached_results, cache_results
+from .thumbnails import save_thumbnails
+
+
+# Leading bytes searched for the image header; JPEG EXIF blocks can push the frame header well past the first KB
+HEADER_BYTES = 64 * 1024
+
+
+def ingest_upload(uploaded_file, labels, classifier, max_pixels=None):
+    """
+    Classifies a Django UploadedFile without ever holding a second copy of it.
+    The file is streamed once in chunks to compute its md5, and the image header in the first chunk is checked
+    against the pixel limit before the rest is read. A cached result for the md5 and label list skips everything
+    but persistence, a stored embedding for the md5 skips decoding; otherwise the upload is decoded once
+    at reduced scale for both the model input and the thumbnail.
+    Django keeps small uploads in memory and removes the temporary file of larger ones after the response,
+    so no temporary files are created here.
+
+    Returns:
+        dict: filename, md5, image_obj, embedding, thumbnail (new images only) and prediction,
+        in the shape classify_files() produces so save_results() can persist either
+    """
+    result = {'filename': uploaded_file.name, 'md5': upload_md5(uploaded_file, max_pixels), 'image_obj': None}
+
+    if apply_cached_results([result], labels, classifier):
+        return result
+
+    embed_upload(result, uploaded_file, classifier, max_pixels)
+    result['prediction'] = classifier.score_embedding(result['embedding'], labels)
+    return result
+
+
+def upload_md5(uploaded_file, max_pixels=None) -> str:
+    """Streams an upload once in chunks for its md5, checking the image header against the pixel limit first"""
+    md5 = hashlib.md5()
+    head = b''
+    size = None
+
+    uploaded_file.seek(0)
+    for chunk in uploaded_file.chunks():
+        md5.update(chunk)
+        if size is None and len(head) < HEADER_BYTES:
+            head += chunk[:HEADER_BYTES - len(head)]
+            size = header_size(head)
+            if size:
+                check_dimensions(size, max_pixels)
+    return md5.hexdigest()
+
+
+def embed_upload(result, uploaded_file, classifier, max_pixels=None):
+    """Fills in the embedding of an upload result, and its image or thumbnail"""
+    # A previously embedded image is scored from its stored embedding, skipping decode and the vision forward
+    stored_embedding = get_stored_embedding(result['md5'], classifier)
+
+    if stored_embedding:
+        result['image_obj'], result['embedding'] = stored_embedding
+        result['embedding_stored'] = True
+
+    else:
+        # One reduced decode feeds both the model input and the stored thumbnail
+        pil_img = decode_upload(uploaded_file, max_pixels=max_pixels)
+        result['embedding'] = embed_image(pil_img, classifier)
+        result['thumbnail'] = make_thumbnail(pil_img)
+
+
+def save_results(user, results, expected_label, classifier):
+    """
+    Persists every successfully classified result in one transaction with a constant number of queries:
+    labels through the process-wide label cache, new images with one upsert on md5, embeddings not already
+    stored, and the submissions and their scores with one bulk insert each, plus one upsert per analytics
+    summary table. An embedding marked 'embedding_from_thumbnail' is never stored, so it cannot stand in for
+    the full resolution image. New predictions are added to the shared result cache once the transaction commits.
+
+    Returns:
+        dict: index of each saved entry in results mapped to its new PLIPSubmission, with image, expected
+        label and scores already attached so it serializes without further queries
+    """
+    saved = {index: result for index, result in enumerate(results) if 'error' not in result}
+    if not saved:
+        return {}
+
+    with transaction.atomic():
+        label_names = [label for result in saved.values() for label in result['prediction']['detailed_scores']]
+        label_objs = get_labels(label_names + ([expected_label] if expected_label else []))
+        expected_label_obj = label_objs[expected_label] if expected_label else None
+
+        image_objs = upsert_images(saved.values())
+
+        new_embeddings = {image_objs[result['md5']].id: result['embedding'] for result in saved.values()
+                          if 'embedding' in result and not result.get('embedding_stored')
+                          and not result.get('embedding_from_thumbnail')}
+        if new_embeddings:
+            store_embeddings(list(new_embeddings), list(new_embeddings.values()), classifier)
+
+        sorted_scores = [sorted(result['prediction']['detailed_scores'].items(), key=lambda item: item[1],
+                                reverse=True) for result in saved.values()]
+        submissions = PLIPSubmission.objects.bulk_create([
+            PLIPSubmission(filename=result['filename'][:100], image=image_objs[result['md5']],
+                           expected_label=expected_label_obj, user=user, model_id=classifier.model_id,
+                           model_revision=classifier.model_revision, precision=classifier.precision,
+                           predicted_label=label_objs[results_sorted[0][0]] if results_sorted else None,
+                           predicted_score=results_sorted[0][1] if results_sorted else None)
+            for result, results_sorted in zip(saved.values(), sorted_scores)
+        ])
+
+        PLIPScore.objects.bulk_create([PLIPScore(label=label_objs[key], score=value, submission=submission_obj)
+                                       for submission_obj, results_sorted in zip(submissions, sorted_scores)
+                                       for key, value in results_sorted])
+        # One query attaches the scores, highest first, so the submissions serialize without a query each
+        scores = PLIPScore.objects.select_related('label').order_by('-score', 'id')
+        prefetch_related_objects(submissions, Prefetch('submission_scores', queryset=scores))
+        record_submissions(submissions)
+        cache_results(results, {md5_checksum: image_obj.id for md5_checksum, image_obj in image_objs.items()})
+
+    return dict(zip(saved, submissions))
+
+
+def upsert_images(results) -> dict:
+    """
+    PLIPImage rows for the results mapped by md5. Images not seen before are inserted with one upsert,
+    which the unique md5 turns into a no-op for an image another worker stored concurrently.
+    """
+    image_objs = {result['md5']: result['image_obj'] for result in results if result['image_obj'] is not None}
+    thumbnails = {result['md5']: result['thumbnail'] for result in results if result['md5'] not in image_objs}
+
+    if thumbnails:
+        # Files are content-addressed, so one left behind by a rolled back transaction is simply reused
+        save_thumbnails(thumbnails)
+        PLIPImage.objects.bulk_create([PLIPImage(md5=md5_checksum) for md5_checksum in thumbnails],
+                                      ignore_conflicts=True)
+        image_objs.update(PLIPImage.objects.in_bulk(list(thumbnails), field_name='md5'))
+    return image_objs
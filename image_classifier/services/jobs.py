@@ -0,0 +1,98 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import PLIPJob
+from .batch import classify_files
+from .inference_client import InferenceServerError
+from .ingest import save_results
+from .scoring import parse_labels
+
+
+def requeue_stale_jobs():
+    """Returns jobs claimed by a worker that died mid-batch to the queue, or fails them after max attempts"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'PLIP_JOB_STALE_SECONDS', 600))
+    stale = PLIPJob.objects.filter(status=PLIPJob.RUNNING, started_at__lt=cutoff)
+
+    stale.filter(attempts__gte=getattr(settings, 'PLIP_JOB_MAX_ATTEMPTS', 3)).update(
+        status=PLIPJob.FAILED, error="Worker did not finish the job", finished_at=timezone.now())
+    return stale.update(status=PLIPJob.QUEUED, worker='')
+
+
+def claim_jobs(batch_size):
+    """
+    Claims up to batch_size queued jobs for this worker, leaving jobs put back after an inference server error
+    until PLIP_JOB_RETRY_SECONDS after their last claim.
+    The conditional UPDATE only flips rows still queued, so concurrent workers never claim the same job,
+    on SQLite as well as PostgreSQL.
+    """
+    worker = uuid.uuid4().hex
+    retry_cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'PLIP_JOB_RETRY_SECONDS', 30))
+    candidate_ids = list(PLIPJob.objects.filter(Q(started_at=None) | Q(started_at__lt=retry_cutoff),
+                                                status=PLIPJob.QUEUED)
+                         .order_by('id').values_list('id', flat=True)[:batch_size])
+    if not candidate_ids:
+        return []
+
+    PLIPJob.objects.filter(id__in=candidate_ids, status=PLIPJob.QUEUED).update(
+        status=PLIPJob.RUNNING, worker=worker, started_at=timezone.now(), attempts=F('attempts') + 1)
+
+    return list(PLIPJob.objects.select_related('user').filter(worker=worker, status=PLIPJob.RUNNING).order_by('id'))
+
+
+def process_jobs(jobs, classifier):
+    """
+    Classifies claimed jobs, batching the vision forward across jobs that share a label list,
+    and records each job's submission or error. Jobs that meet a busy or unreachable inference server are
+    queued again until they have been tried PLIP_JOB_MAX_ATTEMPTS times.
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(tuple(parse_labels(job.labels)), []).append(job)
+
+    for labels, group in groups.items():
+        try:
+            results = classify_files([(job.filename, bytes(job.upload)) for job in group], list(labels), classifier)
+        except InferenceServerError as e:
+            _retry(group, error=f"Inference server unavailable: {str(e)}")
+            continue
+        except Exception as e:
+            for job in group:
+                _finish(job, error=f"Error processing image: {str(e)}")
+            continue
+
+        for job, result in zip(group, results):
+            if 'error' in result:
+                _finish(job, error=result['error'])
+                continue
+
+            try:
+                submission_obj = save_results(job.user, [result], job.expected_label, classifier)[0]
+            except Exception as e:
+                _finish(job, error=f"Error saving submission: {str(e)}")
+                continue
+
+            _finish(job, submission_id=submission_obj.id)
+
+
+def _retry(jobs, error):
+    max_attempts = getattr(settings, 'PLIP_JOB_MAX_ATTEMPTS', 3)
+    for job in jobs:
+        if job.attempts >= max_attempts:
+            _finish(job, error=error)
+    PLIPJob.objects.filter(id__in=[job.id for job in jobs if job.attempts < max_attempts]).update(
+        status=PLIPJob.QUEUED, worker='')
+
+
+def _finish(job, submission_id=None, error=''):
+    # The upload is no longer needed once the job has an outcome
+    PLIPJob.objects.filter(id=job.id).update(
+        status=PLIPJob.FAILED if error else PLIPJob.DONE,
+        submission_id=submission_id,
+        error=error,
+        upload=b'',
+        finished_at=timezone.now(),
+    )
@@ -0,0 +1,41 @@
+import threading
+
+from django.db import transaction
+
+from ..models import PLIPLabel
+
+
+# Label text -> PLIPLabel, shared by every request in the process; labels are only ever added
+_labels = {}
+_labels_lock = threading.Lock()
+
+
+def get_labels(labels) -> dict:
+    """
+    PLIPLabel rows for label names, mapped by name. Names seen before come from the process-wide cache;
+    the rest are created with one bulk upsert and read back with one query, whatever their number.
+    Rows are only cached once the surrounding transaction commits, so a rollback never leaves stale ids behind.
+    """
+    labels = list(dict.fromkeys(labels))
+    with _labels_lock:
+        found = {label: _labels[label] for label in labels if label in _labels}
+
+    missing = [label for label in labels if label not in found]
+    if missing:
+        # The unique constraint on label turns concurrent inserts of the same name into no-ops
+        PLIPLabel.objects.bulk_create([PLIPLabel(label=label) for label in missing], ignore_conflicts=True)
+        fetched = PLIPLabel.objects.in_bulk(missing, field_name='label')
+        found.update(fetched)
+        transaction.on_commit(lambda: _cache_labels(fetched))
+
+    return found
+
+
+def _cache_labels(label_objs):
+    with _labels_lock:
+        _labels.update(label_objs)
+
+
+def clear_label_cache():
+    with _labels_lock:
+        _labels.clear()
@@ -0,0 +1,106 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+COUNT_MODES = ('none', 'exact', 'cached', 'approximate')
+
+
+def encode_cursor(obj) -> str:
+    """Opaque cursor for the position just after obj in (-created_at, -id) order"""
+    position = f"{obj.created_at.isoformat()}|{obj.id}"
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: (created_at, id) of the last row of the previous page
+
+    Raises:
+        ValueError: if the cursor was not made by encode_cursor
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, last_id = position.split('|')
+        created_at = parse_datetime(created_at)
+        last_id = int(last_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if created_at is None:
+        raise ValueError("Invalid cursor")
+    return created_at, last_id
+
+
+def keyset_page(queryset, cursor=None, page_size=10):
+    """
+    One page of a queryset in (-created_at, -id) order, starting after the cursor.
+    The page is found by seeking the (created_at, id) index instead of skipping rows with OFFSET, so a deep
+    page costs the same as the first one, and rows added meanwhile never shift later pages.
+
+    Returns:
+        tuple: (list of objects, cursor of the next page or None on the last page)
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        # The plain range on created_at lets SQLite seek the index; the OR only breaks ties within it
+        queryset = (queryset.filter(created_at__lte=created_at)
+                    .filter(Q(created_at__lt=created_at) | Q(id__lt=last_id)))
+
+    objects = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(objects[page_size - 1]) if len(objects) > page_size else None
+    return objects[:page_size], next_cursor
+
+
+def estimated_rows(model):
+    """Planner estimate of a table's rows without scanning it, or None if the backend has none"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == 'sqlite':
+            # Ids are never reused, so the highest one bounds the rows and reads one index entry
+            cursor.execute(f"SELECT MAX(id) FROM {connection.ops.quote_name(table)}")
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for a table that has never been analyzed
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+def count_rows(queryset, mode, signature=None):
+    """
+    Total rows of a paginated list in one of COUNT_MODES:
+    'none' skips counting, 'exact' always counts, 'cached' counts once per filter signature for
+    PLIP_LIST_COUNT_CACHE_SECONDS, and 'approximate' uses the planner's table estimate when there are no
+    filters and the cached count otherwise.
+
+    Args:
+        signature: JSON serializable filters the queryset was built from; empty when unfiltered
+
+    Returns:
+        tuple: (count or None, whether the count is approximate)
+    """
+    if mode == 'none':
+        return None, False
+    if mode == 'exact':
+        return queryset.count(), False
+
+    if mode == 'approximate' and not signature:
+        estimate = estimated_rows(queryset.model)
+        if estimate is not None:
+            return estimate, True
+
+    key_data = json.dumps([queryset.model._meta.label, signature], sort_keys=True, default=str)
+    key = 'plip-count:' + hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.PLIP_LIST_COUNT_CACHE_SECONDS)
+    return count, mode == 'approximate'
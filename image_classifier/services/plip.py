@@ -1,68 +1,128 @@
+import contextlib
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
 import torch
-from PIL import Image
 from transformers import CLIPProcessor, CLIPModel
 
+from django.conf import settings
+
+from .decode import to_pixel_values
+from .scoring import DEFAULT_LABELS, EmbeddingScorer
+
+
+# fp32 weights; bf16 autocast of the matmuls; int8 dynamic quantization of every Linear in both towers
+PRECISIONS = ('fp32', 'bf16', 'int8')
+
+
+def checkpoint_fingerprint(path):
+    """Short hash of the file names, sizes and modification times of a local checkpoint directory"""
+    digest = hashlib.sha1()
+    for file_path in sorted(Path(path).rglob('*')):
+        if file_path.is_file():
+            stat = file_path.stat()
+            digest.update(f"{file_path.relative_to(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    return 'local-' + digest.hexdigest()[:12]
 
-class PLIPClassifier:
+
+class PLIPClassifier(EmbeddingScorer):
     """
-    A singleton service for Zero-Shot classification using the PLIP model.
-    This ensures the heavy model is only loaded once into memory
+    A CLIP-style checkpoint loaded for zero-shot classification, vinid/plip unless told otherwise.
+    model_id may be a Hugging Face id or a local checkpoint directory. Loading is heavy,
+    so instances are created and shared through the model registry rather than per request.
     """
-    _instance = None
     _model = None
     _processor = None
 
-    def __new__(cls):
-        """Ensure only one class instance is instantiated at a time"""
-        if cls._instance is None:
-            cls._instance = super(PLIPClassifier, cls).__new__(cls)
-            cls._instance._initialize_model()
-        return cls._instance
+    def __init__(self, model_id="vinid/plip", revision="main", precision=None):
+        self.model_id = model_id
+        self.revision = revision
+        self._initialize_model(precision)
 
-    def _initialize_model(self):
-        """Loads the vinid/plip model from Hugging Face."""
-        try:
-            model_id = "vinid/plip"
+    def _initialize_model(self, precision=None):
+        """Loads the checkpoint in the given precision, or PLIP_PRECISION"""
+        self.precision = precision or getattr(settings, 'PLIP_PRECISION', 'fp32')
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unknown PLIP precision '{self.precision}', expected one of {', '.join(PRECISIONS)}")
 
-            # Check for GPU availability
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        try:
+            # Check for GPU availability; dynamic quantized kernels only exist for CPU
+            self.device = "cuda" if torch.cuda.is_available() and self.precision != 'int8' else "cpu"
 
-            self._model = CLIPModel.from_pretrained(model_id).to(self.device)
-            self._processor = CLIPProcessor.from_pretrained(model_id)
+            self._model = CLIPModel.from_pretrained(self.model_id, revision=self.revision).to(self.device)
+            self._processor = CLIPProcessor.from_pretrained(self.model_id, revision=self.revision)
             self._model.eval()  # Set to evaluation mode
 
+            if self.precision == 'int8':
+                self._model = torch.ao.quantization.quantize_dynamic(self._model, {torch.nn.Linear},
+                                                                     dtype=torch.qint8)
+
+            # Resolved commit of the loaded weights, recorded next to persisted embeddings and submissions;
+            # local directories have no commit, so their files are fingerprinted instead
+            if os.path.isdir(self.model_id):
+                self.model_revision = checkpoint_fingerprint(self.model_id)
+            else:
+                self.model_revision = getattr(self._model.config, '_commit_hash', None) or self.revision
+
+            self.logit_scale = self._model.logit_scale.detach().exp().item()
+
+            self._init_text_cache()
+
+            # Nearly every upload uses the default label set, so have it ready before the first request
+            self.embed_labels(DEFAULT_LABELS)
+
         except Exception as e:
             print(f"Failed to load PLIP model: {e}")
             raise
 
-    def predict(self, image_input: Image.Image, candidate_labels: list) -> dict:
+    def memory_bytes(self) -> int:
+        """Bytes held by the model's weights and buffers, counting int8 packed weights at their packed size"""
+        def tensor_bytes(value):
+            if torch.is_tensor(value):
+                return value.numel() * value.element_size()
+            if isinstance(value, (tuple, list)):
+                return sum(tensor_bytes(item) for item in value)
+            return 0
+
+        return sum(tensor_bytes(value) for value in self._model.state_dict().values())
+
+    def _inference_mode(self):
+        """No-grad context, with bf16 autocast when that precision is selected"""
+        stack = contextlib.ExitStack()
+        stack.enter_context(torch.no_grad())
+        if self.precision == 'bf16':
+            stack.enter_context(torch.autocast(device_type=self.device, dtype=torch.bfloat16))
+        return stack
+
+    def embed_images(self, images: list) -> np.ndarray:
         """
-        Classifies a tissue patch against a list of text labels.
+        Runs only the vision tower over a batch of images in one forward pass.
+        Images are resized, cropped and normalized by the vectorized numpy path in decode.py, not CLIPProcessor.
 
         Returns:
-            dict: {'label': str, 'score': float, 'all_scores': dict}
+            np.ndarray: L2-normalized float32 image embeddings, one row per image
         """
-        inputs = self._processor(
-            text=candidate_labels,
-            images=image_input,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
-
-        # Inference (No Gradient)
-        with torch.no_grad():
-            outputs = self._model(**inputs)
-
-        # Calculate Probabilities
-        logits_per_image = outputs.logits_per_image
-        probs = logits_per_image.softmax(dim=1).cpu().numpy()[0]
-
-        # Format Results
-        result_dict = {label: float(prob) for label, prob in zip(candidate_labels, probs)}
-        best_idx = probs.argmax()
-
-        return {
-            "predicted_label": candidate_labels[best_idx],
-            "confidence": float(probs[best_idx]),
-            "detailed_scores": result_dict
-        }
\ No newline at end of file
+        pixel_values = torch.from_numpy(to_pixel_values(images)).to(self.device)
+
+        with self._inference_mode():
+            vision_outputs = self._model.vision_model(pixel_values=pixel_values)
+            image_embeds = self._model.visual_projection(vision_outputs.pooler_output)
+
+        image_embeds = image_embeds.float()
+        image_embeds = image_embeds / image_embeds.norm(p=2, dim=-1, keepdim=True)
+        return image_embeds.cpu().numpy().astype(np.float32)
+
+    def _encode_labels(self, labels: list) -> np.ndarray:
+        """Runs the text tower over labels missing from the cache and returns normalized embeddings"""
+        inputs = self._processor(text=labels, return_tensors="pt", padding=True).to(self.device)
+
+        with self._inference_mode():
+            text_outputs = self._model.text_model(input_ids=inputs['input_ids'],
+                                                  attention_mask=inputs['attention_mask'])
+            text_embeds = self._model.text_projection(text_outputs.pooler_output)
+
+        text_embeds = text_embeds.float()
+        text_embeds = text_embeds / text_embeds.norm(p=2, dim=-1, keepdim=True)
+        return text_embeds.cpu().numpy().astype(np.float32)
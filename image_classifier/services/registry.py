@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_manifest(path):
+    """Returns the operator manifest {'default': name, 'models': {name: spec}}, or an empty one if absent"""
+    try:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return {'models': {}}
+    manifest.setdefault('models', {})
+    return manifest
+
+
+def write_manifest(path, manifest):
+    """Replaces the manifest atomically, so polling processes never read a half-written file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+class ModelRegistry:
+    """
+    Named CLIP-style checkpoints loaded on first use and shared by every request in the process.
+
+    Models are kept in least recently used order and evicted once their combined weights exceed the memory
+    budget, or once idle for longer than idle_seconds; the default model is only evicted for budget.
+    Specs come from PLIP_MODELS, overridden by the manifest file the plip_models command writes. When the
+    manifest changes the spec of a loaded model, the new checkpoint is loaded and warmed up in a background
+    thread while the old one keeps serving, then swapped in atomically. Requests already holding the old
+    classifier finish on it, and its memory is released with the last reference.
+    """
+
+    def __init__(self, models=None, default=None, memory_budget_mb=None, idle_seconds=None, manifest_path=None,
+                 poll_seconds=None, loader=None):
+        self._base_specs = dict(models if models is not None else getattr(settings, 'PLIP_MODELS', {}))
+        self._base_default = default or getattr(settings, 'PLIP_DEFAULT_MODEL', 'plip')
+        budget_mb = memory_budget_mb if memory_budget_mb is not None else getattr(
+            settings, 'PLIP_MODEL_MEMORY_BUDGET_MB', 2048)
+        self.memory_budget = budget_mb * 1024 * 1024
+        self.idle_seconds = idle_seconds if idle_seconds is not None else getattr(
+            settings, 'PLIP_MODEL_IDLE_SECONDS', 3600)
+        self.manifest_path = manifest_path if manifest_path is not None else getattr(
+            settings, 'PLIP_MODEL_MANIFEST', None)
+        self.poll_seconds = poll_seconds if poll_seconds is not None else getattr(
+            settings, 'PLIP_MODEL_MANIFEST_POLL_SECONDS', 5)
+        self._loader = loader or self._load_checkpoint
+
+        self._lock = threading.RLock()
+        self._load_locks = {}
+        self._loaded = OrderedDict()
+        self._swapping = set()
+        self._specs = dict(self._base_specs)
+        self.default = self._base_default
+        self._manifest_mtime = None
+        self._manifest_checked = 0.0
+
+    def get(self, name=None):
+        """Returns the loaded classifier for a model name, loading it on first use"""
+        self._check_manifest()
+        name = name or self.default
+
+        with self._lock:
+            if name not in self._specs:
+                raise ValueError(f"Unknown model '{name}', expected one of {', '.join(sorted(self._specs))}")
+            entry = self._loaded.get(name)
+            if entry is not None:
+                entry['last_used'] = time.monotonic()
+                self._loaded.move_to_end(name)
+                self._evict(keep=name)
+                return entry['classifier']
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # Concurrent first requests for the same model wait for one load instead of each loading a copy
+        with load_lock:
+            with self._lock:
+                entry = self._loaded.get(name)
+                if entry is not None:
+                    return entry['classifier']
+                spec = self._specs[name]
+
+            classifier = self._loader(spec)
+
+            with self._lock:
+                self._install(name, spec, classifier)
+            return classifier
+
+    def swap(self, name, spec, background=True, make_default=False):
+        """
+        Loads and warms up a new spec for a model name, then replaces the serving classifier atomically,
+        making it the default afterwards if asked.
+
+        Returns:
+            threading.Thread or None: the warm-up thread when background is set
+        """
+        with self._lock:
+            if name in self._swapping:
+                return None
+            self._swapping.add(name)
+
+        def run():
+            try:
+                classifier = self._loader(spec)
+            except Exception:
+                logger.exception("Could not load %s for model '%s', keeping the current weights", spec, name)
+                return
+            finally:
+                with self._lock:
+                    self._swapping.discard(name)
+
+            with self._lock:
+                self._specs[name] = spec
+                if make_default:
+                    self.default = name
+                self._install(name, spec, classifier)
+            logger.info("Swapped model '%s' to %s", name, classifier.model_key)
+
+        if not background:
+            run()
+            return None
+
+        thread = threading.Thread(target=run, name=f'plip-model-swap-{name}', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        """Describes every known model and whether this process currently holds it"""
+        now = time.monotonic()
+        with self._lock:
+            report = []
+            for name, spec in sorted(self._specs.items()):
+                entry = self._loaded.get(name)
+                report.append({
+                    'name': name,
+                    'default': name == self.default,
+                    'path': spec.get('path'),
+                    'revision': spec.get('revision'),
+                    'loaded': entry is not None,
+                    'model_key': entry['classifier'].model_key if entry else None,
+                    'memory_mb': round(entry['bytes'] / 1024 / 1024, 1) if entry else None,
+                    'idle_seconds': round(now - entry['last_used'], 1) if entry else None,
+                    'swapping': name in self._swapping,
+                })
+            return report
+
+    def _install(self, name, spec, classifier):
+        self._loaded[name] = {
+            'spec': spec,
+            'classifier': classifier,
+            'bytes': classifier.memory_bytes() if hasattr(classifier, 'memory_bytes') else 0,
+            'last_used': time.monotonic(),
+        }
+        self._loaded.move_to_end(name)
+        self._evict(keep=name)
+
+    def _evict(self, keep):
+        """Drops idle non-default models, then least recently used ones until the budget is met"""
+        now = time.monotonic()
+        for name in list(self._loaded):
+            if (name not in (keep, self.default) and self.idle_seconds
+                    and now - self._loaded[name]['last_used'] > self.idle_seconds):
+                logger.info("Evicting idle model '%s'", name)
+                del self._loaded[name]
+
+        while (self.memory_budget and len(self._loaded) > 1
+               and sum(entry['bytes'] for entry in self._loaded.values()) > self.memory_budget):
+            name = next(name for name in self._loaded if name != keep)
+            logger.info("Evicting model '%s' to stay within the memory budget", name)
+            del self._loaded[name]
+
+    def _check_manifest(self):
+        """Picks up manifest changes at most every poll_seconds; a changed spec of a loaded model is hot swapped"""
+        if not self.manifest_path or time.monotonic() - self._manifest_checked < self.poll_seconds:
+            return
+
+        with self._lock:
+            self._manifest_checked = time.monotonic()
+            try:
+                mtime = os.stat(self.manifest_path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._manifest_mtime:
+                return
+            self._manifest_mtime = mtime
+
+            try:
+                manifest = read_manifest(self.manifest_path)
+            except (OSError, ValueError):
+                logger.exception("Ignoring unreadable model manifest %s", self.manifest_path)
+                return
+
+            specs = {**self._base_specs, **manifest['models']}
+            default = manifest.get('default') or self._base_default
+            if default not in specs:
+                logger.error("Model manifest default '%s' has no spec, keeping '%s'", default, self.default)
+                default = self.default
+
+            for name, spec in specs.items():
+                entry = self._loaded.get(name)
+                if entry is not None and entry['spec'] != spec:
+                    self.swap(name, spec, make_default=name == default)
+                elif name not in self._swapping:
+                    self._specs[name] = spec
+
+            # A new default that is not loaded yet is warmed up before traffic moves to it
+            if default != self.default and default not in self._swapping:
+                if default in self._loaded or self.default not in self._loaded:
+                    self.default = default
+                else:
+                    self.swap(default, specs[default], make_default=True)
+
+    @staticmethod
+    def _load_checkpoint(spec):
+        from PIL import Image
+
+        from .plip import PLIPClassifier
+
+        classifier = PLIPClassifier(model_id=spec['path'], revision=spec.get('revision') or 'main',
+                                    precision=spec.get('precision'))
+        # The constructor already embedded the default labels; run the vision tower once as well
+        classifier.embed_images([Image.new('RGB', (224, 224))])
+        return classifier
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+    return _registry
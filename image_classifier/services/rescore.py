@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from ..models import PLIPImage, PLIPScore, PLIPSubmission
+from .analytics import record_submissions
+from .decode import decode_upload
+from .embeddings import get_stored_embeddings
+from .thumbnails import read_thumbnail
+
+
+def checkpoint_name(labels, classifier) -> str:
+    """Checkpoint file name for one label list and model, so differently configured runs never share progress"""
+    key = json.dumps([list(labels), classifier.model_key])
+    return f"rescore-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.json"
+
+
+def read_checkpoint(path) -> dict:
+    try:
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_checkpoint(path, checkpoint):
+    """Replaces the checkpoint atomically, so an interrupted run never leaves a truncated file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, indent=2)
+    os.replace(temp_path, path)
+
+
+def _embed_missing(image_ids, classifier, batch_size):
+    """
+    Embeds stored thumbnails of images with no embedding from this model, batch_size per vision forward.
+    These only score the run and are never stored, so they cannot stand in for a full resolution upload.
+
+    Returns:
+        tuple: (embeddings by image id, ids of images whose thumbnail could not be decoded)
+    """
+    embeddings, failed = {}, []
+    blobs = PLIPImage.objects.filter(id__in=image_ids).values_list('id', 'md5', 'blob_image')
+
+    batch_ids, batch_images = [], []
+    for image_id, md5_checksum, blob in blobs.iterator(chunk_size=batch_size):
+        try:
+            batch_images.append(decode_upload(read_thumbnail(md5_checksum, blob)))
+            batch_ids.append(image_id)
+        except Exception:
+            failed.append(image_id)
+
+        if len(batch_images) == batch_size:
+            embeddings.update(zip(batch_ids, classifier.embed_images(batch_images)))
+            batch_ids, batch_images = [], []
+
+    if batch_images:
+        embeddings.update(zip(batch_ids, classifier.embed_images(batch_images)))
+    return embeddings, failed
+
+
+def already_rescored(image_ids, label_objs, classifier) -> set:
+    """Ids of the images with a submission by the classifier's model scored against exactly these labels"""
+    label_ids = {label_obj.id for label_obj in label_objs.values()}
+    return set(PLIPSubmission.objects.filter(image_id__in=image_ids, model_id=classifier.model_id,
+                                             model_revision=classifier.model_revision,
+                                             precision=classifier.precision)
+               .annotate(total=Count('submission_scores'),
+                         matching=Count('submission_scores', filter=Q(submission_scores__label_id__in=label_ids)))
+               .filter(total=len(label_ids), matching=len(label_ids)).values_list('image_id', flat=True))
+
+
+def rescore_images(image_ids, labels, label_objs, classifier, batch_size=32):
+    """
+    Scores a chunk of images against a label list and records one new submission per image, copying the
+    user, filename and expected label of the image's latest submission.
+    Stored embeddings are reused and the missing ones are computed from thumbnails in batches. Everything is
+    written with bulk inserts in one short transaction per chunk, so the live site is never held up for long.
+    Images already scored against these labels by this model are skipped inside that transaction, so a chunk
+    that committed before its checkpoint was written is not recorded twice when the run resumes.
+    The new submissions are added to the analytics summary tables like uploads, since they are predictions in
+    their own right: the accuracy figures then cover every model and label set an image was scored with, and
+    stay equal to what rebuild_analytics computes from the submissions.
+
+    Returns:
+        dict: counts of images reused, embedded, failed and skipped and submissions created
+    """
+    embeddings = get_stored_embeddings(image_ids, classifier)
+    reused = len(embeddings)
+
+    missing = [image_id for image_id in image_ids if image_id not in embeddings]
+    computed, failed = _embed_missing(missing, classifier, batch_size) if missing else ({}, [])
+    embeddings.update(computed)
+
+    latest = dict(PLIPSubmission.objects.filter(image_id__in=image_ids).order_by()
+                  .values('image_id').annotate(latest=Max('id')).values_list('image_id', 'latest'))
+    sources = PLIPSubmission.objects.only('user_id', 'filename', 'expected_label_id').in_bulk(latest.values())
+
+    # Images without a submission left have nobody to attribute a new one to
+    scored_ids = [image_id for image_id in image_ids if image_id in embeddings and latest.get(image_id) in sources]
+    predictions = (classifier.score_embeddings(np.stack([embeddings[image_id] for image_id in scored_ids]), labels)
+                   if scored_ids else [])
+
+    sorted_scores = [sorted(prediction['detailed_scores'].items(), key=lambda item: item[1], reverse=True)
+                     for prediction in predictions]
+
+    with transaction.atomic():
+        skipped = already_rescored(scored_ids, label_objs, classifier)
+        if skipped:
+            scored = [(image_id, results_sorted) for image_id, results_sorted in zip(scored_ids, sorted_scores)
+                      if image_id not in skipped]
+            scored_ids, sorted_scores = [image_id for image_id, _ in scored], [results for _, results in scored]
+
+        submissions = PLIPSubmission.objects.bulk_create([
+            PLIPSubmission(image_id=image_id, user_id=sources[latest[image_id]].user_id,
+                           filename=sources[latest[image_id]].filename,
+                           expected_label_id=sources[latest[image_id]].expected_label_id,
+                           model_id=classifier.model_id, model_revision=classifier.model_revision,
+                           precision=classifier.precision,
+                           predicted_label=label_objs[results_sorted[0][0]] if results_sorted else None,
+                           predicted_score=results_sorted[0][1] if results_sorted else None)
+            for image_id, results_sorted in zip(scored_ids, sorted_scores)
+        ])
+
+        scores = []
+        for submission_obj, results_sorted in zip(submissions, sorted_scores):
+            for label, value in results_sorted:
+                scores.append(PLIPScore(label=label_objs[label], score=value, submission=submission_obj))
+        PLIPScore.objects.bulk_create(scores)
+        record_submissions(submissions)
+
+    return {'reused': reused, 'embedded': len(computed), 'failed': len(failed), 'skipped': len(skipped),
+            'submissions': len(submissions)}
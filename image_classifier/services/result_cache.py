@@ -0,0 +1,65 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from ..models import PLIPImage
+
+
+def get_result_cache():
+    return caches[getattr(settings, 'PLIP_RESULT_CACHE', 'plip_results')]
+
+
+def result_cache_key(md5_checksum: str, labels: list, classifier) -> str:
+    """Key for an image md5 scored against an ordered label list by one model revision and precision"""
+    label_hash = hashlib.sha256(json.dumps(list(labels)).encode('utf-8')).hexdigest()
+    key = f"{md5_checksum}:{label_hash}:{classifier.model_key}"
+    return 'plip-result:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def apply_cached_results(results, labels, classifier):
+    """
+    Looks every result up in the shared result cache in one round trip.
+    Hits get their image and prediction filled in and are marked 'cached', so they skip decode, inference
+    and scoring and go straight to persistence. Every result is given its 'cache_key' for cache_results().
+
+    Returns:
+        int: number of hits
+    """
+    for result in results:
+        result['cache_key'] = result_cache_key(result['md5'], labels, classifier)
+
+    cached = get_result_cache().get_many([result['cache_key'] for result in results])
+    if not cached:
+        return 0
+
+    # An image deleted since it was cached turns its entry into a miss
+    image_objs = PLIPImage.objects.in_bulk({entry['image_id'] for entry in cached.values()})
+
+    hits = 0
+    for result in results:
+        entry = cached.get(result['cache_key'])
+        if entry and entry['image_id'] in image_objs:
+            result['image_obj'] = image_objs[entry['image_id']]
+            result['prediction'] = entry['prediction']
+            result['cached'] = True
+            hits += 1
+    return hits
+
+
+def cache_results(results, image_ids):
+    """
+    Caches the prediction of every newly scored result once the surrounding transaction commits,
+    so an entry never points at an image that was rolled back.
+
+    Args:
+        image_ids: md5 of each result mapped to its saved PLIPImage id
+    """
+    entries = {result['cache_key']: {'image_id': image_ids[result['md5']], 'prediction': result['prediction']}
+               for result in results
+               if 'cache_key' in result and not result.get('cached') and 'error' not in result}
+
+    if entries:
+        transaction.on_commit(lambda: get_result_cache().set_many(entries))
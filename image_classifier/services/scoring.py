@@ -0,0 +1,164 @@
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+
+from django.conf import settings
+
+
+# Free-text search queries kept encoded, apart from the labels so searches never evict them
+QUERY_CACHE_SIZE = 64
+
+# NCT-CRC-HE-100K tissue classes, used whenever a submission does not provide its own labels
+DEFAULT_LABELS = ["adipose", "background", "debris", "lymphocytes", "mucus", "smooth muscle", "normal colon mucosa",
+                  "cancer-associated stroma", "colorectal adenocarcinoma epithelium"]
+
+
+def parse_labels(raw_labels: str) -> list:
+    """Splits a comma separated label string, falling back to the default labels when blank"""
+    if raw_labels:
+        return [label.strip() for label in raw_labels.split(',')]
+    return DEFAULT_LABELS
+
+
+def make_model_key(model_id, model_revision, precision) -> str:
+    """Identifies the exact weights and precision behind an embedding or prediction"""
+    return f"{model_id}@{model_revision}:{precision}"
+
+
+class EmbeddingScorer(ABC):
+    """
+    Zero-shot scoring of normalized image embeddings against label text embeddings.
+    Only needs numpy, so it is shared by the in-process classifier and the torch-free inference client.
+    Subclasses provide model_id, model_revision, precision, logit_scale, embed_images() and _encode_labels().
+    """
+    model_id = None
+    model_revision = None
+    precision = 'fp32'
+    logit_scale = None
+    # Whether embed_images is served by the shared inference server, which batches requests of every worker
+    remote = False
+
+    @property
+    def model_key(self) -> str:
+        return make_model_key(self.model_id, self.model_revision, self.precision)
+
+    @abstractmethod
+    def embed_images(self, images: list) -> np.ndarray:
+        """Normalized embeddings of PIL images, one row per image"""
+
+    @abstractmethod
+    def _encode_labels(self, labels: list) -> np.ndarray:
+        """Normalized text embeddings of labels, one row per label"""
+
+    def _init_text_cache(self):
+        # Normalized text embeddings keyed by (model key, label), least recently used first
+        self._text_cache = OrderedDict()
+        self._text_cache_size = getattr(settings, 'PLIP_TEXT_EMBEDDING_CACHE_SIZE', 1024)
+        # Search queries, keyed and evicted the same way
+        self._query_cache = OrderedDict()
+        self._text_cache_lock = threading.Lock()
+
+    def _encode_queries(self, queries: list) -> np.ndarray:
+        """Encodes search queries with the text tower, like labels"""
+        return self._encode_labels(queries)
+
+    def _embed_texts(self, cache, cache_size, texts: list, encode) -> np.ndarray:
+        """Normalized text embeddings, one row per text, encoding only the texts missing from an LRU cache"""
+        with self._text_cache_lock:
+            cached = {}
+            for text in texts:
+                key = (self.model_key, text)
+                if key in cache:
+                    cache.move_to_end(key)
+                    cached[text] = cache[key]
+
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+
+        if missing:
+            text_embeds = encode(missing)
+
+            with self._text_cache_lock:
+                for text, embedding in zip(missing, text_embeds):
+                    cached[text] = embedding
+                    cache[(self.model_key, text)] = embedding
+                    cache.move_to_end((self.model_key, text))
+
+                while len(cache) > cache_size:
+                    cache.popitem(last=False)
+
+        return np.stack([cached[text] for text in texts])
+
+    def embed_labels(self, candidate_labels: list) -> np.ndarray:
+        """
+        Returns L2-normalized text embeddings for the labels, one row per label.
+        Only labels missing from the LRU cache are encoded.
+        """
+        return self._embed_texts(self._text_cache, self._text_cache_size, candidate_labels, self._encode_labels)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Returns the L2-normalized text embedding of a free-text search query. Queries have their own small LRU,
+        so paging through results encodes a query once while arbitrary queries never evict label embeddings.
+        """
+        return self._embed_texts(self._query_cache, QUERY_CACHE_SIZE, [query], self._encode_queries)[0]
+
+    def embed_image(self, image_input) -> np.ndarray:
+        """Returns the L2-normalized embedding of a single image as a 1-D float32 array"""
+        return self.embed_images([image_input])[0]
+
+    def score_embeddings(self, image_embeddings: np.ndarray, candidate_labels: list) -> list:
+        """
+        Scores a matrix of normalized image embeddings against the candidate labels in one matmul.
+
+        Returns:
+            list: one {'predicted_label': str, 'confidence': float, 'detailed_scores': dict} per row
+        """
+        text_embeds = self.embed_labels(candidate_labels)
+
+        # Same logits as CLIPModel.logits_per_image, softmax over the labels
+        logits = self.logit_scale * (np.asarray(image_embeddings, dtype=np.float32) @ text_embeds.T)
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs = probs / probs.sum(axis=1, keepdims=True)
+
+        # Format Results
+        predictions = []
+        for row in probs:
+            best_idx = row.argmax()
+            predictions.append({
+                "predicted_label": candidate_labels[best_idx],
+                "confidence": float(row[best_idx]),
+                "detailed_scores": {label: float(prob) for label, prob in zip(candidate_labels, row)}
+            })
+        return predictions
+
+    def score_embedding(self, image_embedding: np.ndarray, candidate_labels: list) -> dict:
+        """
+        Scores a normalized image embedding against the candidate labels.
+
+        Returns:
+            dict: {'predicted_label': str, 'confidence': float, 'detailed_scores': dict}
+        """
+        return self.score_embeddings(image_embedding[np.newaxis, :], candidate_labels)[0]
+
+    def predict(self, image_input, candidate_labels: list) -> dict:
+        """
+        Classifies a tissue patch against a list of text labels.
+
+        Returns:
+            dict: {'predicted_label': str, 'confidence': float, 'detailed_scores': dict}
+        """
+        return self.score_embedding(self.embed_image(image_input), candidate_labels)
+
+    def predict_batch(self, images: list, candidate_labels: list) -> list:
+        """
+        Classifies several tissue patches with one batched vision forward.
+
+        Returns:
+            list: one prediction dict per image, in input order
+        """
+        if not images:
+            return []
+        return self.score_embeddings(self.embed_images(images), candidate_labels)
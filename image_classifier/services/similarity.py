@@ -0,0 +1,88 @@
+import numpy as np
+
+from django.conf import settings
+from django.db.models import Max
+
+from ..models import PLIPImage, PLIPImageEmbedding, PLIPSubmission
+from .scoring import make_model_key
+from .vector_index import get_vector_store
+
+
+def _embedding_chunks(queryset, chunk_size):
+    """Streams (image ids, float32 vectors) chunks from PLIPImageEmbedding rows"""
+    ids, vectors = [], []
+    for image_id, dtype, vector in queryset.values_list('image_id', 'dtype', 'vector').iterator(chunk_size):
+        ids.append(image_id)
+        vectors.append(np.frombuffer(vector, dtype=dtype))
+        if len(ids) == chunk_size:
+            yield ids, np.stack(vectors).astype(np.float32)
+            ids, vectors = [], []
+    if ids:
+        yield ids, np.stack(vectors).astype(np.float32)
+
+
+def rebuild_vector_store(model_id, model_revision, precision, pca_dim=0, nlist=None, chunk_size=2000):
+    """
+    Rebuilds the similarity search store of one model from its stored embeddings.
+    Embeddings committed while the build runs are caught up from the database before the files are swapped.
+
+    Returns:
+        dict: model_key, rows, dim and nlist of the new store
+    """
+    embeddings = PLIPImageEmbedding.objects.filter(model_id=model_id, model_revision=model_revision,
+                                                   precision=precision).order_by('id')
+    last_id = embeddings.aggregate(last_id=Max('id'))['last_id'] or 0
+    model_key = make_model_key(model_id, model_revision, precision)
+
+    stats = get_vector_store(model_key).build(
+        _embedding_chunks(embeddings.filter(id__lte=last_id), chunk_size), pca_dim=pca_dim, nlist=nlist,
+        catch_up=lambda: _embedding_chunks(embeddings.filter(id__gt=last_id), chunk_size))
+    return {'model_key': model_key, **stats}
+
+
+def find_similar(classifier, embedding, k=10, method=None, nprobe=None, exclude=()):
+    """
+    The k stored images most similar to an embedding of the classifier's model.
+    Images deleted since they were indexed are dropped.
+
+    Returns:
+        list: dicts of image (PLIPImage annotated with latest_submission) and similarity, most similar first
+    """
+    method = method or getattr(settings, 'PLIP_SIMILARITY_METHOD', 'ivf')
+    matches = get_vector_store(classifier.model_key).search(embedding, k=k, method=method, nprobe=nprobe,
+                                                            exclude=exclude)
+
+    image_objs = (PLIPImage.objects.annotate(latest_submission=Max('plipsubmission__id'))
+                  .in_bulk([image_id for image_id, _ in matches]))
+    return [{'image': image_objs[image_id], 'similarity': similarity}
+            for image_id, similarity in matches if image_id in image_objs]
+
+
+def search_text(classifier, query, k=None):
+    """
+    Ranks stored images by the similarity of their embeddings to a free-text query, which PLIP embeds into
+    the same space. The query goes through the classifier's query embedding cache, so repeating it or paging
+    through its results encodes it once. Scoring is an exact scan of the unreduced image embeddings: the PCA
+    and IVF centroids are fitted to image embeddings and would misplace a text embedding.
+
+    Returns:
+        list: up to k (image id, similarity) pairs, most similar first
+    """
+    k = k or getattr(settings, 'PLIP_TEXT_SEARCH_MAX_RESULTS', 200)
+    text_embedding = classifier.embed_query(query)
+    return get_vector_store(classifier.model_key).search(text_embedding, k=k, unreduced=True)
+
+
+def latest_submissions(matches, queryset=None):
+    """
+    The latest submission of each matched image, in match order; images without submissions are dropped.
+
+    Returns:
+        list: dicts of submission and similarity
+    """
+    image_ids = [image_id for image_id, _ in matches]
+    latest = dict(PLIPSubmission.objects.filter(image_id__in=image_ids).order_by()
+                  .values('image_id').annotate(latest=Max('id')).values_list('image_id', 'latest'))
+    submissions = (queryset if queryset is not None else PLIPSubmission.objects.all()).in_bulk(latest.values())
+    return [{'submission': submissions[latest[image_id]], 'similarity': similarity}
+            for image_id, similarity in matches if latest.get(image_id) in submissions]
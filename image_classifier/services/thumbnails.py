@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+
+
+def thumbnail_name(md5_checksum) -> str:
+    """Storage name of an image's thumbnail, fanned out over two directory levels of its md5"""
+    return f"{md5_checksum[:2]}/{md5_checksum[2:4]}/{md5_checksum}.jpg"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage for files named by a hash of their content, under PLIP_THUMBNAIL_DIR unless a
+    location is given. A name that already exists holds the same content, so saving it again keeps the
+    existing file rather than picking a new name. Files are written to a temporary name and renamed into
+    place, so a concurrent reader or nginx never sees a partial file.
+    """
+    @property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.PLIP_THUMBNAIL_DIR)
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            return name
+
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            # mkstemp creates owner-only files, which nginx running as another user could not serve
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return name
+
+
+def get_thumbnail_storage():
+    return storages['plip_thumbnails']
+
+
+def save_thumbnails(thumbnails):
+    """Writes thumbnail bytes keyed by md5 to the thumbnail store, skipping those already stored"""
+    storage = get_thumbnail_storage()
+    for md5_checksum, thumbnail in thumbnails.items():
+        storage.save(thumbnail_name(md5_checksum), ContentFile(thumbnail))
+
+
+def read_thumbnail(md5_checksum, blob=b'') -> bytes:
+    """
+    Thumbnail bytes of an image: the database blob of rows move_thumbnails has not reached yet,
+    otherwise the file in the thumbnail store. Empty if neither exists.
+    """
+    if blob:
+        return bytes(blob)
+    try:
+        with get_thumbnail_storage().open(thumbnail_name(md5_checksum)) as thumbnail_file:
+            return thumbnail_file.read()
+    except FileNotFoundError:
+        return b''
@@ -0,0 +1,138 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+from django.conf import settings
+
+
+# Class map colors, cycled when a label list is longer than the palette
+CLASS_MAP_COLORS = [
+    (31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40), (148, 103, 189),
+    (140, 86, 75), (227, 119, 194), (127, 127, 127), (188, 189, 34), (23, 190, 207),
+]
+# Grid value of cells without a tile, which also caps the label list at 255 labels
+NO_TILE = 255
+
+
+def open_for_tiling(image_file, max_decode_pixels=None):
+    """
+    Opens an upload for tiling with a bounded decoded raster.
+    Only the header is read up front; JPEGs larger than max_decode_pixels are decoded at 1/2, 1/4 or 1/8 scale
+    by the DCT decoder, and other formats over the limit are rejected before any pixel data is decoded, as
+    Pillow can only decode them whole at native resolution.
+
+    Returns:
+        tuple: (RGB image, scale) where scale is original pixels per decoded pixel
+    """
+    if max_decode_pixels is None:
+        max_decode_pixels = getattr(settings, 'PLIP_TILE_MAX_DECODE_PIXELS', 36_000_000)
+
+    image_file.seek(0)
+    is_jpeg = image_file.read(3) == b'\xff\xd8\xff'
+    image_file.seek(0)
+
+    # Slide exports are over PIL's decompression bomb limit, which Image.open enforces before draft() can
+    # shrink the decode, so JPEGs are opened through the plugin directly and bounded by the draft scale below
+    image = JpegImagePlugin.JpegImageFile(image_file) if is_jpeg else Image.open(image_file)
+    width, height = image.size
+    scale = 1
+
+    if width * height > max_decode_pixels:
+        if not is_jpeg:
+            raise ValueError(f"{image.format} images over {max_decode_pixels} pixels can not be tiled, "
+                             f"export the region as JPEG")
+
+        for scale in (2, 4, 8):
+            if math.ceil(width / scale) * math.ceil(height / scale) <= max_decode_pixels:
+                break
+        else:
+            raise ValueError(f"Image of {width}x{height} pixels is too large to tile")
+
+        image.draft('RGB', (width // scale, height // scale))
+
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image, scale
+
+
+def iter_tile_boxes(width, height, tile_size):
+    """Yields (column, row, box) for a non-overlapping grid, skipping edge tiles under half a tile"""
+    min_edge = tile_size // 2
+
+    for row, top in enumerate(range(0, height, tile_size)):
+        for column, left in enumerate(range(0, width, tile_size)):
+            right, bottom = min(left + tile_size, width), min(top + tile_size, height)
+            if right - left >= min_edge and bottom - top >= min_edge:
+                yield column, row, (left, top, right, bottom)
+
+
+def classify_tiles(image, scale, labels, classifier, tile_size=224, batch_size=32):
+    """
+    Runs every tile through batched vision forwards, holding at most batch_size tile crops at a time.
+    tile_size is in original pixels, so an image decoded at reduced scale is cut into tiles of tile_size / scale
+    decoded pixels: each tile covers the same tissue as at native resolution, seen at 1 / scale of its detail.
+
+    Returns:
+        dict: per-tile predictions in original image coordinates, the label index grid and mean label scores
+
+    Raises:
+        ValueError: if there are more labels than the uint8 label index grid can hold
+    """
+    if len(labels) > NO_TILE:
+        raise ValueError(f"Tiled classification supports at most {NO_TILE} labels, got {len(labels)}")
+
+    decoded_tile_size = max(1, round(tile_size / scale))
+    columns, rows = math.ceil(image.width / decoded_tile_size), math.ceil(image.height / decoded_tile_size)
+    grid = np.full((rows, columns), NO_TILE, dtype=np.uint8)
+    score_sum = np.zeros(len(labels), dtype=np.float64)
+    tiles = []
+
+    boxes = iter_tile_boxes(image.width, image.height, decoded_tile_size)
+    while True:
+        batch = [box for _, box in zip(range(batch_size), boxes)]
+        if not batch:
+            break
+
+        embeddings = classifier.embed_images([image.crop(box) for column, row, box in batch])
+        predictions = classifier.score_embeddings(embeddings, labels)
+
+        for (column, row, box), prediction in zip(batch, predictions):
+            grid[row, column] = labels.index(prediction['predicted_label'])
+            score_sum += [prediction['detailed_scores'][label] for label in labels]
+
+            left, top, right, bottom = box
+            tiles.append({
+                'x': left * scale, 'y': top * scale,
+                'width': (right - left) * scale, 'height': (bottom - top) * scale,
+                'label': prediction['predicted_label'], 'score': prediction['confidence'],
+            })
+
+    mean_scores = score_sum / max(len(tiles), 1)
+    return {
+        'tiles': tiles,
+        'grid': grid,
+        'detailed_scores': {label: float(score) for label, score in zip(labels, mean_scores)},
+    }
+
+
+def render_class_map(grid, max_side=512):
+    """Renders the label index grid as a PNG, one color block per tile, sized to at most max_side pixels"""
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    for index in range(NO_TILE):
+        palette[index] = CLASS_MAP_COLORS[index % len(CLASS_MAP_COLORS)]
+
+    class_map = Image.fromarray(palette[grid], 'RGB')
+    block = max(1, max_side // max(grid.shape))
+    class_map = class_map.resize((grid.shape[1] * block, grid.shape[0] * block), Image.Resampling.NEAREST)
+
+    buffer = io.BytesIO()
+    class_map.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def class_map_legend(labels):
+    return {label: '#%02x%02x%02x' % CLASS_MAP_COLORS[index % len(CLASS_MAP_COLORS)]
+            for index, label in enumerate(labels)}
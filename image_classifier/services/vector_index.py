@@ -0,0 +1,412 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import numpy as np
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Rows converted to float32 and multiplied at a time; small enough for the float16 conversion to stay in cache
+SCAN_CHUNK_ROWS = 4096
+# Rows projected and written at a time while building
+BUILD_CHUNK_ROWS = 65536
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, highest first"""
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def fit_pca(sample: np.ndarray, dim: int) -> dict:
+    """Principal components of a sample of embeddings, as {'mean', 'components'} with components of shape (dim, d)"""
+    sample = np.asarray(sample, dtype=np.float32)
+    mean = sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    return {'mean': mean, 'components': np.ascontiguousarray(vt[:dim])}
+
+
+def _assign(vectors, centroids, chunk_rows=16384) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_rows):
+        chunk = np.asarray(vectors[start:start + chunk_rows], dtype=np.float32)
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_ivf(vectors, nlist=None, iterations=10, sample_per_list=64, seed=0) -> dict:
+    """
+    Clusters normalized rows into nlist inverted lists with spherical k-means trained on a sample.
+
+    Returns:
+        dict: centroids (nlist, d), order (row indices grouped by list), offsets (nlist + 1) and rows,
+        the number of rows covered; rows appended later are scanned exactly until the next build
+    """
+    rows = len(vectors)
+    nlist = max(1, min(nlist or int(np.sqrt(rows)), rows))
+    rng = np.random.default_rng(seed)
+
+    sample_index = np.sort(rng.choice(rows, min(rows, nlist * sample_per_list), replace=False))
+    sample = np.asarray(vectors[sample_index], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        # Lists that lost every point are reseeded from random sample rows
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+
+    assignments = _assign(vectors, centroids)
+    return {
+        'centroids': centroids.astype(np.float32),
+        'order': np.argsort(assignments, kind='stable').astype(np.int64),
+        'offsets': np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))]).astype(np.int64),
+        'rows': np.int64(rows),
+    }
+
+
+class VectorStore:
+    """
+    Append-only memory-mapped matrix of one model's image embeddings, kept next to the database.
+
+    Rows are L2-normalized, optionally PCA-reduced, and stored as PLIP_VECTOR_DTYPE in vectors.bin, with the
+    PLIPImage id of each row in ids.bin. A PCA-reduced store also keeps the unreduced rows in source.bin for
+    queries from another modality, which a projection fitted to image embeddings would distort.
+    Web processes append as embeddings are committed, under a file lock; readers map the files and pick up
+    appended rows on their next search without copying the matrix.
+    An optional IVF index (ivf.npz) groups rows into inverted lists around k-means centroids, so a query only
+    scans the lists nearest to it; rows appended after the index was trained are always scanned.
+    build() rewrites everything from scratch and replaces the files atomically.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._meta_mtime = None
+        self._meta = None
+        self._pca = None
+        self._ivf = None
+        self._rows = 0
+        self._vectors = None
+        self._source = None
+        self._ids = None
+
+    @contextmanager
+    def _file_lock(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / 'lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        try:
+            with open(self.path / 'meta.json') as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta, suffix=''):
+        with open(self.path / f'meta.json{suffix}', 'w') as meta_file:
+            json.dump(meta, meta_file, indent=2)
+
+    def _load_npz(self, name):
+        try:
+            with np.load(self.path / name) as data:
+                return {key: data[key] for key in data.files}
+        except FileNotFoundError:
+            return None
+
+    def _stored_rows(self, meta):
+        """Rows present in every file; a crash between the appends leaves a partial row to ignore"""
+        itemsize = np.dtype(meta['dtype']).itemsize
+        try:
+            rows = min(os.path.getsize(self.path / 'vectors.bin') // (meta['dim'] * itemsize),
+                       os.path.getsize(self.path / 'ids.bin') // 8)
+        except FileNotFoundError:
+            return 0
+        if (self.path / 'source.bin').exists():
+            rows = min(rows, os.path.getsize(self.path / 'source.bin') // (meta['source_dim'] * itemsize))
+        return rows
+
+    @staticmethod
+    def _prepare(vectors, pca):
+        """Projects embeddings into the stored space: PCA-reduced when configured, then L2-normalized"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if pca is not None:
+            vectors = (vectors - pca['mean']) @ pca['components'].T
+        return _normalize(vectors)
+
+    def append(self, ids, vectors):
+        """Adds embeddings of the given image ids, creating the store on the first append"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+
+        with self._file_lock():
+            meta = self._read_meta()
+            if meta is None:
+                meta = {'dim': vectors.shape[1], 'source_dim': vectors.shape[1],
+                        'dtype': getattr(settings, 'PLIP_VECTOR_DTYPE', 'float16'), 'built_at': None}
+                self._write_meta(meta)
+
+            pca = self._load_npz('pca.npz')
+            rows = self._prepare(vectors, pca).astype(meta['dtype'])
+
+            # Trim any partial row left by an interrupted append so the files stay aligned
+            stored = self._stored_rows(meta)
+            itemsize = np.dtype(meta['dtype']).itemsize
+            with open(self.path / 'vectors.bin', 'ab') as vector_file:
+                vector_file.truncate(stored * meta['dim'] * itemsize)
+                vector_file.write(rows.tobytes())
+            if pca is not None:
+                with open(self.path / 'source.bin', 'ab') as source_file:
+                    source_file.truncate(stored * meta['source_dim'] * itemsize)
+                    source_file.write(_normalize(vectors).astype(meta['dtype']).tobytes())
+            with open(self.path / 'ids.bin', 'ab') as id_file:
+                id_file.truncate(stored * 8)
+                id_file.write(ids.tobytes())
+
+    def build(self, chunks, pca_dim=0, nlist=None, catch_up=None, sample_rows=100_000):
+        """
+        Rewrites the store from an iterable of (ids, vectors) chunks, optionally fitting a PCA reduction to
+        pca_dim and training an IVF index with nlist lists (0 disables it, None picks sqrt(rows)).
+        catch_up, if given, is called under the append lock just before the new files replace the old ones and
+        returns further chunks, so rows appended while the build ran are not lost.
+
+        Returns:
+            dict: rows, dim and nlist of the new store
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        dtype = getattr(settings, 'PLIP_VECTOR_DTYPE', 'float16')
+        raw_path, ids_path = self.path / 'raw.tmp', self.path / 'ids.bin.tmp'
+
+        # First pass: the unreduced normalized rows, so PCA can be fitted on a sample of everything
+        source_dim, rows = None, 0
+        with open(raw_path, 'wb') as raw_file, open(ids_path, 'wb') as id_file:
+            for ids, vectors in chunks:
+                vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+                source_dim = vectors.shape[1]
+                raw_file.write(vectors.astype(np.float32).tobytes())
+                id_file.write(np.asarray(ids, dtype=np.int64).tobytes())
+                rows += len(vectors)
+
+        if not rows:
+            raw_path.unlink()
+            ids_path.unlink()
+            return {'rows': 0, 'dim': 0, 'nlist': 0}
+
+        raw = np.memmap(raw_path, dtype=np.float32, mode='r', shape=(rows, source_dim))
+        pca = None
+        if pca_dim and pca_dim < source_dim:
+            sample = np.sort(np.random.default_rng(0).choice(rows, min(rows, sample_rows), replace=False))
+            pca = fit_pca(raw[sample], pca_dim)
+        dim = pca['components'].shape[0] if pca is not None else source_dim
+
+        with open(self.path / 'vectors.bin.tmp', 'wb') as vector_file:
+            for start in range(0, rows, BUILD_CHUNK_ROWS):
+                vector_file.write(self._prepare(raw[start:start + BUILD_CHUNK_ROWS], pca).astype(dtype).tobytes())
+        if pca is not None:
+            with open(self.path / 'source.bin.tmp', 'wb') as source_file:
+                for start in range(0, rows, BUILD_CHUNK_ROWS):
+                    source_file.write(np.asarray(raw[start:start + BUILD_CHUNK_ROWS]).astype(dtype).tobytes())
+        del raw
+        raw_path.unlink()
+
+        ivf = None
+        if nlist != 0:
+            vectors = np.memmap(self.path / 'vectors.bin.tmp', dtype=dtype, mode='r', shape=(rows, dim))
+            ivf = train_ivf(vectors, nlist)
+            del vectors
+
+        if pca is not None:
+            np.savez(self.path / 'pca.tmp.npz', **pca)
+        if ivf is not None:
+            np.savez(self.path / 'ivf.tmp.npz', **ivf)
+        meta = {'dim': dim, 'source_dim': source_dim, 'dtype': dtype, 'built_at': time.time()}
+
+        with self._file_lock():
+            if catch_up is not None:
+                with (open(self.path / 'vectors.bin.tmp', 'ab') as vector_file, open(ids_path, 'ab') as id_file,
+                      open(self.path / 'source.bin.tmp', 'ab') if pca is not None else nullcontext() as source_file):
+                    for ids, vectors in catch_up():
+                        vector_file.write(self._prepare(vectors, pca).astype(dtype).tobytes())
+                        id_file.write(np.asarray(ids, dtype=np.int64).tobytes())
+                        if source_file is not None:
+                            source_file.write(_normalize(np.asarray(vectors, dtype=np.float32)).astype(dtype).tobytes())
+
+            for name, built in (('pca.npz', pca), ('ivf.npz', ivf), ('source.bin', pca)):
+                temp_name = name.replace('.npz', '.tmp.npz') if name.endswith('.npz') else name + '.tmp'
+                if built is not None:
+                    os.replace(self.path / temp_name, self.path / name)
+                elif (self.path / name).exists():
+                    (self.path / name).unlink()
+            os.replace(self.path / 'vectors.bin.tmp', self.path / 'vectors.bin')
+            os.replace(ids_path, self.path / 'ids.bin')
+            # meta.json is replaced last; its new mtime is what tells readers to remap
+            self._write_meta(meta, suffix='.tmp')
+            os.replace(self.path / 'meta.json.tmp', self.path / 'meta.json')
+
+        return {'rows': rows, 'dim': dim, 'nlist': len(ivf['centroids']) if ivf is not None else 0}
+
+    def _refresh(self):
+        """Remaps the files after a rebuild or when other processes have appended rows"""
+        try:
+            mtime = os.stat(self.path / 'meta.json').st_mtime_ns
+        except FileNotFoundError:
+            self._meta, self._rows = None, 0
+            return
+
+        if mtime != self._meta_mtime:
+            self._meta_mtime = mtime
+            self._meta = self._read_meta()
+            self._pca = self._load_npz('pca.npz')
+            self._ivf = self._load_npz('ivf.npz')
+            self._rows = -1
+
+        rows = self._stored_rows(self._meta)
+        if rows != self._rows:
+            self._rows = rows
+            if rows:
+                self._vectors = np.memmap(self.path / 'vectors.bin', dtype=self._meta['dtype'], mode='r',
+                                          shape=(rows, self._meta['dim']))
+                self._ids = np.memmap(self.path / 'ids.bin', dtype=np.int64, mode='r', shape=(rows,))
+                self._source = None
+                if (self.path / 'source.bin').exists():
+                    self._source = np.memmap(self.path / 'source.bin', dtype=self._meta['dtype'], mode='r',
+                                             shape=(rows, self._meta['source_dim']))
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._rows if self._meta else 0
+
+    def status(self) -> dict:
+        with self._lock:
+            self._refresh()
+            if not self._meta:
+                return {'rows': 0}
+            return {
+                'rows': self._rows,
+                'dim': self._meta['dim'],
+                'dtype': self._meta['dtype'],
+                'pca': self._pca is not None,
+                'nlist': len(self._ivf['centroids']) if self._ivf is not None else 0,
+                'unindexed_rows': self._rows - int(self._ivf['rows']) if self._ivf is not None else self._rows,
+            }
+
+    def search(self, query, k=10, method='exact', nprobe=None, exclude=(), unreduced=False):
+        """
+        Cosine similarity search for one embedding.
+        'exact' scans every row; 'ivf' scans the nprobe inverted lists nearest to the query plus the rows
+        appended since the index was trained, and falls back to exact when no index has been built.
+        unreduced scans every unreduced row instead, for queries such as text embeddings that the PCA and IVF
+        centroids, both fitted to image embeddings, would distort.
+
+        Returns:
+            list: (image id, similarity) pairs, most similar first, without excluded ids or repeats
+        """
+        with self._lock:
+            self._refresh()
+            if not self._meta or not self._rows:
+                return []
+            vectors, ids, pca, ivf, rows = self._vectors, self._ids, self._pca, self._ivf, self._rows
+            if unreduced and pca is not None:
+                if self._source is None:
+                    raise RuntimeError("This PCA-reduced store predates unreduced rows; rerun build_similarity_index")
+                vectors, pca, ivf = self._source, None, None
+
+        query = self._prepare(np.asarray(query).reshape(1, -1), pca)[0]
+        exclude = set(exclude)
+        # Over-fetch so that excluded ids and any repeated image still leave k results
+        want = k + len(exclude) + 8
+
+        if method == 'ivf' and ivf is not None and not unreduced:
+            nprobe = min(nprobe or getattr(settings, 'PLIP_SIMILARITY_NPROBE', 8), len(ivf['centroids']))
+            probed = _top_k(ivf['centroids'] @ query, nprobe)
+            offsets, order = ivf['offsets'], ivf['order']
+            candidates = np.sort(np.concatenate(
+                [order[offsets[cluster]:offsets[cluster + 1]] for cluster in probed]
+                + [np.arange(int(ivf['rows']), rows)]))
+        else:
+            candidates = None
+
+        scores, found = self._scan(vectors, query, candidates, rows, want)
+
+        results, seen = [], set()
+        for score, row in zip(scores, found):
+            image_id = int(ids[row])
+            if image_id in exclude or image_id in seen:
+                continue
+            seen.add(image_id)
+            results.append((image_id, float(score)))
+            if len(results) == k:
+                break
+        return results
+
+    @staticmethod
+    def _scan(vectors, query, candidates, rows, want):
+        """Scores candidate rows (all rows if None) chunk by chunk, keeping only the running top rows"""
+        total = rows if candidates is None else len(candidates)
+        buffer = np.empty((min(total, SCAN_CHUNK_ROWS), vectors.shape[1]), dtype=np.float32)
+        best_scores, best_rows = [], []
+        for start in range(0, total, SCAN_CHUNK_ROWS):
+            if candidates is None:
+                chunk_rows = np.arange(start, min(start + SCAN_CHUNK_ROWS, rows))
+                chunk = vectors[start:start + SCAN_CHUNK_ROWS]
+            else:
+                chunk_rows = candidates[start:start + SCAN_CHUNK_ROWS]
+                chunk = vectors[chunk_rows]
+            np.copyto(buffer[:len(chunk)], chunk)
+            scores = buffer[:len(chunk)] @ query
+            top = _top_k(scores, want)
+            best_scores.append(scores[top])
+            best_rows.append(chunk_rows[top])
+
+        if not best_scores:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        scores, found = np.concatenate(best_scores), np.concatenate(best_rows)
+        top = _top_k(scores, want)
+        return scores[top], found[top]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_vector_store(model_key: str) -> VectorStore:
+    """The process-wide store of a model key, under PLIP_VECTOR_DIR"""
+    path = Path(settings.PLIP_VECTOR_DIR) / re.sub(r'[^A-Za-z0-9._-]+', '_', model_key)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = VectorStore(path)
+        return _stores[path]
+
+
+def append_embeddings(model_key: str, image_ids, embeddings):
+    """Adds committed embeddings to their model's store; a failure here only delays them until the next build"""
+    try:
+        get_vector_store(model_key).append(image_ids, np.asarray(embeddings).reshape(len(image_ids), -1))
+    except Exception:
+        logger.exception("Could not append %d embeddings to the %s vector store", len(image_ids), model_key)
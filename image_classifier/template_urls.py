@@ -1,10 +1,11 @@
 from django.urls import path
-from .template_views import PLIPView, PLIPImageView, AddFilterRowView, UpdateFilterStateView
+from .template_views import PLIPView, PLIPImageView, PLIPAnalyticsView, AddFilterRowView, UpdateFilterStateView
 
 
 urlpatterns = [
     path('plip/', PLIPView.as_view(), name='plip'),
     path('plip_data/', PLIPImageView.as_view(), name='plip_data'),
+    path('plip_analytics/', PLIPAnalyticsView.as_view(), name='plip_analytics'),
     path('add-filter-row/', AddFilterRowView.as_view(), name='add-filter-row'),
     path('update-filter-state/', UpdateFilterStateView.as_view(), name='update-filter-state'),
 ]
@@ -1,13 +1,5 @@
-import io
-import tempfile
-import hashlib
-
-from PIL import Image
-
-from django.db import transaction
-from django.db.models import Q
-from django.http import HttpResponse
-from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse
+from django.utils.dateparse import parse_date
 from django.views import View
 from django.views.generic import FormView, TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -15,8 +7,15 @@ from django.shortcuts import render
 
 from authentication.permissions import ContributorRequiredMixin
 from .forms import ImageUploadForm
-from .services.plip import PLIPClassifier
-from .models import PLIPImage, PLIPSubmission, PLIPLabel, PLIPScore
+from .services.inference import get_classifier, InferenceUnavailable
+from .services.inference_client import InferenceServerError
+from .services.scoring import parse_labels
+from .services.ingest import ingest_upload, save_results
+from .services.similarity import search_text, latest_submissions
+from .services.pagination import keyset_page, count_rows
+from .services.filters import compile_filter, FilterError
+from .services.analytics import analytics_summary, BUCKETS
+from .models import PLIPSubmission
 from .serializers.plip_serializers import PLIPSubmissionSerializer
 
 
@@ -46,73 +45,29 @@ class PLIPView(LoginRequiredMixin, ContributorRequiredMixin, FormView):
 
     def form_valid(self, form):
         uploaded_file = form.cleaned_data['image']
-        form_labels = form.cleaned_data['labels']
         expected_label = form.cleaned_data['expected_label']
-        md5 = hashlib.md5()
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            for chunk in uploaded_file.chunks():
-                temp_file.write(chunk)
-                md5.update(chunk)
-
-            temp_path = temp_file.name
 
-        md5_checksum = md5.hexdigest()
-
-        pil_img = Image.open(temp_path).convert('RGB')
-        plip_classifier = PLIPClassifier()
-
-        if form_labels:
-            labels = [label.strip() for label in form_labels.split(',')]
-
-        else:
-            labels = ["adipose", "background", "debris", "lymphocytes", "mucus", "smooth muscle", "normal colon mucosa",
-                      "cancer-associated stroma", "colorectal adenocarcinoma epithelium"]
-
-        prediction = plip_classifier.predict(pil_img, candidate_labels=labels)
+        try:
+            plip_classifier = get_classifier()
+            result = ingest_upload(uploaded_file, parse_labels(form.cleaned_data['labels']), plip_classifier)
+            submission_obj = save_results(self.request.user, [result], expected_label, plip_classifier)[0]
+        except (InferenceUnavailable, InferenceServerError) as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
+        except (ValueError, OSError) as e:
+            # Oversized or truncated images the form's header check let through
+            form.add_error('image', str(e))
+            return self.form_invalid(form)
 
         # Sort results and create clean string of rounded values for output
-        results_sorted = dict(sorted(prediction['detailed_scores'].items(), key=lambda item: item[1], reverse=True))
+        results_sorted = dict(sorted(result['prediction']['detailed_scores'].items(),
+                                     key=lambda item: item[1], reverse=True))
         results_str = '<br>'.join([f"{key}: {round(value, 2)}" for key, value in results_sorted.items()])
 
-        pil_img.thumbnail((224, 224), Image.Resampling.LANCZOS)
-        thumb_buffer = io.BytesIO()
-        pil_img.save(thumb_buffer, format="JPEG")
-
-        # Execute statements with atomicity to ensure no partial relationships are created
-        with transaction.atomic():
-            # Only one instance of an image file is needed, so retrieve based on md5 if it exists, otherwise create
-            image_obj, created = PLIPImage.objects.get_or_create(
-                md5=md5_checksum,
-                defaults={"blob_image": thumb_buffer.getvalue()},
-            )
-
-            # If expected_label is populated, get or create it as a label object
-            expected_label_obj = None
-
-            if expected_label:
-                expected_label_obj, created = PLIPLabel.objects.get_or_create(
-                    label=expected_label
-                )
-
-            submission_obj = PLIPSubmission.objects.create(filename=uploaded_file.name, image=image_obj,
-                                                           expected_label=expected_label_obj, user=self.request.user)
-
-            for key, value in results_sorted.items():
-                label_obj, created = PLIPLabel.objects.get_or_create(
-                    label=key
-                )
-
-                PLIPScore.objects.create(
-                    label=label_obj,
-                    score=value,
-                    submission=submission_obj,
-                )
-
         # Re-render the page with the results
         return self.render_to_response(
             self.get_context_data(form=form, result=results_str, expected_label=expected_label,
-                                  thumbnail=image_obj.image_base64)
+                                  thumbnail_url=submission_obj.image.thumbnail_url)
         )
 
 
@@ -122,71 +77,110 @@ class PLIPImageView(LoginRequiredMixin, TemplateView):
 
     def get_template_names(self):
         if self.request.headers.get('HX-Request'):
+            # Infinite scroll appends the next rows in place of the sentinel row that requested them
+            if self.request.GET.get('cursor'):
+                return ['_result_rows.html']
             return ['_filter_results.html']
         return [self.template_name]
 
-    def get_queryset(self):
-        queryset = (PLIPSubmission.objects.select_related('image').all()
-                    .prefetch_related('submission_scores__label').order_by('-id'))
-
-        q_and_objects = Q()
-        q_or_objects = Q()
-
-        has_label_filters = False
-
-        # min_date = self.request.GET.get('min_date')
-        # max_date = self.request.GET.get('max_date')
-        #
-        # if min_date:
-        #     q_and_objects &= Q(created_at__gte=min_date)
-        # if max_date:
-        #     q_and_objects &= Q(created_at__lte=max_date)
-
-        # Expected label filter
-        expected = self.request.GET.get('expected')
-        if expected:
-            q_and_objects &= Q(expected_label__label__iexact=expected)
-
-        # Dynamic Label Filters (label_0 ... label_4)
-        for i in range(5):
-            label = self.request.GET.get(f'label_{i}')
-            min_score = self.request.GET.get(f'min_{i}')
-            max_score = self.request.GET.get(f'max_{i}')
+    def filter_indices(self):
+        """Indices of the label filter rows present in the request"""
+        indices = set()
+        for key in self.request.GET.keys():
+            if key.startswith('label_'):
+                try:
+                    # Extract '3' from 'label_3'
+                    indices.add(int(key.split('_')[1]))
+                except (ValueError, IndexError):
+                    continue
+        return sorted(indices)
 
+    def get_queryset(self):
+        """
+        Filtered submissions: the expected label AND the label rows, which match when any (or all) of them do.
+        Top rows bound the submission's top prediction instead of any of its scores, and excluded rows match
+        submissions without such a score.
+
+        Raises:
+            FilterError: if a score bound is not a number or there are too many rows
+        """
+        queryset = PLIPSubmission.objects.all()
+
+        rows = []
+        for i in self.filter_indices():
+            label = self.request.GET.get(f'label_{i}', '').strip()
             if label:
-                has_label_filters = True
-                q_label_object = Q(submission_scores__label__label__icontains=label)
-
-                if min_score:
-                    q_label_object &= Q(submission_scores__score__gte=float(min_score))
-                if max_score:
-                    q_label_object &= Q(submission_scores__score__lte=float(max_score))
-
-                # Multiple label/score filters are evaluated as ORs
-                q_or_objects |= q_label_object
+                row = {'top' if self.request.GET.get(f'top_{i}') else 'label': label,
+                       'min': self.request.GET.get(f'min_{i}'), 'max': self.request.GET.get(f'max_{i}')}
+                rows.append({'not': row} if self.request.GET.get(f'exclude_{i}') else row)
 
-        # Combine: Dates AND (Label A OR Label B)
-        # Only include or objects if filters are present to avoid potentially appending falsey value or unneeded joins
-        q_final = q_and_objects
-        if has_label_filters:
-            q_final &= q_or_objects
-
-        return queryset.filter(q_final).distinct()
+        tree = {'and': []}
+        expected = self.request.GET.get('expected', '').strip()
+        if expected:
+            tree['and'].append({'expected': expected})
+        if rows:
+            tree['and'].append({'and' if self.request.GET.get('match') == 'all' else 'or': rows})
+
+        return queryset.filter(compile_filter(tree))
+
+    def get_filter_page(self, cursor, context):
+        """
+        Filter mode: the next page of filtered submissions, newest first, found by seeking past the cursor
+        rather than counting off rows, with the total reused from the count cache for the same filters.
+        """
+        try:
+            filtered_qs = self.get_queryset()
+        except FilterError as e:
+            context['search_error'] = str(e)
+            return [], None
+
+        try:
+            submissions, next_cursor = keyset_page(PLIPSubmissionSerializer.setup_eager_loading(filtered_qs),
+                                                   cursor, self.page_size)
+        except ValueError:
+            raise Http404("Invalid cursor")
+
+        if not cursor:
+            filters = {key: value for key, value in self.request.GET.items() if key != 'cursor' and value}
+            context['total'], context['total_approximate'] = count_rows(filtered_qs, 'approximate', filters)
+        return PLIPSubmissionSerializer(submissions, many=True).data, next_cursor
+
+    def get_text_search_page(self, query, cursor, context):
+        """
+        Text search mode: pages through submissions ranked by how well their image matches the query,
+        instead of filtering them. Each image is shown once, by its latest submission. The ranking is held in
+        memory, so the cursor is simply the offset into it.
+        """
+        try:
+            matches = search_text(get_classifier(), query)
+        except (InferenceUnavailable, InferenceServerError) as e:
+            context['search_error'] = str(e)
+            matches = []
+
+        offset = int(cursor) if cursor and cursor.isdigit() else 0
+        results = latest_submissions(matches[offset:offset + self.page_size],
+                                     PLIPSubmissionSerializer.setup_eager_loading(PLIPSubmission.objects.all()))
+        context['total'], context['total_approximate'] = len(matches), False
+
+        serialized_submissions = PLIPSubmissionSerializer([result['submission'] for result in results], many=True).data
+        for submission, result in zip(serialized_submissions, results):
+            submission['similarity'] = round(result['similarity'], 3)
+        next_cursor = str(offset + self.page_size) if offset + self.page_size < len(matches) else None
+        return serialized_submissions, next_cursor
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['filters_expanded'] = self.request.session.get('filters_expanded', True)
+        context['query'] = self.request.GET.get('q', '').strip()
 
-        # Get Filtered Data
-        filtered_qs = self.get_queryset()
+        context['cursor'] = self.request.GET.get('cursor', '')
 
-        # Paginate results
-        paginator = Paginator(filtered_qs, self.page_size)
-        page_number = self.request.GET.get('page')
-        page = paginator.get_page(page_number)
+        if context['query']:
+            serialized_submissions, next_cursor = self.get_text_search_page(context['query'], context['cursor'],
+                                                                            context)
+        else:
+            serialized_submissions, next_cursor = self.get_filter_page(context['cursor'], context)
 
-        # Serialize page
-        serialized_submissions = PLIPSubmissionSerializer(page, many=True).data
         for submission in serialized_submissions:
             scores_list = []
             for score in submission['submission_scores']:
@@ -194,46 +188,74 @@ class PLIPImageView(LoginRequiredMixin, TemplateView):
             submission['scores_str'] = '<br>'.join(scores_list)
 
         context['submissions'] = serialized_submissions
+        context['next_cursor'] = next_cursor
 
-        # Construct Pagination object
-        context['pagination'] = {
-            'number': page.number,
-            'num_pages': paginator.num_pages,
-            'has_next': page.has_next,
-            'has_previous': page.has_previous,
-            'next_page_number': page.next_page_number if page.has_next() else None,
-            'previous_page_number': page.previous_page_number if page.has_previous() else None
-        }
-
-        # Identify existing filter indices for persistence after "apply filters"
-        # active_indices = set([0])  # Always include row 0
-        active_indices = {0}
-        for key in self.request.GET.keys():
-            if key.startswith('label_'):
-                try:
-                    # Extract '3' from 'label_3'
-                    index = int(key.split('_')[1])
-                    active_indices.add(index)
-                except (ValueError, IndexError):
-                    continue
+        # Identify existing filter indices for persistence after "apply filters"; row 0 is always shown
+        active_indices = {0, *self.filter_indices()}
 
         # Extract existing filters from request and populate
         filter_rows = []
-        for i in sorted(list(active_indices)):
+        for i in sorted(active_indices):
             filter_rows.append({
                 'index': i,
                 'label': self.request.GET.get(f'label_{i}', ''),
-                'expected': self.request.GET.get(f'expected_{i}', ''),
                 'min': self.request.GET.get(f'min_{i}', ''),
                 'max': self.request.GET.get(f'max_{i}', ''),
+                'top': bool(self.request.GET.get(f'top_{i}')),
+                'exclude': bool(self.request.GET.get(f'exclude_{i}')),
             })
 
         context['filter_rows'] = filter_rows
+        context['match'] = self.request.GET.get('match', 'any')
 
         # Preserve URL params
         params = self.request.GET.copy()
-        if 'page' in params:
-            del params['page']
+        if 'cursor' in params:
+            del params['cursor']
         context['url_params'] = params.urlencode()
 
         return context
+
+
+class PLIPAnalyticsView(LoginRequiredMixin, TemplateView):
+    """
+    Dashboard of prediction agreement with expected labels, read from the analytics summary tables
+    """
+    template_name = 'plip_analytics.html'
+
+    def date_param(self, name):
+        """Date from a YYYY-MM-DD query parameter, None when missing or invalid"""
+        try:
+            return parse_date(self.request.GET.get(name, ''))
+        except ValueError:
+            return None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        start, end = self.date_param('start'), self.date_param('end')
+        bucket = self.request.GET.get('bucket') if self.request.GET.get('bucket') in BUCKETS else 'week'
+        label = self.request.GET.get('label', '').strip()
+
+        summary = analytics_summary(start, end, bucket, label or None)
+
+        # Confusion matrix rows by expected label, with a column per label either side has used
+        labels = [row['label'] for row in summary['labels']]
+        cells = {(cell['expected'], cell['predicted']): cell['count'] for cell in summary['confusion']}
+        matrix = [{'label': expected, 'cells': [{'count': cells.get((expected, predicted), 0),
+                                                 'diagonal': expected == predicted} for predicted in labels]}
+                  for expected in labels if any((expected, predicted) in cells for predicted in labels)]
+
+        edges = summary['bin_edges']
+        histograms = []
+        for histogram in summary['histograms']:
+            peak = max(histogram['counts']) or 1
+            bins = []
+            for index, count in enumerate(histogram['counts']):
+                labelled = histogram['correct'][index] + histogram['incorrect'][index]
+                bins.append({'low': edges[index], 'high': edges[index + 1], 'count': count, 'peak': peak,
+                             'accuracy': histogram['correct'][index] / labelled if labelled else None})
+            histograms.append({'period': histogram['period'], 'total': sum(histogram['counts']), 'bins': bins})
+
+        context.update(summary=summary, matrix=matrix, matrix_labels=labels, histograms=histograms,
+                       buckets=BUCKETS, bucket=bucket, label=label, start=start, end=end)
+        return context
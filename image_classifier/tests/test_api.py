@@ -1,7 +1,20 @@
+import csv
 import io
+import json
+import tempfile
+import zipfile
+from unittest import mock
 from PIL import Image
 
+from datetime import timedelta
+
 from django.urls import reverse
+from django.utils import timezone
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from rest_framework.authtoken.models import Token
@@ -9,6 +22,12 @@ from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 
 from authentication.models import User
+from image_classifier.models import (PLIPConfidenceCount, PLIPConfusionCount, PLIPImage, PLIPImageEmbedding, PLIPLabel,
+                                     PLIPScore, PLIPSubmission, PLIPTile, PLIPJob)
+from image_classifier.services.analytics import rebuild_analytics
+from image_classifier.services.inference_client import InferenceServerBusy
+from image_classifier.services.jobs import claim_jobs, process_jobs
+from image_classifier.services.labels import clear_label_cache
 
 
 class PLIPApiTests(APITestCase):
@@ -28,6 +47,14 @@ class PLIPApiTests(APITestCase):
         self.contrib_token = Token.objects.create(user=self.contrib_user)
         self.test_image = self.generate_test_image()
 
+        vector_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(vector_dir.cleanup)
+        self.enterContext(override_settings(PLIP_VECTOR_DIR=vector_dir.name))
+        thumbnail_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(thumbnail_dir.cleanup)
+        self.enterContext(override_settings(PLIP_THUMBNAIL_DIR=thumbnail_dir.name))
+        clear_label_cache()
+
     def test_pliplist_session(self):
         self.client.force_login(user=self.user)
         url = reverse('plip-list')
@@ -40,6 +67,153 @@ class PLIPApiTests(APITestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_pliplist_lean_options(self):
+        self.client.force_login(user=self.contrib_user)
+        self.client.post(reverse('plip-input'), {'labels': "test, labels", 'image': self.test_image,
+                                                 'expected_label': "test"}, format='multipart')
+        url = reverse('plip-list')
+
+        submission = self.client.post(url).json()['results'][0]
+        self.assertTrue(submission['image']['thumbnail_url'].startswith('http'))
+        self.assertNotIn('image_base64', submission['image'])
+        self.assertEqual(submission['top_label'], submission['submission_scores'][0]['label'])
+        self.assertEqual(set(submission), {'id', 'image', 'expected_label', 'submission_scores', 'top_label',
+                                           'top_score', 'created_at', 'filename', 'user'})
+
+        submission = self.client.post(f'{url}?thumbnails=base64').json()['results'][0]
+        self.assertTrue(submission['image']['image_base64'])
+
+        submission = self.client.post(f'{url}?fields=id,created_at,top_label').json()['results'][0]
+        self.assertEqual(set(submission), {'id', 'created_at', 'top_label'})
+
+        submission = self.client.post(f'{url}?scores=false&thumbnails=none').json()['results'][0]
+        self.assertNotIn('submission_scores', submission)
+        self.assertNotIn('image', submission)
+        self.assertIn('top_score', submission)
+
+        response = self.client.post(f'{url}?fields=id,blob_image')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pliplist_cursor_pagination(self):
+        self.client.force_login(user=self.user)
+        created_at = timezone.now()
+        # Half the rows share a timestamp, so ties have to be broken by id
+        submissions = PLIPSubmission.objects.bulk_create([
+            PLIPSubmission(image=PLIPImage.objects.create(md5=f'{index:032x}'), user=self.user, filename='x.jpg',
+                           created_at=created_at if index % 2 else created_at - timedelta(seconds=index))
+            for index in range(25)
+        ])
+        expected = [submission.id for submission in sorted(submissions, key=lambda submission: (
+            submission.created_at, submission.id), reverse=True)]
+
+        url, seen = f"{reverse('plip-list')}?fields=id", []
+        while url:
+            response = self.client.post(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.json())
+            seen.extend(submission['id'] for submission in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(seen, expected)
+
+        response = self.client.post(f"{reverse('plip-list')}?count=exact")
+        self.assertEqual((response.json()['count'], response.json()['count_approximate']), (25, False))
+        response = self.client.post(f"{reverse('plip-list')}?count=approximate")
+        self.assertTrue(response.json()['count_approximate'])
+        response = self.client.post(f"{reverse('plip-list')}?count=cached",
+                                    {'min_date': (created_at - timedelta(seconds=10)).date()}, format='json')
+        self.assertEqual(response.json()['count'], 25)
+
+        response = self.client.post(f"{reverse('plip-list')}?cursor=bogus")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pliplist_filter_tree(self):
+        self.client.force_login(user=self.user)
+        tumor, stroma = PLIPLabel.objects.create(label='tumor'), PLIPLabel.objects.create(label='stroma')
+        submission_ids = {}
+        for index, (name, tumor_score) in enumerate((('tumor', 0.9), ('mixed', 0.5), ('stroma', 0.1))):
+            submission = PLIPSubmission.objects.create(
+                image=PLIPImage.objects.create(md5=f'{index:032x}'), user=self.user, filename=f'{name}.jpg',
+                predicted_label=tumor if tumor_score > 0.5 else stroma,
+                predicted_score=max(tumor_score, 1 - tumor_score))
+            PLIPScore.objects.bulk_create([PLIPScore(submission=submission, label=tumor, score=tumor_score),
+                                           PLIPScore(submission=submission, label=stroma, score=1 - tumor_score)])
+            submission_ids[name] = submission.id
+
+        url = f"{reverse('plip-list')}?fields=id"
+        tree = {'and': [{'label': 'tumor', 'min': 0.3}, {'not': {'label': 'stroma', 'min': 0.4}}]}
+        response = self.client.post(url, {'filter': tree}, format='json')
+        self.assertEqual([submission['id'] for submission in response.json()['results']], [submission_ids['tumor']])
+
+        # The labels list and the filter tree are combined with AND
+        response = self.client.post(url, {'labels': [{'label': 'stroma', 'min': 0.3}],
+                                          'filter': {'label': 'tumor', 'min': 0.3}}, format='json')
+        self.assertEqual([submission['id'] for submission in response.json()['results']], [submission_ids['mixed']])
+
+        response = self.client.post(url, {'labels': [{'label': 'stroma', 'min': 0.6, 'top': True}]}, format='json')
+        self.assertEqual([submission['id'] for submission in response.json()['results']], [submission_ids['stroma']])
+
+        response = self.client.post(url, {'filter': {'label': 'tumor', 'min': 'high'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('filter', response.json())
+
+    def test_plipexport(self):
+        self.client.force_login(user=self.user)
+        tumor, stroma = PLIPLabel.objects.create(label='tumor'), PLIPLabel.objects.create(label='stroma')
+        for index, tumor_score in enumerate((0.75, 0.5, 0.25)):
+            submission = PLIPSubmission.objects.create(
+                image=PLIPImage.objects.create(md5=f'{index:032x}', blob_image=b'thumbnail'), user=self.user,
+                filename=f'{index}.jpg', expected_label=tumor, predicted_label=tumor if tumor_score > 0.5 else stroma,
+                predicted_score=max(tumor_score, 1 - tumor_score))
+            PLIPScore.objects.bulk_create([PLIPScore(submission=submission, label=tumor, score=tumor_score),
+                                           PLIPScore(submission=submission, label=stroma, score=1 - tumor_score)])
+        url = reverse('plip-export')
+
+        # Two queries per chunk of submissions, one for them and one for their scores, however many are exported
+        with self.settings(PLIP_EXPORT_CHUNK_SIZE=2), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, format='json')
+            rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual([(row['label'], row['score']) for row in rows[:2]], [('tumor', '0.75'), ('stroma', '0.25')])
+        self.assertNotIn('thumbnail_base64', rows[0])
+        self.assertLessEqual(len([query for query in queries.captured_queries
+                                  if 'image_classifier_plipscore' in query['sql']]), 2)
+
+        response = self.client.post(f"{url}?layout=wide&thumbnails=true", {'filter': {'label': 'tumor', 'min': 0.3}},
+                                    format='json')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual([(row['score_stroma'], row['score_tumor']) for row in rows], [('0.25', '0.75'), ('0.5', '0.5')])
+        self.assertEqual(rows[0]['thumbnail_base64'], 'dGh1bWJuYWls')
+
+        response = self.client.post(f"{url}?file_format=jsonl&layout=wide&columns=tumor",
+                                    {'labels': [{'label': 'stroma', 'min': 0.6, 'top': True}]}, format='json')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['score_tumor'] for line in lines], [0.25])
+
+        response = self.client.post(url, {'filter': {'label': 'tumor', 'min': 'high'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_submissions_command(self):
+        label = PLIPLabel.objects.create(label='tumor')
+        submission = PLIPSubmission.objects.create(image=PLIPImage.objects.create(md5='0' * 32), user=self.user,
+                                                   filename='tumor.jpg')
+        PLIPScore.objects.create(submission=submission, label=label, score=0.7)
+        unscored = PLIPSubmission.objects.create(image=PLIPImage.objects.create(md5='1' * 32), user=self.user,
+                                                 filename='unscored.jpg')
+
+        with tempfile.TemporaryDirectory() as export_dir:
+            path = f"{export_dir}/export.jsonl"
+            call_command('export_submissions', path, format='jsonl', stdout=io.StringIO())
+            with open(path) as export_file:
+                rows = [json.loads(line) for line in export_file]
+        # A submission without scores still gets a row in the long layout, as it is still listed by pliplist
+        self.assertEqual([(row['submission_id'], row['label'], row['score']) for row in rows],
+                         [(submission.id, 'tumor', 0.7), (unscored.id, None, None)])
+
+        with self.assertRaises(CommandError):
+            call_command('export_submissions', '-', filters='{"filter": {"label": ""}}')
+
     def test_plipinput_session(self):
         self.client.force_login(user=self.contrib_user)
         url = reverse('plip-input')
@@ -54,6 +228,56 @@ class PLIPApiTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertIn('filename', response.json())
 
+    def test_plipanalytics(self):
+        cache.clear()
+        self.client.force_login(user=self.contrib_user)
+        for expected_label in ("test", "labels"):
+            self.client.post(reverse('plip-input'), {'labels': "test, labels", 'image': self.generate_test_image(),
+                                                     'expected_label': expected_label}, format='multipart')
+
+        response = self.client.get(reverse('plip-analytics'), {'bucket': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.json()['submissions'], response.json()['labelled']), (2, 2))
+        # The same image gets the same prediction, so exactly one of the two expected labels agrees with it
+        self.assertEqual(response.json()['accuracy'], 0.5)
+        self.assertEqual(sum(cell['count'] for cell in response.json()['confusion']), 2)
+        self.assertEqual(response.json()['histograms'][0]['period'], timezone.localdate().replace(day=1).isoformat())
+
+        response = self.client.get(reverse('plip-analytics'), {'start': '2026-02-01', 'end': '2026-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_plipinput_query_count_independent_of_labels(self):
+        self.client.force_login(user=self.contrib_user)
+        url = reverse('plip-input')
+
+        query_counts = []
+        for color, labels in (('red', "a, b"), ('blue', "c, d, e, f, g, h, i, j")):
+            image_buffer = io.BytesIO()
+            Image.new('RGB', (64, 64), color).save(image_buffer, 'png')
+            data = {
+                'labels': labels,
+                'image': SimpleUploadedFile(f'{color}.png', image_buffer.getvalue(), content_type='image/png'),
+                'expected_label': labels.split(',')[0]
+            }
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    @override_settings(PLIP_DEPLOYMENT_ROLE='browse')
+    def test_plipinput_browse_role(self):
+        self.client.force_login(user=self.contrib_user)
+
+        data = {'labels': "test, labels", 'image': self.test_image, 'expected_label': "test"}
+        response = self.client.post(reverse('plip-input'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(PLIPSubmission.objects.count(), 0)
+
+        response = self.client.post(reverse('plip-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_plipinput_token(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.contrib_token.key)
         url = reverse('plip-input')
@@ -92,4 +316,330 @@ class PLIPApiTests(APITestCase):
         }
 
         response = self.client.post(url, data, format='multipart')
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_plipinput_reuses_stored_embedding(self):
+        self.client.force_login(user=self.contrib_user)
+        url = reverse('plip-input')
+
+        response = self.client.post(url, {'labels': "test, labels", 'image': self.test_image,
+                                           'expected_label': "test"}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(PLIPImageEmbedding.objects.count(), 1)
+
+        with mock.patch('image_classifier.services.batching.get_scheduler') as get_scheduler:
+            response = self.client.post(url, {'labels': "other, labels", 'image': self.generate_test_image(),
+                                               'expected_label': "test"}, format='multipart')
+            get_scheduler.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(PLIPImageEmbedding.objects.count(), 1)
+
+    def test_plipinput_result_cache_hit(self):
+        self.client.force_login(user=self.contrib_user)
+        url = reverse('plip-input')
+        data = {'labels': "test, labels", 'expected_label': "test"}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(url, {**data, 'image': self.test_image}, format='multipart')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        # The same patch with the same ordered labels is persisted straight from the cached prediction
+        with mock.patch('image_classifier.services.ingest.get_stored_embedding') as get_stored_embedding, \
+                mock.patch('image_classifier.services.batching.get_scheduler') as get_scheduler:
+            second = self.client.post(url, {**data, 'image': self.generate_test_image()}, format='multipart')
+            get_stored_embedding.assert_not_called()
+            get_scheduler.assert_not_called()
+
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.json()['image']['id'], first.json()['image']['id'])
+        self.assertEqual(second.json()['submission_scores'], [
+            {**score, 'id': mock.ANY} for score in first.json()['submission_scores']])
+
+    def test_plipreclassify(self):
+        self.client.force_login(user=self.contrib_user)
+        response = self.client.post(reverse('plip-input'), {'labels': "test, labels", 'image': self.test_image,
+                                                            'expected_label': "test"}, format='multipart')
+        submission_id = response.json()['id']
+
+        with mock.patch('image_classifier.services.batching.get_scheduler') as get_scheduler:
+            response = self.client.post(reverse('plip-reclassify'),
+                                        {'submission': submission_id, 'labels': "tumor, stroma, mucus"})
+            get_scheduler.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['expected_label'], "test")
+        self.assertEqual({score['label'] for score in response.json()['submission_scores']},
+                         {"tumor", "stroma", "mucus"})
+        self.assertTrue(response.json()['image']['thumbnail_url'].startswith('https://'))
+        self.assertEqual(PLIPSubmission.objects.count(), 2)
+
+    def test_plipreclassify_never_stores_thumbnail_embedding(self):
+        self.client.force_login(user=self.contrib_user)
+        response = self.client.post(reverse('plip-input'), {'labels': "test, labels", 'image': self.test_image,
+                                                            'expected_label': "test"}, format='multipart')
+        PLIPImageEmbedding.objects.all().delete()
+
+        response = self.client.post(reverse('plip-reclassify'),
+                                    {'submission': response.json()['id'], 'labels': "tumor, stroma"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(PLIPImageEmbedding.objects.exists())
+
+        # A full resolution upload of the same image then stores the canonical embedding
+        response = self.client.post(reverse('plip-input'), {'labels': "other, labels",
+                                                            'image': self.generate_test_image(),
+                                                            'expected_label': "test"}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(PLIPImageEmbedding.objects.count(), 1)
+
+    def test_plipthumbnail(self):
+        self.client.force_login(user=self.contrib_user)
+        response = self.client.post(reverse('plip-input'), {'labels': "test, labels", 'image': self.test_image,
+                                                            'expected_label': "test"}, format='multipart')
+        image = PLIPImage.objects.get(id=response.json()['image']['id'])
+        self.assertEqual(bytes(image.blob_image), b'')
+        url = reverse('plip-thumbnail', kwargs={'md5': image.md5})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(b''.join(response.streaming_content), image.thumbnail)
+        self.assertEqual(response['ETag'], f'"{image.md5}"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{image.md5}"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with override_settings(PLIP_THUMBNAIL_ACCEL_PREFIX='/protected/thumbnails/'):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         f'/protected/thumbnails/{image.md5[:2]}/{image.md5[2:4]}/{image.md5}.jpg')
+        self.assertEqual(response.content, b'')
+
+        self.assertEqual(self.client.get(reverse('plip-thumbnail', kwargs={'md5': '0' * 32})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.client.logout()
+        self.assertIn(self.client.get(url).status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_move_thumbnails_command(self):
+        self.client.force_login(user=self.user)
+        thumbnail_buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), 'green').save(thumbnail_buffer, 'jpeg')
+        image = PLIPImage.objects.create(md5='a' * 32, blob_image=thumbnail_buffer.getvalue())
+
+        # Images stored before the thumbnail store are served from their blob until moved
+        response = self.client.get(reverse('plip-thumbnail', kwargs={'md5': image.md5}))
+        self.assertEqual(response.content, thumbnail_buffer.getvalue())
+
+        call_command('move_thumbnails', chunk_size=1, stdout=io.StringIO())
+
+        image.refresh_from_db()
+        self.assertEqual(bytes(image.blob_image), b'')
+        self.assertEqual(image.thumbnail, thumbnail_buffer.getvalue())
+        response = self.client.get(reverse('plip-thumbnail', kwargs={'md5': image.md5}))
+        self.assertEqual(b''.join(response.streaming_content), thumbnail_buffer.getvalue())
+
+    def test_plipsimilar(self):
+        self.client.force_login(user=self.contrib_user)
+        submission_ids = []
+        for color in ('white', 'black', 'red'):
+            file = io.BytesIO()
+            Image.new('RGB', (100, 100), color).save(file, 'png')
+            upload = SimpleUploadedFile(f'{color}.png', file.getvalue(), content_type='image/png')
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('plip-input'), {'labels': "test, labels", 'image': upload,
+                                                                    'expected_label': "test"}, format='multipart')
+            submission_ids.append(response.json()['id'])
+
+        # Appended as each embedding committed; the rebuild also trains a one-list IVF index
+        output = io.StringIO()
+        call_command('build_similarity_index', nlist=1, stdout=output)
+        self.assertIn('3 rows', output.getvalue())
+
+        self.client.force_login(user=self.user)
+        for method in ('exact', 'ivf'):
+            response = self.client.post(reverse('plip-similar'),
+                                        {'submission': submission_ids[0], 'k': 5, 'method': method})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results = response.json()['results']
+            # The query image itself is excluded
+            self.assertEqual(len(results), 2)
+            self.assertIn(results[0]['latest_submission'], submission_ids[1:])
+            self.assertGreaterEqual(results[0]['similarity'], results[1]['similarity'])
+
+        response = self.client.post(reverse('plip-similar'), {'image': self.generate_test_image(), 'k': 1},
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 1)
+
+        response = self.client.post(reverse('plip-similar'), {'k': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pliptextsearch(self):
+        self.client.force_login(user=self.contrib_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.client.post(reverse('plip-input'), {'labels': "test, labels", 'image': self.test_image,
+                                                                'expected_label': "test"}, format='multipart')
+
+        self.client.force_login(user=self.user)
+        response = self.client.post(reverse('plip-text-search'), {'query': "tumor budding at invasive front"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(response.json()['results'][0]['submission']['id'], created.json()['id'])
+        self.assertIn('similarity', response.json()['results'][0])
+
+    def test_rescore_archive_command(self):
+        self.client.force_login(user=self.contrib_user)
+        for color in ('white', 'black'):
+            file = io.BytesIO()
+            Image.new('RGB', (100, 100), color).save(file, 'png')
+            self.client.post(reverse('plip-input'), {'labels': "test, labels", 'expected_label': "test",
+                                                     'image': SimpleUploadedFile(f'{color}.png', file.getvalue())},
+                             format='multipart')
+        # One image has lost its embedding and is scored from its thumbnail, which is not stored in its place
+        PLIPImageEmbedding.objects.first().delete()
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            checkpoint = f'{checkpoint_dir}/rescore.json'
+            output = io.StringIO()
+            call_command('rescore_archive', labels="tumor, stroma", checkpoint=checkpoint, chunk_size=1,
+                         stdout=output)
+            self.assertIn("1 reused, 1 embedded", output.getvalue())
+
+            rescored = PLIPSubmission.objects.order_by('-id')[:2]
+            for submission in rescored:
+                self.assertEqual(submission.expected_label.label, "test")
+                self.assertEqual({score.label.label for score in submission.submission_scores.all()},
+                                 {"tumor", "stroma"})
+            self.assertEqual(PLIPImageEmbedding.objects.count(), 1)
+
+            # Rescored submissions are counted as predictions of their own, as a rebuild would count them
+            tables = {PLIPConfusionCount: ('day', 'expected_label', 'predicted_label'),
+                      PLIPConfidenceCount: ('day', 'predicted_label', 'bin', 'outcome')}
+            counts = {model: sorted(model.objects.values_list(*fields, 'count')) for model, fields in tables.items()}
+            self.assertEqual(sum(count[-1] for count in counts[PLIPConfusionCount]), 4)
+            rebuild_analytics()
+            for model, fields in tables.items():
+                self.assertEqual(sorted(model.objects.values_list(*fields, 'count')), counts[model])
+
+            # A rerun resumes after the last checkpointed image and has nothing left to do
+            call_command('rescore_archive', labels="tumor, stroma", checkpoint=checkpoint, stdout=io.StringIO())
+            self.assertEqual(PLIPSubmission.objects.count(), 4)
+
+            # Losing the checkpoint after a chunk committed, as a crash in between would, does not rescore twice
+            output = io.StringIO()
+            call_command('rescore_archive', labels="tumor, stroma", checkpoint=checkpoint, restart=True,
+                         stdout=output)
+            self.assertIn("2 already done", output.getvalue())
+            self.assertEqual(PLIPSubmission.objects.count(), 4)
+
+    def test_plipbatch_files_and_archive(self):
+        self.client.force_login(user=self.contrib_user)
+
+        archive_buffer = io.BytesIO()
+        with zipfile.ZipFile(archive_buffer, 'w') as archive:
+            red_buffer = io.BytesIO()
+            Image.new('RGB', (64, 64), 'red').save(red_buffer, 'png')
+            archive.writestr('patches/red.png', red_buffer.getvalue())
+            archive.writestr('patches/notes.txt', 'not an image')
+        archive_upload = SimpleUploadedFile('patches.zip', archive_buffer.getvalue(), content_type='application/zip')
+        broken_upload = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+
+        data = {
+            'labels': "test, labels",
+            'images': [self.test_image, broken_upload],
+            'archive': archive_upload,
+            'expected_label': "test"
+        }
+
+        response = self.client.post(reverse('plip-batch'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        results = response.json()['results']
+        self.assertEqual([result['filename'] for result in results], ['image.jpg', 'broken.jpg', 'red.png'])
+        self.assertIn('submission', results[0])
+        self.assertIn('error', results[1])
+        self.assertEqual(len(results[2]['submission']['submission_scores']), 2)
+        self.assertEqual(PLIPSubmission.objects.count(), 2)
+
+    def test_plipjobs_queue_and_worker(self):
+        self.client.force_login(user=self.contrib_user)
+
+        data = {'image': self.test_image, 'labels': "test, labels", 'expected_label': "test"}
+        response = self.client.post(reverse('plip-job-create'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = response.json()
+        self.assertEqual(job['status'], PLIPJob.QUEUED)
+        self.assertIsNone(job['submission'])
+        self.assertEqual(response['Location'], job['status_url'])
+
+        call_command('run_plip_worker', once=True, stdout=io.StringIO())
+
+        response = self.client.get(reverse('plip-job-status', kwargs={'pk': job['id']}), {'wait': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], PLIPJob.DONE)
+        self.assertEqual(len(response.json()['submission']['submission_scores']), 2)
+        self.assertTrue(response.json()['submission']['image']['thumbnail_url'].startswith('https://'))
+        self.assertEqual(bytes(PLIPJob.objects.get(id=job['id']).upload), b'')
+
+        # Jobs are only visible to the user who queued them
+        self.client.force_login(user=self.user)
+        response = self.client.get(reverse('plip-job-status', kwargs={'pk': job['id']}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(PLIP_JOB_RETRY_SECONDS=0)
+    def test_plipjobs_retry_while_inference_server_busy(self):
+        self.client.force_login(user=self.contrib_user)
+        data = {'image': self.test_image, 'labels': "test, labels", 'expected_label': "test"}
+        job_id = self.client.post(reverse('plip-job-create'), data, format='multipart').json()['id']
+
+        # A busy server puts the job back in the queue until it has used all its attempts
+        with mock.patch('image_classifier.services.jobs.classify_files', side_effect=InferenceServerBusy("full")):
+            call_command('run_plip_worker', once=True, stdout=io.StringIO())
+        job = PLIPJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.attempts), (PLIPJob.FAILED, 3))
+        self.assertIn("full", job.error)
+
+        job_id = self.client.post(reverse('plip-job-create'), {**data, 'image': self.generate_test_image()},
+                                  format='multipart').json()['id']
+        with mock.patch('image_classifier.services.jobs.classify_files', side_effect=InferenceServerBusy("full")):
+            process_jobs(claim_jobs(1), None)
+        self.assertEqual(PLIPJob.objects.get(id=job_id).status, PLIPJob.QUEUED)
+
+        call_command('run_plip_worker', once=True, stdout=io.StringIO())
+        job = PLIPJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.attempts), (PLIPJob.DONE, 2))
+
+    @override_settings(PLIP_BATCH_MAX_MEMBER_BYTES=100)
+    def test_plipjobs_upload_size_limit(self):
+        self.client.force_login(user=self.contrib_user)
+        data = {'image': self.test_image, 'labels': "test, labels", 'expected_label': "test"}
+        response = self.client.post(reverse('plip-job-create'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PLIPJob.objects.exists())
+
+    @override_settings(PLIP_TILE_MAX_DECODE_PIXELS=200_000)
+    def test_pliptiled_reduced_decode(self):
+        self.client.force_login(user=self.contrib_user)
+
+        file = io.BytesIO()
+        Image.new('RGB', (1024, 768), 'white').save(file, 'jpeg')
+        large_image = SimpleUploadedFile('region.jpg', file.getvalue(), content_type='image/jpeg')
+
+        response = self.client.post(reverse('plip-tiled'), {'image': large_image, 'labels': "test, labels",
+                                                            'tile_size': 64}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # 1024x768 exceeds the pixel budget, so it is decoded at 1/2 scale into a 16x12 grid of 32px tiles that
+        # still cover 64 original pixels each
+        data = response.json()
+        self.assertEqual((data['tile_map']['scale'], data['tile_map']['columns'], data['tile_map']['rows']),
+                         (2, 16, 12))
+        self.assertEqual(data['tile_map']['resolution'], 0.5)
+        self.assertEqual(len(data['tiles']), 192)
+        self.assertEqual(max(tile['x'] for tile in data['tiles']), 960)
+        self.assertEqual(data['tiles'][0]['width'], 64)
+        self.assertEqual(set(data['legend']), {"test", "labels"})
+        self.assertEqual(PLIPTile.objects.filter(submission_id=data['submission']['id']).count(), 192)
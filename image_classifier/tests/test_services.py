@@ -0,0 +1,701 @@
+import hashlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from importlib.util import find_spec
+from unittest import mock, skipUnless
+
+import numpy as np
+import torch
+from PIL import Image
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from authentication.models import User
+from image_classifier.models import (PLIPConfidenceCount, PLIPConfusionCount, PLIPImage, PLIPImageEmbedding, PLIPLabel,
+                                     PLIPScore, PLIPSubmission)
+
+from image_classifier.services import inference_protocol as protocol
+from image_classifier.services.analytics import analytics_summary, rebuild_analytics, record_submissions
+from image_classifier.services.batch import classify_files
+from image_classifier.services.batching import BatchScheduler, embed_image
+from image_classifier.services.decode import decode_upload, to_pixel_values
+from image_classifier.services.embeddings import get_stored_embeddings, store_embeddings
+from image_classifier.services.export import SUBMISSION_COLUMNS, ExportError, export_columns, write_parquet
+from image_classifier.services.filters import compile_filter, FilterError
+from image_classifier.services.inference_client import InferenceServerBusy, RemotePLIPClassifier
+from image_classifier.services.inference_server import InferenceServer
+from image_classifier.services.plip import PLIPClassifier, DEFAULT_LABELS
+from image_classifier.services.registry import ModelRegistry, get_registry, write_manifest
+from image_classifier.services.tiling import NO_TILE, classify_tiles, open_for_tiling
+from image_classifier.services.vector_index import VectorStore
+
+
+class PLIPClassifierTests(SimpleTestCase):
+    def setUp(self):
+        self.classifier = get_registry().get()
+        self.image = Image.new('RGB', (100, 100), 'white')
+
+    def test_default_labels_cached_at_load(self):
+        for label in DEFAULT_LABELS:
+            self.assertIn((self.classifier.model_key, label), self.classifier._text_cache)
+
+    def test_search_queries_kept_out_of_label_cache(self):
+        query = "tumor budding at the invasive front"
+        embedding = self.classifier.embed_query(query)
+        self.assertNotIn((self.classifier.model_key, query), self.classifier._text_cache)
+        self.assertIn((self.classifier.model_key, query), self.classifier._query_cache)
+        np.testing.assert_allclose(embedding, self.classifier._encode_labels([query])[0], atol=1e-6)
+
+    def test_split_path_matches_full_forward(self):
+        labels = ["tumor", "stroma", "adipose"]
+        prediction = self.classifier.predict(self.image, candidate_labels=labels)
+
+        inputs = self.classifier._processor(text=labels, images=self.image, return_tensors="pt", padding=True)
+        with torch.no_grad():
+            outputs = self.classifier._model(**inputs)
+        expected = outputs.logits_per_image.softmax(dim=1).numpy()[0]
+
+        np.testing.assert_allclose([prediction['detailed_scores'][label] for label in labels], expected, atol=1e-5)
+        self.assertEqual(prediction['predicted_label'], labels[expected.argmax()])
+
+    def test_predict_batch_matches_predict(self):
+        labels = ["tumor", "stroma"]
+        images = [self.image, Image.new('RGB', (120, 80), 'red')]
+        batch_predictions = self.classifier.predict_batch(images, candidate_labels=labels)
+
+        for image, batch_prediction in zip(images, batch_predictions):
+            prediction = self.classifier.predict(image, candidate_labels=labels)
+            self.assertEqual(batch_prediction['predicted_label'], prediction['predicted_label'])
+            self.assertAlmostEqual(batch_prediction['confidence'], prediction['confidence'], places=5)
+
+    def test_text_cache_evicts_least_recently_used(self):
+        original_cache, original_size = self.classifier._text_cache, self.classifier._text_cache_size
+        self.classifier._text_cache, self.classifier._text_cache_size = OrderedDict(), 2
+        try:
+            self.classifier.embed_labels(["first label", "second label"])
+            self.classifier.embed_labels(["first label"])
+            self.classifier.embed_labels(["third label"])
+            cached_labels = [label for model_key, label in self.classifier._text_cache]
+            self.assertEqual(cached_labels, ["first label", "third label"])
+        finally:
+            self.classifier._text_cache, self.classifier._text_cache_size = original_cache, original_size
+
+    def test_reduced_precision_modes_track_fp32(self):
+        images = [self.image, Image.new('RGB', (120, 80), 'red')]
+        reference = self.classifier.embed_images(images)
+
+        for precision in ('bf16', 'int8'):
+            classifier = PLIPClassifier(precision=precision)
+            self.assertEqual(classifier.precision, precision)
+            embeddings = classifier.embed_images(images)
+            self.assertEqual(embeddings.dtype, np.float32)
+            np.testing.assert_allclose(np.sum(embeddings * reference, axis=1), 1, atol=0.05)
+
+        with self.assertRaises(ValueError):
+            PLIPClassifier(precision='fp8')
+
+
+class DecodeTests(SimpleTestCase):
+    def encode(self, size, format='JPEG'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'white').save(buffer, format)
+        return buffer.getvalue()
+
+    def test_large_jpeg_decodes_near_model_size(self):
+        image = decode_upload(self.encode((4000, 3000)))
+        self.assertEqual(image.mode, 'RGB')
+        self.assertTrue(224 <= min(image.size) < 448, image.size)
+
+        image = decode_upload(self.encode((3000, 2000), 'PNG'))
+        self.assertTrue(224 <= min(image.size) < 896, image.size)
+
+    def test_palette_bilevel_and_16_bit_pngs_decode_to_rgb(self):
+        palette = Image.new('RGB', (2000, 2000), (200, 30, 60)).quantize(colors=4)
+        for image in (palette, Image.new('1', (2000, 2000), 1), Image.new('I;16', (2000, 2000), 255)):
+            buffer = io.BytesIO()
+            image.save(buffer, 'PNG')
+            decoded = decode_upload(buffer.getvalue())
+            self.assertEqual(decoded.mode, 'RGB')
+            self.assertTrue(224 <= min(decoded.size) < 896, decoded.size)
+
+        self.assertEqual(decode_upload(buffer.getvalue()).getpixel((0, 0)), (255, 255, 255))
+        buffer = io.BytesIO()
+        palette.save(buffer, 'PNG')
+        self.assertEqual(decode_upload(buffer.getvalue()).getpixel((0, 0)), (200, 30, 60))
+
+    def test_oversized_header_rejected(self):
+        with self.assertRaises(ValueError):
+            decode_upload(self.encode((1000, 1000)), max_pixels=500_000)
+
+    def test_pixel_values_match_clip_processor(self):
+        rng = np.random.default_rng(0)
+        images = [Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+                  for width, height in ((100, 100), (640, 480), (225, 1000))]
+        expected = get_registry().get()._processor(images=images, return_tensors="np")['pixel_values']
+        np.testing.assert_allclose(to_pixel_values(images), expected, atol=1e-5)
+
+
+class DeploymentRoleTests(SimpleTestCase):
+    def test_browse_role_never_imports_torch(self):
+        # A fresh interpreter, since this test process has already imported torch
+        script = ("import sys, django; django.setup(); "
+                  "import digital_pathology_demo.wsgi, digital_pathology_demo.urls, image_classifier.admin; "
+                  "print(sorted(name for name in ('torch', 'transformers') if name in sys.modules))")
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'digital_pathology_demo.settings',
+               'PLIP_DEPLOYMENT_ROLE': 'browse'}
+        output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip().splitlines()[-1], '[]')
+
+
+class TilingTests(SimpleTestCase):
+    # Peak memory of tiling a 6000x6000 JPEG under a 1 MP decode budget, measured in a fresh interpreter
+    MEMORY_SCRIPT = '''
+import resource, sys
+import numpy as np
+from unittest import mock
+from image_classifier.services.tiling import classify_tiles, open_for_tiling
+
+classifier = mock.Mock(embed_images=lambda images: np.zeros((len(images), 4), dtype=np.float32))
+classifier.score_embeddings.side_effect = lambda embeddings, labels: [
+    {'predicted_label': 'tumor', 'confidence': 1.0, 'detailed_scores': {'tumor': 1.0}} for _ in embeddings]
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+with open(sys.argv[1], 'rb') as image_file:
+    image, scale = open_for_tiling(image_file, max_decode_pixels=1_000_000)
+    tiled = classify_tiles(image, scale, ['tumor'], classifier, tile_size=224)
+print(scale, len(tiled['tiles']), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+'''
+
+    def classifier(self, crop_sizes):
+        def embed_images(images):
+            crop_sizes.update(image.size for image in images)
+            return np.zeros((len(images), 4), dtype=np.float32)
+
+        classifier = mock.Mock(embed_images=embed_images)
+        classifier.score_embeddings.side_effect = lambda embeddings, labels: [
+            {'predicted_label': 'tumor', 'confidence': 1.0, 'detailed_scores': {'tumor': 1.0}} for _ in embeddings]
+        return classifier
+
+    def test_draft_decoded_tiles_cover_tile_size_original_pixels(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4000, 3000), 'white').save(buffer, 'jpeg')
+
+        image, scale = open_for_tiling(buffer, max_decode_pixels=1_000_000)
+        self.assertEqual((scale, image.size), (4, (1000, 750)))
+
+        crop_sizes = set()
+        tiled = classify_tiles(image, scale, ['tumor'], self.classifier(crop_sizes), tile_size=224)
+        # 56px decoded tiles: 18 columns, the last 48px wide, and 13 rows, the 22px remainder being dropped
+        self.assertEqual(tiled['grid'].shape, (14, 18))
+        self.assertEqual(len(tiled['tiles']), 18 * 13)
+        self.assertEqual(crop_sizes, {(56, 56), (48, 56)})
+        self.assertEqual(tiled['tiles'][0], {'x': 0, 'y': 0, 'width': 224, 'height': 224, 'label': 'tumor',
+                                             'score': 1.0})
+        self.assertEqual(max(tile['x'] + tile['width'] for tile in tiled['tiles']), 4000)
+
+    def test_large_jpeg_peak_memory_follows_decode_budget(self):
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            Image.new('RGB', (6000, 6000), 'white').save(image_file, 'jpeg')
+            image_file.flush()
+            output = subprocess.run([sys.executable, '-c', self.MEMORY_SCRIPT, image_file.name],
+                                    capture_output=True, text=True, check=True)
+
+        scale, tiles, peak_kib = map(int, output.stdout.split())
+        # 750x750 decoded pixels in 27 rows and columns of 28px tiles, the last 22px wide
+        self.assertEqual((scale, tiles), (8, 27 * 27))
+        # A full decode would need 108 MB for the raster alone
+        self.assertLess(peak_kib, 16 * 1024)
+
+    def test_label_sets_over_the_grid_range_rejected(self):
+        labels = [f'label {index}' for index in range(NO_TILE + 1)]
+        classifier = mock.Mock(embed_images=lambda images: np.zeros((len(images), 4), dtype=np.float32))
+        classifier.score_embeddings.side_effect = lambda embeddings, labels: [
+            {'predicted_label': labels[-1], 'confidence': 1.0, 'detailed_scores': dict.fromkeys(labels, 0.0)}
+            for _ in embeddings]
+        image = Image.new('RGB', (224, 224), 'white')
+
+        tiled = classify_tiles(image, 1, labels[:NO_TILE], classifier, tile_size=224)
+        self.assertEqual(tiled['grid'].tolist(), [[NO_TILE - 1]])
+
+        with self.assertRaises(ValueError):
+            classify_tiles(image, 1, labels, classifier, tile_size=224)
+        classifier.score_embeddings.assert_called_once()
+
+
+class BatchSchedulerTests(SimpleTestCase):
+    def test_concurrent_requests_share_batches(self):
+        batch_sizes = []
+        release = threading.Event()
+
+        def embed_fn(batch):
+            # Hold the first batch so the remaining requests queue up behind it
+            release.wait(timeout=5)
+            batch_sizes.append(len(batch))
+            return [value * 2 for value in batch]
+
+        scheduler = BatchScheduler(embed_fn, max_batch_size=4, max_wait_ms=50)
+
+        with ThreadPoolExecutor(max_workers=9) as executor:
+            futures = [executor.submit(scheduler.embed, value) for value in range(9)]
+            release.set()
+            results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(results, [value * 2 for value in range(9)])
+        self.assertEqual(sum(batch_sizes), 9)
+        self.assertLessEqual(max(batch_sizes), 4)
+        self.assertLess(len(batch_sizes), 9)
+
+    def test_errors_propagate_to_every_caller(self):
+        def embed_fn(batch):
+            raise RuntimeError("forward failed")
+
+        scheduler = BatchScheduler(embed_fn, max_batch_size=2, max_wait_ms=0)
+        with self.assertRaises(RuntimeError):
+            scheduler.embed(1, timeout=5)
+
+    def test_short_batches_fail_every_caller(self):
+        release = threading.Event()
+
+        def embed_fn(batch):
+            release.wait(timeout=5)
+            return [value * 2 for value in batch[:-1]]
+
+        scheduler = BatchScheduler(embed_fn, max_batch_size=4, max_wait_ms=50)
+        futures = [scheduler.submit(value) for value in range(4)]
+        release.set()
+
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result(timeout=5)
+
+
+class BatchClassifyTests(TestCase):
+    def test_files_are_read_one_chunk_at_a_time(self):
+        read = []
+
+        def files():
+            contents = []
+            for index in range(5):
+                read.append(index)
+                buffer = io.BytesIO()
+                Image.new('RGB', (32, 32), (index * 40, 0, 0)).save(buffer, 'png')
+                contents.append(buffer.getvalue())
+                yield f'{index}.png', contents[-1]
+            # A duplicate of an image decoded in an earlier chunk reuses its embedding
+            yield 'copy.png', contents[0]
+
+        forwards = []
+
+        def embed_images(images):
+            forwards.append((len(images), len(read)))
+            return np.eye(len(images), 4, dtype=np.float32)
+
+        classifier = mock.Mock(model_id='plip', model_revision='abc', precision='fp32', model_key='plip@abc:fp32',
+                               embed_images=embed_images)
+        classifier.score_embeddings.side_effect = lambda embeddings, labels: [
+            {'detailed_scores': {'tumor': 1.0}} for _ in embeddings]
+
+        results = classify_files(files(), ['tumor'], classifier, chunk_size=2)
+        self.assertEqual(forwards, [(2, 2), (2, 4), (1, 5)])
+        self.assertEqual([result['filename'] for result in results], ['0.png', '1.png', '2.png', '3.png', '4.png',
+                                                                       'copy.png'])
+        np.testing.assert_array_equal(results[-1]['embedding'], results[0]['embedding'])
+
+
+class ModelRegistryTests(SimpleTestCase):
+    class FakeClassifier:
+        def __init__(self, spec):
+            self.spec = spec
+            self.model_key = f"{spec['path']}@{spec.get('revision', 'main')}:fp32"
+
+        def memory_bytes(self):
+            return self.spec.get('mb', 1) * 1024 * 1024
+
+    def make_registry(self, models, **kwargs):
+        loads = []
+
+        def loader(spec):
+            loads.append(spec['path'])
+            return self.FakeClassifier(spec)
+
+        registry = ModelRegistry(models=models, default='a', loader=loader, **kwargs)
+        return registry, loads
+
+    def test_models_load_once_and_evict_least_recently_used(self):
+        models = {name: {'path': name, 'mb': 40} for name in ('a', 'b', 'c')}
+        registry, loads = self.make_registry(models, memory_budget_mb=100, idle_seconds=0, manifest_path='')
+
+        self.assertIs(registry.get(), registry.get('a'))
+        registry.get('b')
+        registry.get('a')
+        registry.get('c')
+        self.assertEqual(loads, ['a', 'b', 'c'])
+        self.assertEqual([entry['name'] for entry in registry.status() if entry['loaded']], ['a', 'c'])
+
+        registry.get('b')
+        self.assertEqual(loads, ['a', 'b', 'c', 'b'])
+        with self.assertRaises(ValueError):
+            registry.get('missing')
+
+    def test_manifest_change_swaps_model_without_downtime(self):
+        with tempfile.TemporaryDirectory() as manifest_dir:
+            manifest_path = os.path.join(manifest_dir, 'models.json')
+            registry, loads = self.make_registry({'a': {'path': 'a', 'revision': 'v1'}},
+                                                 manifest_path=manifest_path, poll_seconds=0)
+            old = registry.get()
+            self.assertEqual(old.model_key, 'a@v1:fp32')
+
+            write_manifest(manifest_path, {'default': 'a', 'models': {'a': {'path': 'a', 'revision': 'v2'}}})
+            # The old weights keep serving until the new ones are loaded, then every caller gets the new ones
+            registry.get()
+            for thread in threading.enumerate():
+                if thread.name == 'plip-model-swap-a':
+                    thread.join(timeout=5)
+
+            new = registry.get()
+            self.assertEqual(new.model_key, 'a@v2:fp32')
+            self.assertIsNot(new, old)
+            self.assertEqual(loads, ['a', 'a'])
+
+
+class VectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = VectorStore(self.directory.name)
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((8, 32)).astype(np.float32)
+        self.vectors = centers[rng.integers(0, 8, 2000)] + 0.3 * rng.standard_normal((2000, 32)).astype(np.float32)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_append_and_exact_search(self):
+        self.store.append(np.arange(1000), self.vectors[:1000])
+        self.store.append(np.arange(1000, 2000), self.vectors[1000:])
+        self.assertEqual(len(self.store), 2000)
+
+        results = self.store.search(self.vectors[42], k=5)
+        self.assertEqual(results[0][0], 42)
+        self.assertAlmostEqual(results[0][1], 1, places=2)
+        self.assertNotIn(42, [image_id for image_id, _ in self.store.search(self.vectors[42], k=5, exclude=[42])])
+
+    def test_ivf_index_matches_exact_and_covers_appended_rows(self):
+        stats = self.store.build([(np.arange(1500), self.vectors[:1500])], pca_dim=16, nlist=16)
+        self.assertEqual((stats['rows'], stats['dim'], stats['nlist']), (1500, 16, 16))
+        self.store.append(np.arange(1500, 2000), self.vectors[1500:])
+
+        recalls = []
+        for row in (3, 700, 1499, 1800):
+            exact = {image_id for image_id, _ in self.store.search(self.vectors[row], k=10, method='exact')}
+            approximate = self.store.search(self.vectors[row], k=10, method='ivf', nprobe=4)
+            self.assertEqual(approximate[0][0], row)
+            recalls.append(len(exact & {image_id for image_id, _ in approximate}) / 10)
+        self.assertGreaterEqual(np.mean(recalls), 0.8)
+        self.assertEqual(self.store.status()['unindexed_rows'], 500)
+
+    def test_unreduced_search_matches_exact_scan_of_source_vectors(self):
+        self.store.build([(np.arange(1500), self.vectors[:1500])], pca_dim=8, nlist=16)
+        self.store.append(np.arange(1500, 2000), self.vectors[1500:])
+
+        # Queries away from the image clusters, as text embeddings are, scored against the unreduced rows
+        normalized = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        for seed in range(5):
+            query = np.random.default_rng(100 + seed).standard_normal(32).astype(np.float32)
+            scores = normalized @ (query / np.linalg.norm(query))
+            expected = np.argsort(-scores)[:10]
+            results = self.store.search(query, k=10, method='ivf', unreduced=True)
+            self.assertEqual([image_id for image_id, _ in results][:5], expected[:5].tolist())
+            np.testing.assert_allclose([similarity for _, similarity in results], scores[expected], atol=2e-3)
+
+
+class FilterCompilerTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='filteruser', password='password123')
+        labels = {name: PLIPLabel.objects.create(label=name) for name in ('tumor', 'tumor budding', 'stroma')}
+        self.submissions = {}
+        for name, scores in (('tumor', {'tumor': 0.8, 'stroma': 0.1}), ('budding', {'tumor budding': 0.6}),
+                             ('mixed', {'tumor': 0.5, 'stroma': 0.5}), ('stroma', {'stroma': 0.9})):
+            top = max(scores, key=scores.get)
+            submission = PLIPSubmission.objects.create(
+                image=PLIPImage.objects.create(md5=hashlib.md5(name.encode()).hexdigest()), user=user,
+                filename=f'{name}.jpg', expected_label=labels['stroma'] if name == 'stroma' else None,
+                predicted_label=labels[top], predicted_score=scores[top])
+            for label, score in scores.items():
+                PLIPScore.objects.create(submission=submission, label=labels[label], score=score)
+            self.submissions[name] = submission.id
+
+    def matching(self, tree):
+        return {name for name, submission_id in self.submissions.items()
+                if PLIPSubmission.objects.filter(compile_filter(tree), id=submission_id).exists()}
+
+    def test_sql_shape(self):
+        tree = {'and': [{'or': [{'label': 'tumor', 'min': 0.4}, {'label': 'stroma', 'max': 0.2}]},
+                        {'not': {'label': 'stroma', 'min': 0.3}}]}
+        # Label texts are resolved in one query against the label table, before the submission query
+        with self.assertNumQueries(1):
+            q_filter = compile_filter(tree)
+
+        sql = str(PLIPSubmission.objects.filter(q_filter).query).upper()
+        self.assertEqual(sql.count('EXISTS'), 3)
+        self.assertIn('NOT (EXISTS', sql)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('LIKE', sql)
+
+        # A top prediction reads the submission's own columns
+        sql = str(PLIPSubmission.objects.filter(compile_filter({'top': 'tumor', 'min': 0.5})).query).upper()
+        self.assertNotIn('EXISTS', sql)
+        self.assertIn('PREDICTED_SCORE', sql)
+
+    def test_groups(self):
+        self.assertEqual(self.matching({'label': 'tumor', 'min': 0.55}), {'tumor', 'budding'})
+        self.assertEqual(self.matching({'and': [{'label': 'tumor', 'min': 0.4}, {'label': 'stroma', 'min': 0.4}]}),
+                         {'mixed'})
+        self.assertEqual(self.matching({'and': [{'label': 'tumor'}, {'not': {'label': 'stroma', 'min': 0.3}}]}),
+                         {'tumor', 'budding'})
+        self.assertEqual(self.matching({'or': [{'expected': 'STROMA'}, {'label': 'budding'}]}), {'stroma', 'budding'})
+        self.assertEqual(self.matching({'top': 'tumor', 'min': 0.55}), {'tumor', 'budding'})
+        self.assertEqual(self.matching({'top': 'stroma'}), {'stroma'})
+        self.assertEqual(self.matching({'not': {'top': 'tumor'}}), {'stroma'})
+        self.assertEqual(self.matching({'label': 'mucus'}), set())
+        self.assertEqual(self.matching({'not': {'label': 'mucus'}}), set(self.submissions))
+
+    def test_malformed(self):
+        for tree in ({'label': ''}, {'label': 'tumor', 'min': 'high'}, {'or': {'label': 'tumor'}},
+                     {'label': 'tumor', 'expected': 'tumor'}, {'xor': []}):
+            with self.assertRaises(FilterError):
+                compile_filter(tree)
+        with override_settings(PLIP_FILTER_MAX_PREDICATES=2), self.assertRaises(FilterError):
+            compile_filter({'or': [{'label': 'a'}, {'label': 'b'}, {'label': 'c'}]})
+
+
+@override_settings(PLIP_ANALYTICS_CACHE_SECONDS=0)
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='analyticsuser', password='password123')
+        self.tumor, self.stroma = PLIPLabel.objects.create(label='tumor'), PLIPLabel.objects.create(label='stroma')
+
+    def save(self, expected, predicted, score, count=1):
+        submissions = PLIPSubmission.objects.bulk_create([
+            PLIPSubmission(image=PLIPImage.objects.create(md5=hashlib.md5(os.urandom(8)).hexdigest()),
+                           user=self.user, filename='x.jpg', expected_label=expected, predicted_label=predicted,
+                           predicted_score=score) for _ in range(count)])
+        record_submissions(submissions)
+
+    def test_counts_and_summary(self):
+        self.save(self.tumor, self.tumor, 0.95, count=3)
+        self.save(self.tumor, self.stroma, 0.55)
+        self.save(self.stroma, self.stroma, 0.7, count=2)
+        self.save(None, self.tumor, 1.0)
+        self.save(self.stroma, None, None)
+
+        # Repeated keys are added to one row rather than inserted again
+        self.assertEqual(PLIPConfusionCount.objects.count(), 3)
+        self.assertEqual(PLIPConfusionCount.objects.get(expected_label=self.tumor, predicted_label=self.tumor).count, 3)
+
+        # Read from the summary tables only, however many submissions they cover
+        with self.assertNumQueries(2):
+            summary = analytics_summary(bucket='day')
+
+        self.assertEqual((summary['submissions'], summary['labelled']), (7, 6))
+        self.assertAlmostEqual(summary['accuracy'], 5 / 6)
+        labels = {row['label']: row for row in summary['labels']}
+        self.assertAlmostEqual(labels['tumor']['precision'], 1.0)
+        self.assertAlmostEqual(labels['tumor']['recall'], 3 / 4)
+        self.assertAlmostEqual(labels['stroma']['precision'], 2 / 3)
+        self.assertAlmostEqual(labels['stroma']['recall'], 1.0)
+
+        histogram, = summary['histograms']
+        self.assertEqual(histogram['counts'], [0, 0, 0, 0, 0, 1, 0, 2, 0, 4])
+        self.assertEqual(histogram['correct'], [0, 0, 0, 0, 0, 0, 0, 2, 0, 3])
+        self.assertEqual(histogram['incorrect'], [0, 0, 0, 0, 0, 1, 0, 0, 0, 0])
+
+        # Totals follow the label filter, and the overall totals and tables do not
+        stroma = analytics_summary(label='stroma')
+        self.assertEqual((stroma['submissions'], stroma['labelled'], stroma['overall_labelled']), (3, 3, 6))
+        self.assertAlmostEqual(stroma['accuracy'], 2 / 3)
+        self.assertAlmostEqual(stroma['overall_accuracy'], 5 / 6)
+        self.assertEqual(stroma['labels'], summary['labels'])
+        self.assertEqual(analytics_summary(label='tumor')['labelled'], 3)
+
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        self.assertEqual(analytics_summary(start=tomorrow)['submissions'], 0)
+
+        cache.clear()
+        with override_settings(PLIP_ANALYTICS_CACHE_SECONDS=60):
+            analytics_summary(bucket='month')
+            with self.assertNumQueries(0):
+                self.assertEqual(analytics_summary(bucket='month')['submissions'], 7)
+
+    def test_rebuild(self):
+        self.save(self.tumor, self.tumor, 0.95, count=2)
+        self.save(None, self.stroma, 0.4)
+        before = analytics_summary()
+
+        PLIPConfusionCount.objects.update(count=99)
+        PLIPConfidenceCount.objects.all().delete()
+        self.assertEqual(rebuild_analytics(chunk_size=2), 3)
+        self.assertEqual(analytics_summary(), before)
+
+    def test_rebuild_counts_uploads_committed_behind_the_scan(self):
+        self.save(self.tumor, self.tumor, 0.95, count=3)
+        first = PLIPSubmission.objects.order_by('id').first()
+        first_id, image = first.id, first.image
+        first.delete()
+
+        def commit_upload():
+            # An upload holding an id below the scanned ones commits while the rebuild waits for its lock
+            record_submissions([PLIPSubmission.objects.create(
+                id=first_id, image=image, user=self.user, filename='late.jpg', expected_label=self.stroma,
+                predicted_label=self.stroma, predicted_score=0.6)])
+
+        with mock.patch('image_classifier.services.analytics._lock_summary_tables', side_effect=commit_upload):
+            self.assertEqual(rebuild_analytics(chunk_size=2), 3)
+        summary = analytics_summary()
+        self.assertEqual((summary['submissions'], summary['labelled']), (3, 3))
+        self.assertEqual(PLIPConfusionCount.objects.get(expected_label=self.stroma).count, 1)
+
+
+class EmbeddingStoreTests(TestCase):
+    def test_only_inserted_embeddings_reach_the_vector_store(self):
+        classifier = mock.Mock(model_id='plip', model_revision='abc', precision='fp32', model_key='plip@abc:fp32')
+        first, second = (PLIPImage.objects.create(md5=f'{index:032x}') for index in range(2))
+        embeddings = np.eye(2, 4, dtype=np.float32)
+
+        with mock.patch('image_classifier.services.embeddings.append_embeddings') as append_embeddings:
+            with self.captureOnCommitCallbacks(execute=True):
+                store_embeddings([first.id], embeddings[:1], classifier)
+            # The first image is already stored, e.g. by a concurrent worker, so only the second is appended
+            with self.captureOnCommitCallbacks(execute=True):
+                store_embeddings([first.id, second.id], embeddings[::-1], classifier)
+
+        self.assertEqual([call.args[1] for call in append_embeddings.call_args_list], [[first.id], [second.id]])
+        np.testing.assert_array_equal(append_embeddings.call_args.args[2][0], embeddings[0])
+        self.assertEqual(PLIPImageEmbedding.objects.count(), 2)
+        stored = get_stored_embeddings([first.id, second.id], classifier)
+        np.testing.assert_array_equal(stored[first.id], embeddings[0])
+        np.testing.assert_array_equal(stored[second.id], embeddings[0])
+
+
+class ExportTests(SimpleTestCase):
+    def rows(self, count):
+        created_at = timezone.now()
+        return [{**dict.fromkeys(SUBMISSION_COLUMNS), 'submission_id': index, 'created_at': created_at,
+                 'md5': f'{index:032x}', 'label': 'tumor', 'score': index / count} for index in range(count)]
+
+    @skipUnless(find_spec('pyarrow'), "pyarrow is not installed")
+    def test_parquet_streams_row_groups(self):
+        import pyarrow.parquet
+
+        columns = export_columns('long')
+        chunks = list(write_parquet(iter(self.rows(5)), columns, row_group_size=2))
+        # Written as each row group fills rather than all at the end
+        self.assertGreater(len([chunk for chunk in chunks if chunk]), 2)
+
+        parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+        table = parquet_file.read()
+        self.assertEqual(table.column_names, columns)
+        self.assertEqual(table.column('submission_id').to_pylist(), [0, 1, 2, 3, 4])
+        self.assertEqual(table.column('score').to_pylist(), [0.0, 0.2, 0.4, 0.6, 0.8])
+
+    def test_parquet_without_pyarrow(self):
+        with mock.patch.dict(sys.modules, {'pyarrow': None, 'pyarrow.parquet': None}):
+            with self.assertRaises(ExportError):
+                write_parquet(iter(self.rows(1)), export_columns('long'))
+
+
+class InferenceServerTests(SimpleTestCase):
+    def setUp(self):
+        self.socket_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.socket_dir.name, 'inference.sock')
+        self.server = InferenceServer(self.socket_path, max_pending=2, queue_timeout=1)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        RemotePLIPClassifier._instances = {}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.socket_dir.cleanup()
+        RemotePLIPClassifier._instances = {}
+
+    def test_pack_round_trip(self):
+        arrays = [np.zeros((2, 3, 3), dtype=np.uint8), np.full((4, 1, 3), 7, dtype=np.uint8)]
+        unpacked = protocol.unpack_images(protocol.pack_images(arrays))
+        for original, result in zip(arrays, unpacked):
+            np.testing.assert_array_equal(original, result)
+
+        matrix = np.arange(6, dtype=np.float32).reshape(2, 3)
+        np.testing.assert_array_equal(protocol.unpack_matrix(protocol.pack_matrix(matrix)), matrix)
+
+    def test_remote_matches_local_classifier(self):
+        image = Image.new('RGB', (100, 100), 'white')
+        labels = ["tumor", "stroma"]
+
+        with override_settings(PLIP_INFERENCE_SOCKET=self.socket_path):
+            remote = RemotePLIPClassifier()
+            remote_prediction = remote.predict(image, candidate_labels=labels)
+            remote_query = remote.embed_query("tumor budding")
+            health = remote.health()
+
+        local = get_registry().get()
+        local_prediction = local.predict(image, candidate_labels=labels)
+        np.testing.assert_allclose(remote_query, local.embed_query("tumor budding"), atol=1e-5)
+        self.assertNotIn((local.model_key, "tumor budding"), local._text_cache)
+        for label in labels:
+            self.assertAlmostEqual(remote_prediction['detailed_scores'][label],
+                                   local_prediction['detailed_scores'][label], places=5)
+        self.assertEqual(health['status'], 'ok')
+        self.assertEqual(health['images'], 1)
+
+    def test_only_dropped_connections_are_retried(self):
+        with override_settings(PLIP_INFERENCE_SOCKET=self.socket_path):
+            remote = RemotePLIPClassifier()
+
+        # The server thread shares the protocol module, so only this thread's messages are counted or failed
+        client = threading.current_thread()
+        send_message, recv_message = protocol.send_message, protocol.recv_message
+        sent, failures = [], []
+
+        def send(sock, *args):
+            if threading.current_thread() is client:
+                sent.append(args[0])
+            return send_message(sock, *args)
+
+        def recv(sock):
+            if failures and threading.current_thread() is client:
+                raise failures.pop()
+            return recv_message(sock)
+
+        with mock.patch.object(protocol, 'send_message', side_effect=send), \
+                mock.patch.object(protocol, 'recv_message', side_effect=recv):
+            # A server restart resets the pooled connection, and the request is sent again on a new one
+            failures.append(ConnectionResetError())
+            self.assertEqual(remote.health()['status'], 'ok')
+            self.assertEqual(len(sent), 2)
+
+            # A slow server is reported busy at once rather than waited on twice
+            sent.clear()
+            failures.append(TimeoutError())
+            with self.assertRaises(InferenceServerBusy):
+                remote.health()
+            self.assertEqual(len(sent), 1)
+
+    def test_remote_classifier_bypasses_worker_batching(self):
+        image = Image.new('RGB', (100, 100), 'white')
+
+        with override_settings(PLIP_INFERENCE_SOCKET=self.socket_path), \
+                mock.patch('image_classifier.services.batching.get_scheduler') as get_scheduler:
+            embedding = embed_image(image, RemotePLIPClassifier())
+            get_scheduler.assert_not_called()
+
+        np.testing.assert_allclose(embedding, get_registry().get().embed_images([image])[0], atol=1e-5)
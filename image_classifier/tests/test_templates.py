@@ -1,11 +1,18 @@
+import hashlib
 import io
+import tempfile
+from unittest import mock
 from PIL import Image
 
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from authentication.models import User
+from image_classifier.models import PLIPImage, PLIPLabel, PLIPScore, PLIPSubmission
+from image_classifier.services.inference_client import InferenceServerBusy
+from image_classifier.services.labels import clear_label_cache
 
 
 class PLIPTemplateTests(TestCase):
@@ -22,6 +29,10 @@ class PLIPTemplateTests(TestCase):
         self.contrib_user = User.objects.create_user(username='plipcontribuser', password='password123',
                                                      is_contributor=True)
         self.test_image = self.generate_test_image()
+        thumbnail_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(thumbnail_dir.cleanup)
+        self.enterContext(override_settings(PLIP_THUMBNAIL_DIR=thumbnail_dir.name))
+        clear_label_cache()
 
     def test_template_plip(self):
         url = reverse('plip')
@@ -47,6 +58,28 @@ class PLIPTemplateTests(TestCase):
         response = self.client.post(url, data, format='multipart')
         self.assertContains(response, 'alt="Uploaded Image"')
 
+    @override_settings(PLIP_MAX_IMAGE_PIXELS=5000)
+    def test_template_plip_form_oversized(self):
+        self.client.force_login(self.contrib_user)
+
+        data = {'labels': "test, labels", 'image': self.test_image, 'expected_label': "test"}
+        response = self.client.post(reverse('plip'), data, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'pixel limit')
+        self.assertNotContains(response, 'alt="Uploaded Image"')
+        self.assertEqual(PLIPSubmission.objects.count(), 0)
+
+    def test_template_plip_form_inference_server_busy(self):
+        self.client.force_login(self.contrib_user)
+
+        data = {'labels': "test, labels", 'image': self.test_image, 'expected_label': "test"}
+        with mock.patch('image_classifier.template_views.get_classifier',
+                        side_effect=InferenceServerBusy("Inference queue is full")):
+            response = self.client.post(reverse('plip'), data, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Inference queue is full')
+        self.assertEqual(PLIPSubmission.objects.count(), 0)
+
     def test_contrib_template_plip(self):
         # user without is_contributor should fail
         url = reverse('plip')
@@ -76,3 +109,84 @@ class PLIPTemplateTests(TestCase):
         self.assertContains(response, 'name="csrfmiddlewaretoken"')
         self.assertContains(response, 'name="label_0"')
         self.assertContains(response, '<th>Image</th>')
+
+    def test_template_plip_data_browser_infinite_scroll(self):
+        self.client.force_login(self.user)
+        PLIPSubmission.objects.bulk_create([
+            PLIPSubmission(image=PLIPImage.objects.create(md5=f'{index:032x}'), user=self.user, filename='x.jpg')
+            for index in range(15)
+        ])
+
+        response = self.client.get(reverse('plip_data'))
+        self.assertContains(response, 'alt="Uploaded Image"', count=10)
+        self.assertContains(response, 'hx-trigger="revealed"')
+        next_cursor = response.context['next_cursor']
+
+        response = self.client.get(reverse('plip_data'), {'cursor': next_cursor}, HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, '_result_rows.html')
+        self.assertNotContains(response, '<table')
+        self.assertContains(response, 'alt="Uploaded Image"', count=5)
+        self.assertNotContains(response, 'hx-trigger="revealed"')
+
+    def test_template_plip_data_browser_thumbnail_src(self):
+        self.client.force_login(self.user)
+        md5_checksum = hashlib.md5(b'thumbnail').hexdigest()
+        PLIPSubmission.objects.create(image=PLIPImage.objects.create(md5=md5_checksum), user=self.user,
+                                      filename='x.jpg')
+
+        # Rows link the cacheable thumbnail endpoint rather than inlining the image
+        for headers in ({}, {'HTTP_HX_REQUEST': 'true'}):
+            response = self.client.get(reverse('plip_data'), **headers)
+            self.assertContains(response, f'<img src="/api/v1/thumbnails/{md5_checksum}/"', count=1)
+            self.assertNotContains(response, 'base64')
+
+    def test_template_plip_data_browser_label_rows(self):
+        self.client.force_login(self.user)
+        tumor, stroma = PLIPLabel.objects.create(label='tumor'), PLIPLabel.objects.create(label='stroma')
+        for name, score in (('tumor', 0.9), ('mixed', 0.5)):
+            image = PLIPImage.objects.create(md5=hashlib.md5(name.encode()).hexdigest())
+            submission = PLIPSubmission.objects.create(image=image, user=self.user, filename=f'{name}.jpg')
+            PLIPScore.objects.create(submission=submission, label=tumor, score=score)
+            PLIPScore.objects.create(submission=submission, label=stroma, score=1 - score)
+
+        # More rows than the old cap of five, one of them excluding
+        params = {f'label_{index}': 'mucus' for index in range(6)}
+        params.update(label_6='tumor', min_6='0.4', label_7='stroma', min_7='0.3', exclude_7='1', match='any')
+        response = self.client.get(reverse('plip_data'), params, HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'alt="Uploaded Image"', count=2)
+
+        response = self.client.get(reverse('plip_data'), {'label_0': 'tumor', 'min_0': '0.4', 'label_1': 'stroma',
+                                                          'min_1': '0.3', 'exclude_1': '1', 'match': 'all'},
+                                   HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'alt="Uploaded Image"', count=1)
+
+        response = self.client.get(reverse('plip_data'), {'label_0': 'tumor', 'min_0': 'high'}, HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'min must be a number')
+
+    def test_template_plip_analytics(self):
+        cache.clear()
+        self.client.force_login(self.contrib_user)
+        self.client.post(reverse('plip'), {'labels': "test, labels", 'image': self.test_image,
+                                           'expected_label': "test"}, format='multipart')
+
+        response = self.client.get(reverse('plip_analytics'), {'bucket': 'day', 'start': 'not a date'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'plip_analytics.html')
+        self.assertContains(response, 'Confusion matrix')
+        self.assertContains(response, '1 of 1 submission\n')
+        self.assertContains(response, '<progress value="1"', count=1)
+
+    def test_template_plip_data_browser_text_search(self):
+        self.client.force_login(self.contrib_user)
+        with tempfile.TemporaryDirectory() as vector_dir, override_settings(PLIP_VECTOR_DIR=vector_dir):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('plip'), {'labels': "test, labels", 'image': self.test_image,
+                                                   'expected_label': "test"}, format='multipart')
+
+            response = self.client.get(reverse('plip_data'), {'q': "tumor budding at invasive front"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<th>Similarity</th>')
+        self.assertContains(response, 'alt="Uploaded Image"', count=1)
+        submission = PLIPSubmission.objects.select_related('image').get()
+        self.assertContains(response, f'src="{submission.image.thumbnail_url}"')
+        self.assertNotContains(response, 'base64')